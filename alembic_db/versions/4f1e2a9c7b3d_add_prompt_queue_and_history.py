@@ -0,0 +1,67 @@
+"""Add prompt queue and history
+
+Revision ID: 4f1e2a9c7b3d
+Revises:
+Create Date: 2025-09-01 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1e2a9c7b3d'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'prompt_queue',
+        sa.Column('prompt_id', sa.String(), nullable=False),
+        sa.Column('number', sa.Float(), nullable=False),
+        sa.Column('client', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('prompt', sa.JSON(), nullable=False),
+        sa.Column('extra_data', sa.JSON(), nullable=False),
+        sa.Column('outputs_to_execute', sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint('prompt_id')
+    )
+    op.create_index(op.f('ix_prompt_queue_client'), 'prompt_queue', ['client'], unique=False)
+    op.create_index(op.f('ix_prompt_queue_status'), 'prompt_queue', ['status'], unique=False)
+    op.create_index(op.f('ix_prompt_queue_created_at'), 'prompt_queue', ['created_at'], unique=False)
+
+    op.create_table(
+        'prompt_history',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('prompt_id', sa.String(), nullable=False),
+        sa.Column('client', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=False),
+        sa.Column('entry', sa.JSON(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_prompt_history_prompt_id'), 'prompt_history', ['prompt_id'], unique=True)
+    op.create_index(op.f('ix_prompt_history_client'), 'prompt_history', ['client'], unique=False)
+    op.create_index(op.f('ix_prompt_history_status'), 'prompt_history', ['status'], unique=False)
+    op.create_index(op.f('ix_prompt_history_completed_at'), 'prompt_history', ['completed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_prompt_history_completed_at'), table_name='prompt_history')
+    op.drop_index(op.f('ix_prompt_history_status'), table_name='prompt_history')
+    op.drop_index(op.f('ix_prompt_history_client'), table_name='prompt_history')
+    op.drop_index(op.f('ix_prompt_history_prompt_id'), table_name='prompt_history')
+    op.drop_table('prompt_history')
+
+    op.drop_index(op.f('ix_prompt_queue_created_at'), table_name='prompt_queue')
+    op.drop_index(op.f('ix_prompt_queue_status'), table_name='prompt_queue')
+    op.drop_index(op.f('ix_prompt_queue_client'), table_name='prompt_queue')
+    op.drop_table('prompt_queue')
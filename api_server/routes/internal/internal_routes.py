@@ -2,6 +2,7 @@ from aiohttp import web
 from typing import Optional
 from folder_paths import folder_names_and_paths, get_directory_by_type
 from api_server.services.terminal_service import TerminalService
+from comfy_execution.profiler import to_chrome_trace
 import app.logger
 import os
 
@@ -64,6 +65,41 @@ class InternalRoutes:
             )
             return web.json_response([entry.name for entry in sorted_files], status=200)
 
+        @self.routes.get('/profile/{prompt_id}')
+        async def get_profile(request: web.Request) -> web.Response:
+            prompt_id = request.match_info['prompt_id']
+            history = await self.prompt_server.read_history(self.prompt_server.prompt_queue.get_history, prompt_id=prompt_id, map_function=lambda h: h.get("profile", None))
+            profile = history.get(prompt_id, None)
+            if profile is None:
+                return web.json_response({"error": "No profile recorded for this prompt"}, status=404)
+            if request.rel_url.query.get("format", "json") == "trace":
+                return web.json_response(to_chrome_trace(profile), headers={
+                    "Content-Disposition": f'attachment; filename="{prompt_id}.trace.json"'
+                })
+            return web.json_response(profile)
+
+        @self.routes.get('/scheduler')
+        async def get_scheduler_stats(request):
+            stats = self.prompt_server.prompt_queue.get_scheduler_stats()
+            if stats is None:
+                return web.json_response({"error": "Model affinity scheduling is disabled"}, status=404)
+            return web.json_response(stats)
+
+        @self.routes.get('/admission')
+        async def get_admission_stats(request):
+            queue = self.prompt_server.prompt_queue
+            return web.json_response({
+                "queue_depth": queue.get_queue_depth(),
+                "queued_bytes": queue.get_queued_bytes(),
+                "average_execution_time": queue.get_average_execution_time(),
+                "rejected": self.prompt_server.admission.get_stats(),
+            })
+
+        @self.routes.get('/loop_lag')
+        async def get_loop_lag(request):
+            # Seconds the event loop woke up late, for every measurement of the last minute
+            return web.json_response({"samples": list(self.prompt_server.loop_lag)})
+
 
     def get_app(self):
         if self._app is None:
@@ -0,0 +1,281 @@
+"""
+Coordinator mode, see --coordinator-backends.
+
+A coordinator accepts prompts like any ComfyUI server, but instead of executing them it
+queues each one on one of its backends, other ComfyUI instances, through their regular HTTP
+and websocket API. A prompt goes to the backend where it's expected to start first: the one
+with the fewest queued prompts, counting every model file the prompt uses that wasn't used
+by the last prompt sent to that backend as MODEL_SWAP_COST more prompts.
+
+The coordinator is connected to the websocket of every backend and forwards the messages
+about a prompt (progress, previews, executed...) to the client that queued it. Previews
+are requested with their metadata, the prompt_id in it tells which client they belong to.
+/queue, /history and /interrupt are answered from the backends. To try it on one machine:
+
+    python main.py --port 8189
+    python main.py --port 8190
+    python main.py --port 8188 --coordinator-backends http://127.0.0.1:8189 http://127.0.0.1:8190
+"""
+import asyncio
+import json
+import logging
+import struct
+import uuid
+
+import aiohttp
+
+from comfy_api import feature_flags
+from comfy_execution.scheduling import get_prompt_models
+from protocol import BinaryEventTypes
+
+# A model file that isn't loaded on a backend delays a prompt about as much as this many
+# prompts queued before it
+MODEL_SWAP_COST = 1.0
+# Seconds between attempts to connect to a backend
+RECONNECT_INTERVAL = 5.0
+# Seconds to wait for the response of a backend
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
+# The image type numbers of the PREVIEW_IMAGE message, for clients without preview metadata support
+LEGACY_PREVIEW_TYPES = {"image/jpeg": 1, "image/png": 2}
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        # The client id of the coordinator on this backend
+        self.client_id = uuid.uuid4().hex
+        self.connected = False
+        # Prompts queued or running on the backend, from its status messages
+        self.queue_remaining = 0
+        # Prompts sent by the coordinator that haven't finished
+        self.prompts = set()
+        # The model files of the last prompt sent to the backend, assumed to be loaded
+        self.last_models = frozenset()
+        # The prompt the backend is executing, binary messages without a prompt_id belong to it
+        self.executing = None
+
+    def get_depth(self):
+        return max(self.queue_remaining, len(self.prompts))
+
+
+def choose_backend(backends, models):
+    """Returns the connected backend where a prompt using models would start first, or None."""
+    best = None
+    best_score = None
+    for backend in backends:
+        if not backend.connected:
+            continue
+        score = backend.get_depth() + MODEL_SWAP_COST * len(models - backend.last_models)
+        if best_score is None or score < best_score:
+            best = backend
+            best_score = score
+    return best
+
+
+def get_completion_time(entry):
+    """The timestamp of the last status message of a history entry, 0 if it has none."""
+    status = entry.get("status", None) or {}
+    timestamps = [data.get("timestamp", 0) for _, data in status.get("messages", []) if isinstance(data, dict)]
+    return max(timestamps, default=0)
+
+
+def merge_histories(histories, max_items=None):
+    """Merges the histories of the backends, ordered by completion time like a single history."""
+    entries = {}
+    for history in histories:
+        entries.update(history)
+    ordered = sorted(entries.items(), key=lambda x: get_completion_time(x[1]))
+    if max_items is not None:
+        ordered = ordered[max(len(ordered) - max_items, 0):]
+    return dict(ordered)
+
+
+class Coordinator:
+    def __init__(self, server, urls):
+        self.server = server
+        self.backends = [Backend(url) for url in urls]
+        # The client that queued each prompt that hasn't finished
+        self.clients = {}
+        self.tasks = []
+
+    def start(self):
+        for backend in self.backends:
+            self.tasks.append(asyncio.create_task(self.connect(backend)))
+
+    def get_tasks_remaining(self):
+        return sum(backend.get_depth() for backend in self.backends)
+
+    async def connect(self, backend):
+        session = self.server.client_session
+        while True:
+            try:
+                async with session.ws_connect("{}/ws?clientId={}".format(backend.url, backend.client_id), heartbeat=30) as ws:
+                    await ws.send_json({"type": "feature_flags", "data": {"supports_preview_metadata": True}})
+                    await self.sync(backend)
+                    backend.connected = True
+                    logging.info("Connected to backend {}".format(backend.url))
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            await self.handle_message(backend, json.loads(msg.data))
+                        elif msg.type == aiohttp.WSMsgType.BINARY:
+                            await self.handle_binary(backend, msg.data)
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                if backend.connected:
+                    logging.warning("Lost connection to backend {}: {}".format(backend.url, e))
+            except Exception:
+                logging.exception("Error handling a message from backend {}".format(backend.url))
+            if backend.connected:
+                backend.connected = False
+                self.server.queue_updated()
+            await asyncio.sleep(RECONNECT_INTERVAL)
+
+    async def sync(self, backend):
+        """Forgets the prompts sent to backend that finished while it wasn't connected."""
+        queue = await self.request(backend, "GET", "/queue")
+        queued = set(x[1] for x in queue["queue_running"] + queue["queue_pending"])
+        for prompt_id in backend.prompts - queued:
+            self.prompt_done(backend, prompt_id)
+        backend.queue_remaining = len(queued)
+
+    def prompt_done(self, backend, prompt_id):
+        backend.prompts.discard(prompt_id)
+        self.clients.pop(prompt_id, None)
+        if backend.executing == prompt_id:
+            backend.executing = None
+
+    async def handle_message(self, backend, message):
+        event = message.get("type", None)
+        data = message.get("data", None)
+        if event == "status":
+            backend.queue_remaining = data["status"]["exec_info"]["queue_remaining"]
+            self.server.queue_updated()
+            return
+        if not isinstance(data, dict) or data.get("prompt_id", None) not in backend.prompts:
+            return
+        prompt_id = data["prompt_id"]
+        client_id = self.clients.get(prompt_id, None)
+        if event in ("execution_start", "executing"):
+            backend.executing = prompt_id
+        if client_id is not None:
+            await self.server.send_json(event, data, client_id)
+        if event == "executing" and data.get("node", None) is None:
+            self.prompt_done(backend, prompt_id)
+
+    async def handle_binary(self, backend, message):
+        event = struct.unpack(">I", message[:4])[0]
+        data = message[4:]
+        prompt_id = backend.executing
+        metadata = None
+        if event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA:
+            metadata_length = struct.unpack(">I", data[:4])[0]
+            metadata = json.loads(data[4:4 + metadata_length])
+            prompt_id = metadata.get("prompt_id", prompt_id)
+        if prompt_id not in backend.prompts:
+            return
+        client_id = self.clients.get(prompt_id, None)
+        if client_id is None:
+            return
+        if metadata is not None and not feature_flags.supports_feature(self.server.sockets_metadata, client_id, "supports_preview_metadata"):
+            image_type = LEGACY_PREVIEW_TYPES.get(metadata.get("image_type", None), None)
+            if image_type is None:
+                return
+            event = BinaryEventTypes.PREVIEW_IMAGE
+            data = struct.pack(">I", image_type) + data[4 + metadata_length:]
+        await self.server.send_bytes(event, data, client_id)
+
+    async def request(self, backend, method, path, data=None):
+        async with self.server.client_session.request(method, backend.url + path, json=data, timeout=REQUEST_TIMEOUT) as response:
+            if response.content_type == "application/json":
+                return await response.json()
+            return None
+
+    async def request_all(self, method, path, data=None):
+        """Sends a request to every connected backend and returns their responses."""
+        backends = [x for x in self.backends if x.connected]
+        results = await asyncio.gather(*[self.request(x, method, path, data) for x in backends], return_exceptions=True)
+        out = []
+        for backend, result in zip(backends, results):
+            if isinstance(result, Exception):
+                logging.warning("Request {} {} to backend {} failed: {}".format(method, path, backend.url, result))
+            else:
+                out.append(result)
+        return out
+
+    async def queue_prompt(self, prompt_id, prompt, extra_data, partial_execution_targets=None, front=False):
+        """Queues a prompt on the best backend. Returns (status, response) like POST /prompt."""
+        models = get_prompt_models(prompt)
+        client_id = extra_data.get("client_id", None)
+        data = {
+            "prompt": prompt,
+            "prompt_id": prompt_id,
+            "extra_data": {**extra_data, "client_id": None},
+            "front": front,
+        }
+        if partial_execution_targets is not None:
+            data["partial_execution_targets"] = partial_execution_targets
+        tried = set()
+        rejected = None
+        while True:
+            backend = choose_backend([x for x in self.backends if x not in tried], models)
+            if backend is None:
+                if rejected is not None:
+                    # Every backend refused the prompt, the client gets the last reason
+                    return rejected
+                error = {
+                    "type": "no_backend",
+                    "message": "No backend available",
+                    "details": "None of the backends of the coordinator is connected",
+                    "extra_info": {}
+                }
+                return 503, {"error": error, "node_errors": {}}
+            tried.add(backend)
+            data["extra_data"]["client_id"] = backend.client_id
+            # Registered first so that no message about the prompt is missed
+            backend.prompts.add(prompt_id)
+            if client_id is not None:
+                self.clients[prompt_id] = client_id
+            try:
+                async with self.server.client_session.post(backend.url + "/prompt", json=data, timeout=REQUEST_TIMEOUT) as response:
+                    status = response.status
+                    out = await response.json()
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as e:
+                logging.warning("Failed to queue prompt {} on backend {}: {}".format(prompt_id, backend.url, e))
+                self.prompt_done(backend, prompt_id)
+                continue
+            if status != 200:
+                # Rejected by this backend (queue full, rate limited, a missing model...),
+                # another one may accept it
+                logging.info("Backend {} rejected prompt {} with status {}".format(backend.url, prompt_id, status))
+                self.prompt_done(backend, prompt_id)
+                rejected = (status, out)
+                continue
+            backend.last_models = models
+            out["backend"] = backend.url
+            return status, out
+
+    async def get_queue(self):
+        """The running and pending prompts of all the backends, with the client ids of their clients."""
+        running = []
+        pending = []
+        for queue in await self.request_all("GET", "/queue"):
+            for items, out in ((queue["queue_running"], running), (queue["queue_pending"], pending)):
+                for item in items:
+                    if item[1] in self.clients:
+                        item[3]["client_id"] = self.clients[item[1]]
+                    out.append(item)
+        pending.sort(key=lambda x: x[0])
+        return {"queue_running": running, "queue_pending": pending}
+
+    async def get_history(self, prompt_id=None, max_items=None):
+        if prompt_id is not None:
+            return merge_histories(await self.request_all("GET", "/history/{}".format(prompt_id)))
+        path = "/history" if max_items is None else "/history?max_items={}".format(max_items)
+        return merge_histories(await self.request_all("GET", path), max_items)
+
+    async def interrupt(self, prompt_id=None):
+        """Interrupts prompt_id on the backend running it, or every backend if prompt_id is None."""
+        for backend in self.backends:
+            if backend.connected and (prompt_id is None or prompt_id in backend.prompts):
+                await self.request(backend, "POST", "/interrupt", {"prompt_id": prompt_id} if prompt_id is not None else {})
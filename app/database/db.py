@@ -14,7 +14,7 @@ try:
     from alembic.config import Config
     from alembic.runtime.migration import MigrationContext
     from alembic.script import ScriptDirectory
-    from sqlalchemy import create_engine
+    from sqlalchemy import create_engine, event
     from sqlalchemy.orm import sessionmaker
 
     _DB_AVAILABLE = True
@@ -75,6 +75,14 @@ def init_db():
 
     # Check if we need to upgrade
     engine = create_engine(db_url)
+    if db_url.startswith("sqlite:///"):
+        # WAL lets the history be read while the queue is written, and only syncs on checkpoints
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragma(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
     conn = engine.connect()
 
     context = MigrationContext.configure(conn)
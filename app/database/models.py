@@ -1,3 +1,4 @@
+from sqlalchemy import JSON, Column, DateTime, Float, Integer, String
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,4 +12,36 @@ def to_dict(obj):
         if (val := getattr(obj, field))
     }
 
-# TODO: Define models here
+
+class QueueItem(Base):
+    """A prompt that is queued or running, see --persistent-queue."""
+
+    __tablename__ = "prompt_queue"
+
+    prompt_id = Column(String, primary_key=True)
+    # Clients may queue prompts with fractional numbers, see load_number
+    number = Column(Float, nullable=False)
+    client = Column(String, index=True)
+    # "pending" or "running"
+    status = Column(String, nullable=False, index=True)
+    # Number of times the prompt was started
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, index=True)
+    prompt = Column(JSON, nullable=False)
+    extra_data = Column(JSON, nullable=False)
+    outputs_to_execute = Column(JSON, nullable=False)
+
+
+class HistoryItem(Base):
+    """The history entry of an executed prompt, see --persistent-queue."""
+
+    __tablename__ = "prompt_history"
+
+    # Increases with the completion order of prompts
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    prompt_id = Column(String, nullable=False, unique=True, index=True)
+    client = Column(String, index=True)
+    # "success" or "error", None when the prompt has no status
+    status = Column(String, index=True)
+    completed_at = Column(DateTime, nullable=False, index=True)
+    entry = Column(JSON, nullable=False)
@@ -0,0 +1,228 @@
+"""
+Durable prompt queue and history, see --persistent-queue.
+
+PromptQueue keeps working on its in-memory queue and history and records every change
+through a PromptStore. The changes are written by a background thread, batched into one
+transaction every WRITE_INTERVAL seconds, so executing prompts never waits on the disk.
+Queued and running prompts are restored from the database when the server starts.
+
+Reads never wait for the writer: history changes that aren't committed yet are kept in memory
+and applied over what's read from the database.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, true, update
+
+from app.database.models import HistoryItem, QueueItem
+
+# Time the writer waits for more changes to write them in the same transaction
+WRITE_INTERVAL = 0.1
+# A prompt that was running when the server stopped this many times isn't restarted again
+MAX_ATTEMPTS = 2
+
+
+def load_number(number):
+    """
+    Returns a stored prompt number as an int when it is one. The column is a float because
+    clients may queue prompts with fractional numbers.
+    """
+    if number is not None and number.is_integer():
+        return int(number)
+    return number
+
+
+class PromptStore:
+    def __init__(self, create_session, max_history_size):
+        self.create_session = create_session
+        self.max_history_size = max_history_size
+        self.cond = threading.Condition()
+        self.pending = []
+        self.enqueued = 0
+        self.written = 0
+        # History changes that aren't committed yet: prompt id -> (change number, entry), the
+        # entry is None for a deleted one. uncommitted_clear is the number of the last
+        # uncommitted deletion of the whole history, 0 if there is none.
+        self.uncommitted = {}
+        self.uncommitted_clear = 0
+        self.writer = threading.Thread(target=self._write_loop, daemon=True, name="prompt_store_writer")
+        self.writer.start()
+
+    def _write_loop(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+            time.sleep(WRITE_INTERVAL)
+            with self.cond:
+                changes, self.pending = self.pending, []
+                written = self.enqueued
+            try:
+                with self.create_session() as session:
+                    for change in changes:
+                        change(session)
+                    session.commit()
+            except Exception:
+                logging.exception("Failed to write {} prompt queue changes to the database".format(len(changes)))
+            with self.cond:
+                self.written = written
+                self.uncommitted = {k: v for k, v in self.uncommitted.items() if v[0] > written}
+                if self.uncommitted_clear <= written:
+                    self.uncommitted_clear = 0
+                self.cond.notify_all()
+
+    def _enqueue(self, change, history=None):
+        """history is (prompt id, entry) for a change of the history, see uncommitted."""
+        with self.cond:
+            self.pending.append(change)
+            self.enqueued += 1
+            if history is not None:
+                prompt_id, entry = history
+                if prompt_id is None:
+                    self.uncommitted = {}
+                    self.uncommitted_clear = self.enqueued
+                else:
+                    # Moved to the end, the newest entry
+                    self.uncommitted.pop(prompt_id, None)
+                    self.uncommitted[prompt_id] = (self.enqueued, entry)
+            self.cond.notify_all()
+
+    def _get_uncommitted(self):
+        with self.cond:
+            return self.uncommitted_clear > 0, {k: v[1] for k, v in self.uncommitted.items()}
+
+    def flush(self):
+        """Waits until every change recorded so far is written."""
+        with self.cond:
+            target = self.enqueued
+            while self.written < target:
+                self.cond.wait()
+
+    def add_queued(self, item, client):
+        number, prompt_id, prompt, extra_data, outputs_to_execute = item[:5]
+        created_at = datetime.now()
+
+        def change(session):
+            session.merge(QueueItem(prompt_id=prompt_id, number=number, client=client, status="pending", attempts=0,
+                                    created_at=created_at, prompt=prompt, extra_data=extra_data,
+                                    outputs_to_execute=list(outputs_to_execute) if outputs_to_execute is not None else None))
+        self._enqueue(change)
+
+    def set_running(self, prompt_id):
+        def change(session):
+            session.execute(update(QueueItem).where(QueueItem.prompt_id == prompt_id)
+                            .values(status="running", attempts=QueueItem.attempts + 1))
+        self._enqueue(change)
+
+    def remove_queued(self, prompt_ids=None):
+        """Removes the given prompts from the stored queue, or all of them."""
+        def change(session):
+            query = delete(QueueItem)
+            if prompt_ids is not None:
+                query = query.where(QueueItem.prompt_id.in_(prompt_ids))
+            session.execute(query)
+        self._enqueue(change)
+
+    def add_history(self, prompt_id, client, entry):
+        """Moves a prompt from the stored queue to the history."""
+        completed_at = datetime.now()
+        status = entry.get("status", None)
+        status_str = status.get("status_str", None) if status is not None else None
+
+        def change(session):
+            session.execute(delete(QueueItem).where(QueueItem.prompt_id == prompt_id))
+            session.execute(delete(HistoryItem).where(HistoryItem.prompt_id == prompt_id))
+            session.add(HistoryItem(prompt_id=prompt_id, client=client, status=status_str,
+                                    completed_at=completed_at, entry=entry))
+            session.flush()
+            last_id = session.scalar(select(func.max(HistoryItem.id)))
+            session.execute(delete(HistoryItem).where(HistoryItem.id <= last_id - self.max_history_size))
+        self._enqueue(change, history=(prompt_id, entry))
+
+    def delete_history(self, prompt_id=None):
+        """Deletes the history entry of a prompt, or the whole history."""
+        def change(session):
+            query = delete(HistoryItem)
+            if prompt_id is not None:
+                query = query.where(HistoryItem.prompt_id == prompt_id)
+            session.execute(query)
+        self._enqueue(change, history=(prompt_id, None))
+
+    def load_queue(self):
+        """
+        Returns the stored queue as (item, client) pairs. Prompts that were running when the
+        server stopped are queued again, unless they already were MAX_ATTEMPTS times.
+        """
+        self.flush()
+        items = []
+        with self.create_session() as session:
+            for row in session.scalars(select(QueueItem).order_by(QueueItem.number)):
+                if row.status == "running" and row.attempts >= MAX_ATTEMPTS:
+                    logging.warning("Not restarting prompt {}, it was interrupted {} times".format(row.prompt_id, row.attempts))
+                    session.delete(row)
+                    continue
+                items.append(((load_number(row.number), row.prompt_id, row.prompt, row.extra_data, row.outputs_to_execute), row.client))
+            session.execute(update(QueueItem).values(status="pending"))
+            session.commit()
+        return items
+
+    def get_history(self, prompt_id):
+        cleared, uncommitted = self._get_uncommitted()
+        if prompt_id in uncommitted:
+            added = [k for k, v in uncommitted.items() if v is not None]
+            if prompt_id in added[-self.max_history_size:]:
+                return uncommitted[prompt_id]
+            return None
+        if cleared:
+            return None
+        with self.create_session() as session:
+            return session.scalar(select(HistoryItem.entry).where(HistoryItem.prompt_id == prompt_id))
+
+    def get_history_page(self, max_items=None, offset=-1):
+        """
+        Returns {prompt_id: entry} for max_items entries starting at offset, oldest first. A
+        negative offset returns the newest max_items entries.
+        """
+        cleared, uncommitted = self._get_uncommitted()
+        # The uncommitted entries are the newest ones, they replace the rows of the same prompts
+        added = [(k, v) for k, v in uncommitted.items() if v is not None]
+        with self.create_session() as session:
+            condition = HistoryItem.prompt_id.not_in(list(uncommitted)) if len(uncommitted) > 0 else true()
+            stored = 0 if cleared else session.scalar(select(func.count()).select_from(HistoryItem).where(condition))
+            # Positions in the stored rows followed by the uncommitted entries, of which the
+            # oldest beyond max_history_size are about to be deleted
+            total = stored + len(added)
+            oldest = max(total - self.max_history_size, 0)
+            if offset < 0:
+                first = max(total - max_items, oldest) if max_items is not None else oldest
+            else:
+                first = oldest + offset
+            last = total if max_items is None else min(first + max_items, total)
+            rows = []
+            if first < min(last, stored):
+                query = select(HistoryItem.prompt_id, HistoryItem.entry).where(condition).order_by(HistoryItem.id)
+                rows = [tuple(x) for x in session.execute(query.offset(first).limit(min(last, stored) - first)).all()]
+        rows += added[max(first - stored, 0):max(last - stored, 0)]
+        return {prompt_id: entry for prompt_id, entry in rows}
+
+    def get_history_since(self, cursor, max_items=None):
+        """
+        Returns ({prompt_id: entry}, cursor) for the entries added after cursor, the id of a
+        history row, oldest first, and the cursor to pass to get the entries after them. The
+        entries that aren't committed yet have no id, they're returned once they are.
+        """
+        with self.create_session() as session:
+            query = select(HistoryItem.id, HistoryItem.prompt_id, HistoryItem.entry).where(HistoryItem.id > cursor).order_by(HistoryItem.id)
+            if max_items is not None:
+                query = query.limit(max_items)
+            rows = session.execute(query).all()
+        if len(rows) > 0:
+            cursor = rows[-1][0]
+        return {prompt_id: entry for _, prompt_id, entry in rows}, cursor
+
+    def get_max_number(self):
+        self.flush()
+        with self.create_session() as session:
+            return load_number(session.scalar(select(func.max(QueueItem.number))))
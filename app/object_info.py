@@ -0,0 +1,84 @@
+"""
+Precomputed /object_info response.
+
+The info of every node class is serialized to JSON once and kept with the class it was built
+for. It's only rebuilt for the classes that were registered, replaced or removed since the
+last request, or for every class once the model folders changed (see
+folder_paths.get_folder_version()). Classes with CACHE_INPUT_TYPES = False are rebuilt on
+every request. The response body, and its gzip and brotli encodings, are only rebuilt when a
+class's info actually changed.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import threading
+import traceback
+
+import folder_paths
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class ObjectInfoResponse:
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+        self.encodings = {"gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body, quality=5)
+
+    def get_body(self, accept_encoding):
+        """Returns (body, content encoding) for the Accept-Encoding header of a request."""
+        accepted = set(x.split(";")[0].strip() for x in accept_encoding.split(","))
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encodings:
+                return self.encodings[encoding], encoding
+        return self.body, None
+
+
+class ObjectInfoCache:
+    def __init__(self, node_info, node_classes):
+        self.node_info = node_info
+        # Node class name -> class (nodes.NODE_CLASS_MAPPINGS), read again on every request
+        self.node_classes = node_classes
+        self.lock = threading.Lock()
+        self.folder_version = None
+        # Node class name -> (class, serialized info)
+        self.entries = {}
+        self.response = None
+        self.rebuilt = 0
+
+    def build_entry(self, name, obj_class):
+        try:
+            return (obj_class, json.dumps(self.node_info(name)).encode("utf-8"))
+        except Exception:
+            logging.error(f"[ERROR] An error occurred while retrieving information for the '{name}' node.")
+            logging.error(traceback.format_exc())
+            return (obj_class, None)
+
+    def get(self):
+        """Returns the ObjectInfoResponse for the current node classes."""
+        with self.lock, folder_paths.cache_helper:
+            version = folder_paths.get_folder_version()
+            rebuild_all = version != self.folder_version
+            self.folder_version = version
+            changed = self.response is None or len(self.entries) != len(self.node_classes)
+            entries = {}
+            for name, obj_class in list(self.node_classes.items()):
+                entry = self.entries.get(name, None)
+                if entry is None or entry[0] is not obj_class or rebuild_all or not getattr(obj_class, "CACHE_INPUT_TYPES", True):
+                    new_entry = self.build_entry(name, obj_class)
+                    self.rebuilt += 1
+                    if entry is None or entry[1] != new_entry[1]:
+                        changed = True
+                    entry = new_entry
+                entries[name] = entry
+            self.entries = entries
+            if changed:
+                parts = [json.dumps(name).encode("utf-8") + b": " + info for name, (_, info) in entries.items() if info is not None]
+                self.response = ObjectInfoResponse(b"{" + b", ".join(parts) + b"}")
+            return self.response
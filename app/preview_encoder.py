@@ -0,0 +1,94 @@
+"""
+Encoding of the preview images sent to websocket clients.
+
+Previews are resized and encoded in a thread pool instead of on the event loop. At most one
+frame per client and format is encoded at a time: the frames that arrive in the meantime wait,
+and only the newest of them is encoded once the running encoding finishes, the older ones are
+superseded. Clients pick the format through the feature flags they send when they connect:
+"preview_format" ("jpeg", "png" or "webp", webp only for clients that support preview
+metadata since the legacy preview message can't describe it) and "preview_quality" (1-100).
+"""
+import asyncio
+import concurrent.futures
+import time
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+import comfy.metrics
+
+MAX_WORKERS = 2
+DEFAULT_QUALITY = 95
+PREVIEW_FORMATS = ("JPEG", "PNG", "WEBP")
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+PREVIEW_ENCODE_SECONDS = comfy.metrics.Histogram("comfyui_preview_encode_seconds", "Time spent resizing and encoding a preview image.", ["format"],
+                                                 buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PREVIEWS_SKIPPED = comfy.metrics.Counter("comfyui_previews_skipped_total", "Preview images that weren't encoded because a newer one superseded them (superseded) or no client was listening (no_client).", ["reason"])
+
+
+def get_preview_format(client_flags, image_type, with_metadata):
+    """Returns (format, quality) of the previews sent to a client with the feature flags client_flags."""
+    image_format = image_type
+    requested = client_flags.get("preview_format", None)
+    if isinstance(requested, str):
+        requested = requested.upper()
+        if requested in ("JPEG", "PNG") or (requested == "WEBP" and with_metadata):
+            image_format = requested
+    quality = client_flags.get("preview_quality", None)
+    if not isinstance(quality, int) or isinstance(quality, bool) or not 1 <= quality <= 100:
+        quality = DEFAULT_QUALITY
+    return image_format, quality
+
+
+def encode_preview(image, max_size, image_format, quality):
+    start = time.perf_counter()
+    if max_size is not None:
+        if hasattr(Image, 'Resampling'):
+            resampling = Image.Resampling.BILINEAR
+        else:
+            resampling = Image.BILINEAR
+
+        image = ImageOps.contain(image, (max_size, max_size), resampling)
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    if image_format == "WEBP":
+        image.save(buffer, format=image_format, quality=quality, method=0)
+    else:
+        image.save(buffer, format=image_format, quality=quality, compress_level=1)
+    PREVIEW_ENCODE_SECONDS.observe(time.perf_counter() - start, image_format)
+    return buffer.getvalue()
+
+
+class PreviewEncoder:
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        # Key -> the newest frame waiting to be encoded
+        self.latest = {}
+        # Key -> future of the running encoding
+        self.running = {}
+
+    async def encode(self, key, image, max_size, image_format, quality):
+        """
+        Returns the encoded image, or None if a frame with the same key was submitted before
+        its encoding started.
+        """
+        frame = object()
+        self.latest[key] = frame
+        while True:
+            running = self.running.get(key, None)
+            if running is None or running.done():
+                break
+            await asyncio.wait([running])
+        if self.latest.get(key, None) is not frame:
+            PREVIEWS_SKIPPED.inc("superseded")
+            return None
+        del self.latest[key]
+        future = asyncio.get_running_loop().run_in_executor(self.executor, encode_preview, image, max_size, image_format, quality)
+        self.running[key] = future
+        try:
+            return await future
+        finally:
+            if self.running.get(key, None) is future:
+                del self.running[key]
@@ -0,0 +1,204 @@
+"""
+Cache of the image variants served by /view (?preview=webp;90, ?channel=rgb|a).
+
+A variant is identified by the path, modification time and size of its source file and the
+parameters of the variant, so it's never served after the file changed. Encoded variants are
+kept in a bounded in-memory LRU and written to a directory on disk; they're encoded in a
+thread pool so the event loop isn't blocked, and concurrent requests for the same variant
+share a single encoding.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import logging
+import os
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+MAX_MEMORY_BYTES = 64 * 1024 * 1024
+MAX_DISK_BYTES = 1024 * 1024 * 1024
+MAX_WORKERS = 4
+
+
+def get_variant(query):
+    """Returns the variant requested by the query of a /view request, None for the file itself."""
+    channel = query.get('channel', '')
+    if 'preview' in query:
+        preview_info = query['preview'].split(';')
+        image_format = preview_info[0]
+        if image_format not in ['webp', 'jpeg'] or 'a' in channel:
+            image_format = 'webp'
+
+        quality = 90
+        if preview_info[-1].isdigit():
+            quality = int(preview_info[-1])
+        return ("preview", image_format, quality, image_format == 'jpeg' or channel == 'rgb')
+    if channel in ('rgb', 'a'):
+        return (channel,)
+    return None
+
+
+def get_content_type(variant):
+    if variant[0] == "preview":
+        return "image/{}".format(variant[1])
+    return "image/png"
+
+
+def encode_variant(file, variant):
+    """Returns the variant of the image file encoded."""
+    buffer = BytesIO()
+    with Image.open(file) as img:
+        if variant[0] == "preview":
+            _, image_format, quality, rgb = variant
+            if rgb:
+                img = img.convert("RGB")
+            img.save(buffer, format=image_format, quality=quality)
+        elif variant[0] == "rgb":
+            if img.mode == "RGBA":
+                r, g, b, a = img.split()
+                new_img = Image.merge('RGB', (r, g, b))
+            else:
+                new_img = img.convert("RGB")
+            new_img.save(buffer, format='PNG')
+        elif variant[0] == "a":
+            if img.mode == "RGBA":
+                _, _, _, a = img.split()
+            else:
+                a = Image.new('L', img.size, 255)
+
+            # alpha img
+            alpha_img = Image.new('RGBA', img.size)
+            alpha_img.putalpha(a)
+            alpha_img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def get_etag(file, stat, variant=None):
+    """A strong ETag for the variant of file (or file itself) as it is at stat."""
+    key = repr((os.path.abspath(file), stat.st_mtime_ns, stat.st_size, variant))
+    return '"{}"'.format(hashlib.sha256(key.encode("utf-8")).hexdigest()[:32])
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    tags = [x.strip() for x in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+class ViewCache:
+    def __init__(self, directory, max_memory_bytes=MAX_MEMORY_BYTES, max_disk_bytes=MAX_DISK_BYTES, max_workers=MAX_WORKERS):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="view_cache")
+        # ETag -> encoded variant, least recently used first
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        # Variants being loaded: ETag -> future
+        self.loading = {}
+        # Files in the directory, least recently used first: name -> size
+        self.lock = threading.Lock()
+        self.disk = collections.OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.disk[name] = size
+            self.disk_bytes += size
+
+    def get_path(self, etag):
+        return os.path.join(self.directory, etag.strip('"'))
+
+    async def get(self, file, stat, variant):
+        """Returns (data, ETag) of the variant of file."""
+        etag = get_etag(file, stat, variant)
+        data = self.memory.get(etag, None)
+        if data is not None:
+            self.memory.move_to_end(etag)
+            with self.lock:
+                self.hits += 1
+            return data, etag
+        future = self.loading.get(etag, None)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self.load, file, variant, etag)
+            self.loading[etag] = future
+            future.add_done_callback(functools.partial(self.loaded, etag))
+        # Shielded, a cancelled request doesn't cancel the load the other requests wait for
+        return await asyncio.shield(future), etag
+
+    def loaded(self, etag, future):
+        del self.loading[etag]
+        if future.cancelled() or future.exception() is not None:
+            return
+        data = future.result()
+        self.memory[etag] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes and len(self.memory) > 1:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def load(self, file, variant, etag):
+        """Reads the variant from the disk, or encodes it and writes it to the disk."""
+        name = etag.strip('"')
+        path = self.get_path(etag)
+        with self.lock:
+            present = name in self.disk
+            if present:
+                self.disk.move_to_end(name)
+        if present:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                with self.lock:
+                    self.hits += 1
+                return data
+            except OSError:
+                pass
+
+        data = encode_variant(file, variant)
+        with self.lock:
+            self.misses += 1
+        try:
+            temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning("Failed to write {} to the view cache: {}".format(file, e))
+            return data
+        with self.lock:
+            self.disk_bytes += len(data) - self.disk.pop(name, 0)
+            self.disk[name] = len(data)
+            evicted = []
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk) > 1:
+                evicted_name, size = self.disk.popitem(last=False)
+                self.disk_bytes -= size
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, evicted_name))
+            except OSError:
+                pass
+        return data
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "memory_entries": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+                "disk_entries": len(self.disk),
+                "disk_bytes": self.disk_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,141 @@
+"""
+Per-client websocket send queues.
+
+A message sent to many clients is encoded once and put on the queue of every client, each
+drained by its own task, so a slow client doesn't delay the others. The queues are bounded
+by type instead of by count alone: progress, full progress_state, status and preview messages
+only show the latest state, so a newer one replaces the queued older one with the same key,
+and they're dropped first when a queue is full. Every other message (executing, executed,
+execution_success/error...) is always delivered, a client that can't keep up with those is
+disconnected instead. A message can also be queued as a future of its payload while it's
+being encoded (previews), the messages after it wait until the future has its result, and
+it's skipped if the result is None.
+"""
+import asyncio
+import collections
+import logging
+import time
+
+import aiohttp
+
+import comfy.metrics
+from protocol import BinaryEventTypes
+
+MAX_QUEUED_MESSAGES = 256
+# A client with this many messages that can't be dropped waiting is disconnected
+MAX_PENDING_MESSAGES = 4096
+
+WEBSOCKET_SEND_SECONDS = comfy.metrics.Histogram("comfyui_websocket_send_seconds", "Time spent sending a message to a websocket client.",
+                                                 buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+WEBSOCKET_QUEUED = comfy.metrics.Counter("comfyui_websocket_queued_messages_total", "Messages queued to be sent to a websocket client.")
+WEBSOCKET_DROPPED = comfy.metrics.Counter("comfyui_websocket_dropped_messages_total", "Messages to websocket clients that weren't sent: replaced by a newer one (superseded), dropped from a full queue (overflow), or the client was disconnected or the send failed.", ["reason"])
+
+PREVIEW_EVENTS = (BinaryEventTypes.PREVIEW_IMAGE, BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA)
+
+
+def get_message_key(event, data):
+    """
+    Returns the key of a message that only carries the latest state of something, newer
+    messages with the same key replace it. None for messages that must always be delivered.
+    """
+    if event in PREVIEW_EVENTS:
+        return ("preview",)
+    if event == "progress" and isinstance(data, dict):
+        return ("progress", data.get("prompt_id", None), data.get("node", None))
+    if event == "progress_state" and isinstance(data, dict) and not data.get("delta", False):
+        # Deltas only carry the nodes that changed, they can't replace each other
+        return ("progress_state", data.get("prompt_id", None))
+    if event == "status":
+        return ("status",)
+    return None
+
+
+class QueuedMessage:
+    __slots__ = ("payload", "key", "dropped")
+
+    def __init__(self, payload, key):
+        self.payload = payload
+        self.key = key
+        self.dropped = False
+
+
+class ClientSendQueue:
+    def __init__(self, ws, max_size=MAX_QUEUED_MESSAGES, max_pending=MAX_PENDING_MESSAGES):
+        self.ws = ws
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.queue = collections.deque()
+        # The latest queued message of each key
+        self.latest = {}
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.create_task(self.run())
+
+    def put(self, payload, key=None):
+        """Queues payload (str for JSON, bytes for binary messages, or a future of either) to be sent."""
+        if self.closed:
+            WEBSOCKET_DROPPED.inc("disconnected")
+            return
+        message = QueuedMessage(payload, key)
+        if key is not None:
+            previous = self.latest.get(key, None)
+            if previous is not None and not previous.dropped:
+                previous.dropped = True
+                WEBSOCKET_DROPPED.inc("superseded")
+            self.latest[key] = message
+
+        if len(self.queue) >= self.max_size:
+            self.queue = collections.deque(x for x in self.queue if not x.dropped)
+        if len(self.queue) >= self.max_size:
+            oldest = next((x for x in self.queue if x.key is not None), None)
+            if oldest is None and key is not None:
+                oldest = message
+            if oldest is not None:
+                oldest.dropped = True
+                WEBSOCKET_DROPPED.inc("overflow")
+                if oldest is message:
+                    return
+            elif len(self.queue) >= self.max_pending:
+                logging.warning("Disconnecting a websocket client that doesn't receive its messages")
+                WEBSOCKET_DROPPED.inc("disconnected", amount=len(self.queue) + 1)
+                self.close()
+                asyncio.create_task(self.ws.close())
+                return
+
+        self.queue.append(message)
+        WEBSOCKET_QUEUED.inc()
+        self.wakeup.set()
+
+    async def run(self):
+        while True:
+            while len(self.queue) > 0:
+                message = self.queue.popleft()
+                if message.dropped:
+                    continue
+                if message.key is not None and self.latest.get(message.key, None) is message:
+                    del self.latest[message.key]
+                payload = message.payload
+                if isinstance(payload, asyncio.Future):
+                    # Shielded, the future can be shared by the queues of several clients
+                    payload = await asyncio.shield(payload)
+                    if payload is None:
+                        continue
+                start = time.perf_counter()
+                try:
+                    if isinstance(payload, str):
+                        await self.ws.send_str(payload)
+                    else:
+                        await self.ws.send_bytes(payload)
+                except (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError) as err:
+                    logging.warning("send error: {}".format(err))
+                    WEBSOCKET_DROPPED.inc("error")
+                    continue
+                WEBSOCKET_SEND_SECONDS.observe(time.perf_counter() - start)
+            self.wakeup.clear()
+            await self.wakeup.wait()
+
+    def close(self):
+        self.closed = True
+        self.queue.clear()
+        self.latest.clear()
+        self.task.cancel()
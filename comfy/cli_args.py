@@ -100,12 +100,37 @@ class LatentPreviewMethod(enum.Enum):
 parser.add_argument("--preview-method", type=LatentPreviewMethod, default=LatentPreviewMethod.NoPreviews, help="Default preview method for sampler nodes.", action=EnumAction)
 
 parser.add_argument("--preview-size", type=int, default=512, help="Sets the maximum preview size for sampler nodes.")
+parser.add_argument("--max-progress-state-rate", type=float, default=10.0, metavar="N", help="Send at most N progress_state messages per second to a client while a node reports progress, the changes in between are coalesced. 0 sends one for every update.")
 
 cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
+cache_group.add_argument("--cache-ram-budget", type=float, default=0, metavar="GB", help="Use LRU caching that evicts node results by their measured size until the cached outputs fit in N GB of RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 
+parser.add_argument("--parallel-execution-workers", type=int, default=0, metavar="N", help="Run nodes that declare a cpu or io RESOURCE_CLASS on a pool of N worker threads so that independent branches of a workflow can execute concurrently. Nodes using the GPU always run one at a time. Disabled by default.")
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="N", help="Number of prompts executed at the same time. Each worker has its own caches and is pinned to a device from --prompt-worker-devices.")
+parser.add_argument("--prompt-worker-devices", type=str, default=None, metavar="DEVICES", help="Comma separated list of the devices the prompt workers are pinned to, for example: 0,1 or cuda:0,cpu (plain numbers are indexes of the default device type). Workers are assigned to them round robin. By default every worker uses the default device.")
+parser.add_argument("--execution-subprocess", action="store_true", help="Execute prompts in a child process for each prompt worker. A crashing node only takes down its execution process, which is restarted automatically.")
+parser.add_argument("--fair-queue", action="store_true", help="Share the prompt queue fairly between clients (users with --multi-user) with weighted deficit round robin instead of running prompts strictly in the order they were queued.")
+parser.add_argument("--fair-queue-weights", type=str, default=None, metavar="WEIGHTS", help="Comma separated list of client=weight for --fair-queue, for example: alice=2,bob=0.5. Clients that aren't listed have a weight of 1.")
+parser.add_argument("--max-queued-per-client", type=int, default=0, metavar="N", help="Reject new prompts from a client that already has N prompts in the queue. Disabled by default.")
+parser.add_argument("--max-queue-size", type=int, default=0, metavar="N", help="Reject new prompts with 429 Too Many Requests while N prompts are queued. Disabled by default.")
+parser.add_argument("--max-queued-mb", type=float, default=0, metavar="MB", help="Reject new prompts while the requests of the queued prompts add up to more than this many MB. Disabled by default.")
+parser.add_argument("--max-prompts-per-minute", type=int, default=0, metavar="N", help="Reject new prompts from a client that queued more than N prompts in the last minute (bursts of up to N prompts are allowed). Disabled by default.")
+parser.add_argument("--lazy-prompt-validation", action="store_true", help="Only check that the nodes of a prompt exist when it's queued and validate its inputs when it's about to be executed. Makes queueing prompts faster, but errors in the inputs are only reported with an execution_error message.")
+parser.add_argument("--coordinator-backends", type=str, nargs="+", default=None, metavar="URL", help="Run as a coordinator: queue every prompt on one of these ComfyUI instances (for example http://127.0.0.1:8189) chosen by queue depth and the models it already loaded, and forward their progress messages, queue and history.")
+parser.add_argument("--max-running-per-client", type=int, default=0, metavar="N", help="Maximum number of prompts of a single client that run at the same time (with --prompt-workers). Disabled by default.")
+parser.add_argument("--model-affinity-window", type=int, default=0, metavar="N", help="Instead of strictly running prompts in queue order, run the one among the oldest prompt and the N following ones that needs the fewest models that aren't already loaded. A prompt is passed over at most N times. Disabled by default.")
+parser.add_argument("--seed-sweep-batch-size", type=int, default=0, metavar="N", help="Execute up to N queued prompts that only differ in the seed of their sampler as one prompt, with the sampler denoising one latent per seed in a single batch. Only prompts with one KSampler using a sampler that adds no noise between steps are coalesced. Disabled by default.")
+parser.add_argument("--profile-execution", action="store_true", help="Record the time, memory use and output size of every node and store it with the history entry of the prompt. Can also be enabled for a single prompt with \"profile\": true in its extra_data.")
+
+parser.add_argument("--cache-tensor-fingerprint", type=str, choices=["none", "full", "sampled"], default="full", help="How tensor and array inputs are fingerprinted for cache keys. 'full' hashes tensors up to --cache-tensor-fingerprint-max-mb and never caches nodes with larger ones, 'sampled' also hashes a sample of larger tensors (faster, but tensors that only differ between samples will collide), 'none' never caches nodes with tensor inputs.")
+parser.add_argument("--cache-tensor-fingerprint-max-mb", type=float, default=64.0, help="Maximum size in MB of a tensor input that is hashed in full for cache keys.")
+parser.add_argument("--cache-disk-directory", type=str, default=None, help="Enable a persistent on-disk tier for node outputs stored in this directory. Identical subgraphs are reloaded from disk after a restart or cache eviction instead of being recomputed.")
+parser.add_argument("--cache-disk-size", type=float, default=10.0, help="Set the maximum size in GB of the on-disk node output cache.")
+parser.add_argument("--view-cache-directory", type=str, default=None, help="Directory where the previews and channel variants of images served by /view are cached. By default they are cached in the temp directory, which is cleared when the server starts.")
+
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
 attn_group.add_argument("--use-quad-cross-attention", action="store_true", help="Use the sub-quadratic cross attention optimization . Ignored when xformers is used.")
@@ -213,6 +238,7 @@ database_default_path = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "user", "comfyui.db")
 )
 parser.add_argument("--database-url", type=str, default=f"sqlite:///{database_default_path}", help="Specify the database URL, e.g. for an in-memory database you can use 'sqlite:///:memory:'.")
+parser.add_argument("--persistent-queue", action="store_true", help="Store the prompt queue and history in the database so queued prompts and the history survive a restart or crash.")
 
 if comfy.options.args_parsing:
     args = parser.parse_args()
@@ -0,0 +1,125 @@
+"""
+Prometheus metrics, served in the text exposition format at /metrics.
+
+Metrics are plain objects living in the process: recording a value takes a lock and an
+addition (plus a bisect for histograms), so they're always enabled. Values that are already
+tracked elsewhere, like the queue depth, are read by a function when the metrics are scraped.
+"""
+import bisect
+import math
+import threading
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+REGISTRY = []
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(pairs):
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, escape_label(value)) for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None, registry=REGISTRY):
+        """
+        function, if given, returns the value of the metric when it's scraped: a number, or
+        a dict mapping tuples of label values to numbers.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.lock = threading.Lock()
+        self.values = {}
+        if registry is not None:
+            registry.append(self)
+
+    def get_values(self):
+        if self.function is None:
+            with self.lock:
+                return dict(self.values)
+        values = self.function()
+        if not isinstance(values, dict):
+            return {(): values}
+        return {labels if isinstance(labels, tuple) else (labels,): value for labels, value in values.items()}
+
+    def samples(self):
+        """Returns (name suffix, label pairs, value) for every sample of the metric."""
+        return [("", tuple(zip(self.labelnames, labels)), value) for labels, value in sorted(self.get_values().items())]
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.documentation.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE {} {}".format(self.name, self.type)]
+        for suffix, labels, value in self.samples():
+            lines.append("{}{}{} {}".format(self.name, suffix, format_labels(labels), format_value(value)))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, documentation, labelnames, registry=registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels, None)
+            if state is None:
+                # Count per bucket (not cumulative, the last one is +Inf) and sum
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: (list(counts), total) for labels, (counts, total) in self.values.items()}
+        out = []
+        for labels, (counts, total) in sorted(values.items()):
+            pairs = tuple(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                out.append(("_bucket", pairs + (("le", format_value(bound)),), cumulative))
+            out.append(("_sum", pairs, total))
+            out.append(("_count", pairs, cumulative))
+        return out
+
+
+def render(registry=REGISTRY):
+    return "\n".join(metric.render() for metric in registry) + "\n"
@@ -26,6 +26,11 @@ import importlib
 import platform
 import weakref
 import gc
+import threading
+import functools
+import contextvars
+import time
+import comfy.metrics
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -166,9 +171,15 @@ def is_ixuca():
         return True
     return False
 
+# The device of the prompt worker running on the current thread, see set_thread_torch_device()
+current_torch_device = contextvars.ContextVar("current_torch_device", default=None)
+
 def get_torch_device():
     global directml_enabled
     global cpu_state
+    device = current_torch_device.get()
+    if device is not None:
+        return device
     if directml_enabled:
         global directml_device
         return directml_device
@@ -436,6 +447,103 @@ except:
 
 current_loaded_models = []
 
+# current_loaded_models is shared by all prompt workers
+model_management_lock = threading.RLock()
+
+def with_model_management_lock(func):
+    @functools.wraps(func)
+    def wrapper(*a, **kw):
+        with model_management_lock:
+            return func(*a, **kw)
+    return wrapper
+
+# Notified when a prompt worker releases its models
+models_released = threading.Condition(model_management_lock)
+
+class ModelsInUse:
+    """The models loaded by one prompt worker for the prompt it's executing (ids of their ModelPatchers)."""
+    def __init__(self):
+        self.ids = set()
+        # The workers this one waits for to release a clone of a model it loads
+        self.waiting_for = set()
+
+current_models_in_use = contextvars.ContextVar("current_models_in_use", default=None)
+worker_models_in_use = weakref.WeakSet()
+
+def register_models_in_use():
+    """Creates the set of models in use of the calling prompt worker."""
+    models_in_use = ModelsInUse()
+    with model_management_lock:
+        worker_models_in_use.add(models_in_use)
+    current_models_in_use.set(models_in_use)
+    return models_in_use
+
+@with_model_management_lock
+def release_models_in_use():
+    """Called by a prompt worker when its prompt finished, its models can be unloaded by the other workers again."""
+    models_in_use = current_models_in_use.get()
+    if models_in_use is not None:
+        models_in_use.ids.clear()
+        models_released.notify_all()
+
+def is_waiting_for(models_in_use, other):
+    """Whether models_in_use waits, directly or through other workers, for other."""
+    visited = set()
+    stack = list(models_in_use.waiting_for)
+    while len(stack) > 0:
+        x = stack.pop()
+        if x is other:
+            return True
+        if x not in visited:
+            visited.add(x)
+            stack.extend(x.waiting_for)
+    return False
+
+@with_model_management_lock
+def wait_for_clones_in_use(models):
+    """
+    Waits until no other prompt worker uses a clone of one of models: they share their weights,
+    loading one repatches them under the worker executing with the other.
+    """
+    current = current_models_in_use.get()
+    while True:
+        holders = set()
+        for loaded in current_loaded_models:
+            if any(loaded.model is not m and m.is_clone(loaded.model) for m in models):
+                holders.update(x for x in worker_models_in_use if x is not current and id(loaded.model) in x.ids)
+        if len(holders) == 0:
+            return
+        if current is not None and any(is_waiting_for(x, current) for x in holders):
+            logging.warning("Prompt workers are waiting for each other's models, loading a model another worker is using.")
+            return
+        if current is not None:
+            current.waiting_for = holders
+        try:
+            models_released.wait()
+        finally:
+            if current is not None:
+                current.waiting_for = set()
+
+def get_models_used_by_other_workers():
+    current = current_models_in_use.get()
+    ids = set()
+    for models_in_use in worker_models_in_use:
+        if models_in_use is not current:
+            ids.update(models_in_use.ids)
+    return ids
+
+def set_thread_torch_device(device):
+    """Makes device the device returned by get_torch_device() on the calling thread."""
+    current_torch_device.set(device)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    elif device.type == "xpu":
+        torch.xpu.set_device(device)
+    elif device.type == "npu":
+        torch.npu.set_device(device)
+    elif device.type == "mlu":
+        torch.mlu.set_device(device)
+
 def module_size(module):
     module_mem = 0
     sd = module.state_dict()
@@ -444,6 +552,9 @@ def module_size(module):
         module_mem += t.nelement() * t.element_size()
     return module_mem
 
+MODEL_LOAD_SECONDS = comfy.metrics.Histogram("comfyui_model_load_seconds", "Time spent loading a model to its device.", ["model"])
+MODEL_UNLOAD_SECONDS = comfy.metrics.Histogram("comfyui_model_unload_seconds", "Time spent fully unloading a model from its device.", ["model"])
+
 class LoadedModel:
     def __init__(self, model):
         self._set_model(model)
@@ -484,6 +595,7 @@ class LoadedModel:
             return self.model_memory()
 
     def model_load(self, lowvram_model_memory=0, force_patch_weights=False):
+        start = time.perf_counter()
         self.model.model_patches_to(self.device)
         self.model.model_patches_to(self.model.model_dtype())
 
@@ -500,6 +612,7 @@ class LoadedModel:
 
         self.real_model = weakref.ref(real_model)
         self.model_finalizer = weakref.finalize(real_model, cleanup_models)
+        MODEL_LOAD_SECONDS.observe(time.perf_counter() - start, type(real_model).__name__)
         return real_model
 
     def should_reload_model(self, force_patch_weights=False):
@@ -508,6 +621,7 @@ class LoadedModel:
         return False
 
     def model_unload(self, memory_to_free=None, unpatch_weights=True):
+        start = time.perf_counter()
         if memory_to_free is not None:
             if memory_to_free < self.model.loaded_size():
                 freed = self.model.partially_unload(self.model.offload_device, memory_to_free)
@@ -517,6 +631,7 @@ class LoadedModel:
         self.model_finalizer.detach()
         self.model_finalizer = None
         self.real_model = None
+        MODEL_UNLOAD_SECONDS.observe(time.perf_counter() - start, type(self.model.model).__name__)
         return True
 
     def model_use_more_vram(self, extra_memory, force_patch_weights=False):
@@ -565,16 +680,19 @@ def extra_reserved_memory():
 def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
+@with_model_management_lock
 def free_memory(memory_required, device, keep_loaded=[]):
     cleanup_models_gc()
     unloaded_model = []
     can_unload = []
     unloaded_models = []
+    # Models another prompt worker is executing with can't be unloaded or unpatched under it
+    used_by_other_workers = get_models_used_by_other_workers()
 
     for i in range(len(current_loaded_models) -1, -1, -1):
         shift_model = current_loaded_models[i]
         if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
+            if shift_model not in keep_loaded and not shift_model.is_dead() and id(shift_model.model) not in used_by_other_workers:
                 can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
                 shift_model.currently_used = False
 
@@ -602,6 +720,7 @@ def free_memory(memory_required, device, keep_loaded=[]):
                 soft_empty_cache()
     return unloaded_models
 
+@with_model_management_lock
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
     cleanup_models_gc()
     global vram_state
@@ -621,6 +740,11 @@ def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimu
 
     models = models_temp
 
+    wait_for_clones_in_use(models)
+    models_in_use = current_models_in_use.get()
+    if models_in_use is not None:
+        models_in_use.ids.update(id(m) for m in models)
+
     models_to_load = []
 
     for x in models:
@@ -700,6 +824,7 @@ def loaded_models(only_currently_used=False):
     return output
 
 
+@with_model_management_lock
 def cleanup_models_gc():
     do_gc = False
     for i in range(len(current_loaded_models)):
@@ -720,6 +845,7 @@ def cleanup_models_gc():
 
 
 
+@with_model_management_lock
 def cleanup_models():
     to_delete = []
     for i in range(len(current_loaded_models)):
@@ -1403,7 +1529,6 @@ def unload_all_models():
 
 
 #TODO: might be cleaner to put this somewhere else
-import threading
 
 class InterruptProcessingException(Exception):
     pass
@@ -1411,22 +1536,59 @@ class InterruptProcessingException(Exception):
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
-def interrupt_current_processing(value=True):
+
+class InterruptFlag:
+    def __init__(self):
+        self.value = False
+
+# Each prompt worker has its own flag so that interrupting one prompt doesn't stop the others.
+# Code running outside of a prompt worker uses the global flag.
+current_interrupt_flag = contextvars.ContextVar("current_interrupt_flag", default=None)
+worker_interrupt_flags = weakref.WeakSet()
+
+def register_interrupt_flag():
+    """Creates an interrupt flag for the calling prompt worker."""
+    flag = InterruptFlag()
+    with interrupt_processing_mutex:
+        worker_interrupt_flags.add(flag)
+    current_interrupt_flag.set(flag)
+    return flag
+
+def interrupt_current_processing(value=True, flag=None):
+    """
+    Sets the interrupt flag of the calling prompt worker, or of the given flag. Called from
+    anywhere else, it sets the flag of every prompt worker.
+    """
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        if flag is None:
+            flag = current_interrupt_flag.get()
+        if flag is not None:
+            flag.value = value
+            return
         interrupt_processing = value
+        for f in worker_interrupt_flags:
+            f.value = value
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
+        flag = current_interrupt_flag.get()
+        if flag is not None:
+            return flag.value
         return interrupt_processing
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        if interrupt_processing:
+        flag = current_interrupt_flag.get()
+        if flag is not None:
+            if flag.value:
+                flag.value = False
+                raise InterruptProcessingException()
+        elif interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
@@ -24,6 +24,12 @@ def prepare_noise(latent_image, seed, noise_inds=None):
     noises = torch.cat(noises, axis=0)
     return noises
 
+def prepare_seed_sweep_noise(latent_image, seeds, noise_inds=None):
+    """
+    creates the noise for a latent made of one copy of a latent per seed, each part being the noise prepare_noise would create for the copy and its seed.
+    """
+    return torch.cat([prepare_noise(x, seed, noise_inds) for x, seed in zip(latent_image.chunk(len(seeds)), seeds)])
+
 def fix_empty_latent_channels(model, latent_image):
     latent_format = model.get_model_object("latent_format") #Resize the empty latent image so it has the right number of channels
     if latent_format.latent_channels != latent_image.shape[1] and torch.count_nonzero(latent_image) == 0:
@@ -12,6 +12,9 @@ from comfy.cli_args import args
 # Default server capabilities
 SERVER_FEATURE_FLAGS: Dict[str, Any] = {
     "supports_preview_metadata": True,
+    "supports_progress_state_delta": True,
+    # Values of the "preview_format" client feature flag the server can encode previews to
+    "preview_formats": ["jpeg", "png", "webp"],
     "max_upload_size": args.max_upload_size * 1024 * 1024, # Convert MB to bytes
 }
 
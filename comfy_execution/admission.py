@@ -0,0 +1,74 @@
+"""
+Admission control for POST /prompt.
+
+Every queued prompt holds its JSON in memory until it runs, and validating it costs CPU on
+the event loop. The AdmissionController rejects prompts over the configured limits (queue
+size, total size of the queued prompts, prompts queued by the client and rate of prompts per
+client) so the server can answer 429 with a Retry-After instead of growing without bound.
+"""
+import collections
+import math
+import threading
+import time
+from typing import NamedTuple
+
+
+class Rejection(NamedTuple):
+    type: str
+    message: str
+    retry_after: int
+
+
+class AdmissionController:
+    def __init__(self, max_queue_size=0, max_queued_bytes=0, max_queued_per_client=0, max_prompts_per_minute=0):
+        self.max_queue_size = max_queue_size
+        self.max_queued_bytes = max_queued_bytes
+        self.max_queued_per_client = max_queued_per_client
+        self.max_prompts_per_minute = max_prompts_per_minute
+        self.lock = threading.Lock()
+        # Token bucket of each client: (tokens, time they were counted)
+        self.buckets = {}
+        self.rejected = collections.Counter()
+
+    def _take_token(self, owner):
+        """Takes one of the client's tokens. Returns 0, or the seconds until it has one."""
+        now = time.monotonic()
+        capacity = float(self.max_prompts_per_minute)
+        tokens, last = self.buckets.get(owner, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * capacity / 60.0)
+        if tokens < 1:
+            self.buckets[owner] = (tokens, now)
+            return (1 - tokens) * 60.0 / capacity
+        self.buckets[owner] = (tokens - 1, now)
+        if len(self.buckets) > 10000:
+            # Drop the clients whose bucket has refilled
+            self.buckets = {k: v for k, v in self.buckets.items() if v[0] + (now - v[1]) * capacity / 60.0 < capacity}
+        return 0
+
+    def check(self, queue, owner, size):
+        """
+        Returns None if a prompt of size bytes from owner can be queued, otherwise a Rejection
+        with the number of seconds after which the client should retry.
+        """
+        # Every worker finishes a prompt about every average execution time
+        retry_after = max(1, math.ceil(queue.get_average_execution_time() / queue.get_worker_count()))
+        rejection = None
+        if self.max_queue_size > 0 and queue.get_queue_depth() >= self.max_queue_size:
+            rejection = Rejection("queue_full", "The queue is full", retry_after)
+        elif self.max_queued_bytes > 0 and queue.get_queued_bytes() + size > self.max_queued_bytes:
+            rejection = Rejection("queue_full", "The queued prompts use too much memory", retry_after)
+        elif self.max_queued_per_client > 0 and queue.get_pending_count(owner) >= self.max_queued_per_client:
+            rejection = Rejection("queue_limit_exceeded", "This client already has {} prompts in the queue".format(self.max_queued_per_client), retry_after)
+        elif self.max_prompts_per_minute > 0:
+            with self.lock:
+                wait = self._take_token(owner)
+            if wait > 0:
+                rejection = Rejection("rate_limited", "This client queues more than {} prompts per minute".format(self.max_prompts_per_minute), max(1, math.ceil(wait)))
+        if rejection is not None:
+            with self.lock:
+                self.rejected[rejection.type] += 1
+        return rejection
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.rejected)
@@ -1,11 +1,16 @@
+import hashlib
 import itertools
-from typing import Sequence, Mapping, Dict
+import weakref
+import torch
+from typing import Sequence, Mapping, Dict, Optional
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
 
 import nodes
 
 from comfy_execution.graph_utils import is_link
+from comfy_execution.disk_cache import DiskCache, is_disk_cacheable, key_digest
+from comfy_execution.fingerprint import get_fingerprint
 
 NODE_CLASS_CONTAINS_UNIQUE_ID: Dict[str, bool] = {}
 
@@ -73,11 +78,79 @@ class CacheKeySetID(CacheKeySet):
             self.keys[node_id] = (node_id, node["class_type"])
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+class SignatureUnhashableError(Exception):
+    pass
+
+def hash_signature(hasher, obj):
+    """
+    Feeds a canonical, type-tagged encoding of obj into hasher. Unlike hash(), the result is
+    stable across processes. Other objects are hashed through their content fingerprint (see
+    comfy_execution.fingerprint). Raises SignatureUnhashableError for values that can't be
+    compared by content (including NaN, which never equals itself).
+    """
+    if obj is None:
+        hasher.update(b"N")
+    elif isinstance(obj, bool):
+        hasher.update(b"T" if obj else b"F")
+    elif isinstance(obj, int):
+        hasher.update(b"i%d;" % obj)
+    elif isinstance(obj, float):
+        if obj != obj:
+            raise SignatureUnhashableError()
+        hasher.update(b"f" + repr(obj).encode() + b";")
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8", "surrogatepass")
+        hasher.update(b"s%d:" % len(data))
+        hasher.update(data)
+    elif isinstance(obj, bytes):
+        hasher.update(b"b%d:" % len(obj))
+        hasher.update(obj)
+    elif isinstance(obj, Mapping):
+        hasher.update(b"{%d:" % len(obj))
+        for k, v in sorted(obj.items()):
+            hash_signature(hasher, k)
+            hash_signature(hasher, v)
+        hasher.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        hasher.update(b"[%d:" % len(obj))
+        for x in obj:
+            hash_signature(hasher, x)
+        hasher.update(b"]")
+    else:
+        # Tensors, arrays and objects implementing __comfy_fingerprint__
+        fingerprint = get_fingerprint(obj)
+        if fingerprint is None:
+            raise SignatureUnhashableError()
+        hasher.update(b"o")
+        hash_signature(hasher, fingerprint)
+
+def signature_digest(signature):
+    hasher = hashlib.blake2b(digest_size=32)
+    try:
+        hash_signature(hasher, signature)
+    except (SignatureUnhashableError, TypeError, RecursionError):
+        # TypeError is raised when sorting a mapping with incomparable keys, RecursionError by
+        # self-referencing fingerprints
+        return Unhashable()
+    return hasher.digest()
+
+# Node digests only depend on the prompt, so they are shared by every key set (including the
+# ones created for subcaches) that is built for the same DynamicPrompt.
+_prompt_node_digests: "weakref.WeakKeyDictionary[DynamicPrompt, Dict]" = weakref.WeakKeyDictionary()
+
 class CacheKeySetInputSignature(CacheKeySet):
+    """
+    Keys each node by a fixed-size digest of its own inputs and the digests of its parents
+    (a Merkle hash of its ancestry). Identical subgraphs get identical keys regardless of node
+    ids, and every node is hashed once per prompt.
+    """
     def __init__(self, dynprompt, node_ids, is_changed_cache):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        if dynprompt not in _prompt_node_digests:
+            _prompt_node_digests[dynprompt] = {}
+        self.node_digests = _prompt_node_digests[dynprompt].setdefault(type(self), {})
 
     def include_node_id_in_input(self) -> bool:
         return False
@@ -93,17 +166,36 @@ class CacheKeySetInputSignature(CacheKeySet):
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
     async def get_node_signature(self, dynprompt, node_id):
-        signature = []
-        ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
-        signature.append(await self.get_immediate_node_signature(dynprompt, node_id, order_mapping))
-        for ancestor_id in ancestors:
-            signature.append(await self.get_immediate_node_signature(dynprompt, ancestor_id, order_mapping))
-        return to_hashable(signature)
-
-    async def get_immediate_node_signature(self, dynprompt, node_id, ancestor_order_mapping):
+        # Parents are hashed before their children using an explicit stack so that very deep
+        # graphs don't hit the recursion limit.
+        stack = [(node_id, False)]
+        in_progress = set()
+        while len(stack) > 0:
+            current_id, parents_done = stack.pop()
+            if current_id in self.node_digests:
+                continue
+            if parents_done:
+                self.node_digests[current_id] = await self.get_immediate_node_signature(dynprompt, current_id)
+                in_progress.discard(current_id)
+                continue
+            in_progress.add(current_id)
+            stack.append((current_id, True))
+            for parent_id in self.get_parent_ids(dynprompt, current_id):
+                # A parent that is still in progress is part of a cycle and stays unhashable
+                if parent_id not in self.node_digests and parent_id not in in_progress:
+                    stack.append((parent_id, False))
+        return self.node_digests[node_id]
+
+    def get_parent_ids(self, dynprompt, node_id):
+        if not dynprompt.has_node(node_id):
+            return []
+        inputs = dynprompt.get_node(node_id)["inputs"]
+        return [inputs[key][0] for key in sorted(inputs.keys()) if is_link(inputs[key])]
+
+    async def get_immediate_node_signature(self, dynprompt, node_id):
         if not dynprompt.has_node(node_id):
             # This node doesn't exist -- we can't cache it.
-            return [float("NaN")]
+            return Unhashable()
         node = dynprompt.get_node(node_id)
         class_type = node["class_type"]
         class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
@@ -114,32 +206,36 @@ class CacheKeySetInputSignature(CacheKeySet):
         for key in sorted(inputs.keys()):
             if is_link(inputs[key]):
                 (ancestor_id, ancestor_socket) = inputs[key]
-                ancestor_index = ancestor_order_mapping[ancestor_id]
-                signature.append((key,("ANCESTOR", ancestor_index, ancestor_socket)))
+                ancestor_digest = self.node_digests.get(ancestor_id, None)
+                if not isinstance(ancestor_digest, bytes):
+                    return Unhashable()
+                signature.append((key, ("ANCESTOR", ancestor_digest, ancestor_socket)))
             else:
                 signature.append((key, inputs[key]))
-        return signature
-
-    # This function returns a list of all ancestors of the given node. The order of the list is
-    # deterministic based on which specific inputs the ancestor is connected by.
-    def get_ordered_ancestry(self, dynprompt, node_id):
-        ancestors = []
-        order_mapping = {}
-        self.get_ordered_ancestry_internal(dynprompt, node_id, ancestors, order_mapping)
-        return ancestors, order_mapping
+        return signature_digest(signature)
 
-    def get_ordered_ancestry_internal(self, dynprompt, node_id, ancestors, order_mapping):
-        if not dynprompt.has_node(node_id):
-            return
-        inputs = dynprompt.get_node(node_id)["inputs"]
-        input_keys = sorted(inputs.keys())
-        for key in input_keys:
-            if is_link(inputs[key]):
-                ancestor_id = inputs[key][0]
-                if ancestor_id not in order_mapping:
-                    ancestors.append(ancestor_id)
-                    order_mapping[ancestor_id] = len(ancestors) - 1
-                    self.get_ordered_ancestry_internal(dynprompt, ancestor_id, ancestors, order_mapping)
+async def find_duplicate_nodes(dynprompt, node_ids, is_changed_cache):
+    """
+    Finds nodes whose input signature is identical to that of another node. Returns a dict
+    mapping each duplicate to the first node (in node_ids order) with the same signature.
+    Output nodes and nodes that aren't idempotent are never treated as duplicates.
+    """
+    key_set = CacheKeySetInputSignature(dynprompt, node_ids, is_changed_cache)
+    await key_set.add_keys(node_ids)
+    first_with_key = {}
+    duplicate_of = {}
+    for node_id in node_ids:
+        class_def = nodes.NODE_CLASS_MAPPINGS[dynprompt.get_node(node_id)["class_type"]]
+        if getattr(class_def, "NOT_IDEMPOTENT", False) or getattr(class_def, "OUTPUT_NODE", False):
+            continue
+        key = key_set.get_data_key(node_id)
+        if not isinstance(key, bytes):
+            continue
+        if key in first_with_key:
+            duplicate_of[node_id] = first_with_key[key]
+        else:
+            first_with_key[key] = node_id
+    return duplicate_of
 
 class BasicCache:
     def __init__(self, key_class):
@@ -149,9 +245,17 @@ class BasicCache:
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        self.disk_cache: Optional[DiskCache] = None
+        self.disk_digests = {}
+
+    def set_disk_cache(self, disk_cache):
+        self.disk_cache = disk_cache
+        for subcache in self.subcaches.values():
+            subcache.set_disk_cache(disk_cache)
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
         self.dynprompt = dynprompt
+        self.disk_digests = {}
         self.cache_key_set = self.key_class(dynprompt, node_ids, is_changed_cache)
         await self.cache_key_set.add_keys(node_ids)
         self.is_changed_cache = is_changed_cache
@@ -188,10 +292,23 @@ class BasicCache:
         self._clean_cache()
         self._clean_subcaches()
 
+    def _get_disk_digest(self, node_id, cache_key):
+        if self.disk_cache is None or cache_key is None:
+            return None
+        if cache_key not in self.disk_digests:
+            class_type = self.dynprompt.get_node(node_id)["class_type"]
+            if is_disk_cacheable(nodes.NODE_CLASS_MAPPINGS[class_type]):
+                self.disk_digests[cache_key] = key_digest(cache_key)
+            else:
+                self.disk_digests[cache_key] = None
+        return self.disk_digests[cache_key]
+
     def _set_immediate(self, node_id, value):
         assert self.initialized
         cache_key = self.cache_key_set.get_data_key(node_id)
         self.cache[cache_key] = value
+        if self.disk_cache is not None:
+            self.disk_cache.put(self._get_disk_digest(node_id, cache_key), value)
 
     def _get_immediate(self, node_id):
         if not self.initialized:
@@ -199,6 +316,12 @@ class BasicCache:
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key in self.cache:
             return self.cache[cache_key]
+        elif self.disk_cache is not None:
+            value = self.disk_cache.get(self._get_disk_digest(node_id, cache_key))
+            if value is not None:
+                # Promote to the in-memory tier
+                self.cache[cache_key] = value
+            return value
         else:
             return None
 
@@ -207,6 +330,7 @@ class BasicCache:
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
             subcache = BasicCache(self.key_class)
+            subcache.set_disk_cache(self.disk_cache)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -318,6 +442,114 @@ class LRUCache(BasicCache):
         return self
 
 
+def get_storage_sizes(obj, storages=None):
+    """
+    Returns a dict mapping storage pointer -> size in bytes for every tensor found
+    recursively in obj. Tensors that are views of the same storage are only counted once.
+    """
+    if storages is None:
+        storages = {}
+    if isinstance(obj, torch.Tensor):
+        storage = obj.untyped_storage()
+        storages[(obj.device, storage.data_ptr())] = storage.nbytes()
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            get_storage_sizes(x, storages)
+    elif isinstance(obj, Mapping):
+        for x in obj.values():
+            get_storage_sizes(x, storages)
+    return storages
+
+class RAMBudgetLRUCache(LRUCache):
+    """
+    An LRU cache that evicts by the measured size of the cached outputs instead of the number
+    of entries. Storages shared between entries are only counted once towards the budget.
+    """
+    def __init__(self, key_class, max_bytes):
+        super().__init__(key_class, max_size=0)
+        self.max_bytes = max_bytes
+        self.entry_storages = {}
+        self.storage_refs = {}
+        self.storage_sizes = {}
+        self.total_bytes = 0
+
+    def _add_storages(self, cache_key, value):
+        self._remove_storages(cache_key)
+        storages = get_storage_sizes(value)
+        self.entry_storages[cache_key] = storages
+        for ptr, size in storages.items():
+            if ptr not in self.storage_refs:
+                self.storage_refs[ptr] = 0
+                self.storage_sizes[ptr] = size
+                self.total_bytes += size
+            self.storage_refs[ptr] += 1
+
+    def _remove_storages(self, cache_key):
+        storages = self.entry_storages.pop(cache_key, None)
+        if storages is None:
+            return
+        for ptr in storages:
+            self.storage_refs[ptr] -= 1
+            if self.storage_refs[ptr] == 0:
+                del self.storage_refs[ptr]
+                self.total_bytes -= self.storage_sizes.pop(ptr)
+
+    def _remove_key(self, cache_key):
+        self._remove_storages(cache_key)
+        self.cache.pop(cache_key, None)
+        self.used_generation.pop(cache_key, None)
+        self.children.pop(cache_key, None)
+
+    def _set_immediate(self, node_id, value):
+        super()._set_immediate(node_id, value)
+        self._add_storages(self.cache_key_set.get_data_key(node_id), value)
+
+    def _get_immediate(self, node_id):
+        cache_key = self.cache_key_set.get_data_key(node_id) if self.initialized else None
+        present = cache_key in self.cache
+        value = super()._get_immediate(node_id)
+        if value is not None and not present:
+            # Promoted from the disk tier
+            self._add_storages(cache_key, value)
+        return value
+
+    def set(self, node_id, value):
+        super().set(node_id, value)
+        self._evict(self.generation)
+
+    def clean_unused(self):
+        self._evict(self.generation)
+        self._clean_subcaches()
+
+    def _evict(self, protected_generation):
+        # Entries used by the current prompt are protected while it is running
+        if self.total_bytes <= self.max_bytes:
+            return
+        candidates = [key for key in self.cache if self.used_generation[key] < protected_generation]
+        # Oldest generation first, largest entries first within a generation
+        candidates.sort(key=lambda key: (self.used_generation[key], -self.get_entry_size(key)))
+        for key in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._remove_key(key)
+        self.min_generation = min((self.used_generation[key] for key in self.cache), default=self.generation)
+
+    def get_entry_size(self, cache_key):
+        return sum(self.entry_storages.get(cache_key, {}).values())
+
+    def get_entry_sizes(self):
+        return {key: self.get_entry_size(key) for key in self.cache}
+
+    def recursive_debug_dump(self):
+        result = super().recursive_debug_dump()
+        result.append({
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "entry_sizes": self.get_entry_sizes(),
+        })
+        return result
+
+
 class DependencyAwareCache(BasicCache):
     """
     A cache implementation that tracks dependencies between nodes and manages
@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import safetensors.torch
+
+FORMAT_VERSION = "1"
+FILE_EXTENSION = ".safetensors"
+
+# The dtypes of the safetensors format
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+for name, dtype in (("F8_E4M3", "float8_e4m3fn"), ("F8_E5M2", "float8_e5m2"), ("U16", "uint16"), ("U32", "uint32"), ("U64", "uint64")):
+    if hasattr(torch, dtype):
+        DTYPES[name] = getattr(torch, dtype)
+
+
+class NotPersistable(Exception):
+    pass
+
+
+def key_digest(cache_key):
+    """Returns a hex digest for a cache key, or None if the key can't be stored on disk."""
+    # Input signature keys are content digests that are stable across processes. Anything
+    # else (e.g. Unhashable keys) only has meaning within the current process.
+    if isinstance(cache_key, bytes):
+        return cache_key.hex()
+    return None
+
+
+def is_persistable(value):
+    """Whether value is made only of what _flatten can store, checked before anything is copied."""
+    if value is None or isinstance(value, (torch.Tensor, bool, int, float, str)):
+        return True
+    elif isinstance(value, (tuple, list)):
+        return all(is_persistable(x) for x in value)
+    elif isinstance(value, dict):
+        return all(isinstance(k, str) and is_persistable(v) for k, v in value.items())
+    return False
+
+
+def _flatten(value, tensors, seen):
+    if isinstance(value, torch.Tensor):
+        index = seen.get(id(value), None)
+        if index is None:
+            index = str(len(tensors))
+            seen[id(value)] = index
+            # Always copy so that views sharing a storage are saved independently
+            tensors[index] = value.detach().to("cpu", copy=True).contiguous()
+        return {"t": index}
+    elif value is None or isinstance(value, (bool, int, float, str)):
+        return {"v": value}
+    elif isinstance(value, tuple):
+        return {"tu": [_flatten(x, tensors, seen) for x in value]}
+    elif isinstance(value, list):
+        return {"l": [_flatten(x, tensors, seen) for x in value]}
+    elif isinstance(value, dict) and all(isinstance(k, str) for k in value):
+        return {"d": {k: _flatten(v, tensors, seen) for k, v in value.items()}}
+    raise NotPersistable()
+
+
+def _unflatten(structure, tensors):
+    if "t" in structure:
+        return tensors[structure["t"]]
+    elif "v" in structure:
+        return structure["v"]
+    elif "tu" in structure:
+        return tuple(_unflatten(x, tensors) for x in structure["tu"])
+    elif "l" in structure:
+        return [_unflatten(x, tensors) for x in structure["l"]]
+    elif "d" in structure:
+        return {k: _unflatten(v, tensors) for k, v in structure["d"].items()}
+    raise ValueError(f"Unknown entry in cached structure: {structure}")
+
+
+def load_mmap(path):
+    """
+    Returns (tensors, metadata) of a safetensors file. The tensors are views of a private
+    memory map of the file instead of copies in RAM: their pages are read when they're used
+    and the OS can drop them again under memory pressure.
+    """
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data = torch.empty(0, dtype=torch.uint8).set_(storage)
+    metadata = header.pop("__metadata__", None) or {}
+    start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        dtype = DTYPES[info["dtype"]]
+        raw = data[start + begin:start + end]
+        if (start + begin) % dtype.itemsize != 0:
+            # A view needs the data to be aligned to the size of the dtype
+            raw = raw.clone()
+        tensors[name] = raw.view(dtype).reshape(info["shape"])
+    return tensors, metadata
+
+
+def is_disk_cacheable(class_def):
+    """
+    Output nodes are excluded because their side effects (saving files, UI output) would be
+    skipped on a hit. Node classes can opt out with NOT_DISK_CACHEABLE = True.
+    """
+    if getattr(class_def, "NOT_DISK_CACHEABLE", False):
+        return False
+    if getattr(class_def, "NOT_IDEMPOTENT", False):
+        return False
+    if getattr(class_def, "OUTPUT_NODE", False):
+        return False
+    return True
+
+
+class DiskCache:
+    """
+    A second tier for the output cache that stores node outputs as safetensors files keyed
+    by a digest of the node's input signature. Outputs are written in the background once a
+    node completes and are reloaded on a miss in the in-memory cache, which lets identical
+    subgraphs survive restarts and LRU evictions. Only outputs made of tensors, primitives,
+    lists, tuples and string-keyed dicts can be stored; anything else (models, VAEs, ...)
+    is silently skipped. Loaded tensors are memory mapped from their file.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.RLock()
+        self.entries = {}  # Maps digest -> [size, last_access]
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.skipped = 0
+        self.pending = set()
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk_cache")
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+
+    def _scan(self):
+        entries, total_bytes = self._read_directory()
+        with self.lock:
+            self.entries = entries
+            self.total_bytes = total_bytes
+            self._evict()
+        logging.info(f"Disk cache: {len(self.entries)} entries ({self.total_bytes / (1024 * 1024):.1f} MB) in {self.directory}")
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest + FILE_EXTENSION)
+
+    def get(self, digest):
+        if digest is None:
+            return None
+        with self.lock:
+            entry = self.entries.get(digest, None)
+            if entry is None:
+                # Not counted as a miss, outputs are also looked up to check whether they're
+                # cached. put() counts the misses, when the node had to be executed.
+                return None
+            entry[1] = time.time()
+        path = self._path(digest)
+        try:
+            tensors, metadata = load_mmap(path)
+            if metadata.get("format") != FORMAT_VERSION:
+                raise ValueError(f"Unsupported disk cache format {metadata.get('format')}")
+            value = _unflatten(json.loads(metadata["structure"]), tensors)
+            os.utime(path)
+        except Exception as e:
+            logging.warning(f"Disk cache: dropping unreadable entry {digest}: {e}")
+            self._remove(digest)
+            return None
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def put(self, digest, value):
+        if digest is None:
+            return
+        with self.lock:
+            if digest in self.entries or digest in self.pending:
+                return
+            if not is_persistable(value):
+                self.skipped += 1
+                return
+            self.misses += 1
+            self.pending.add(digest)
+        self.writer.submit(self._write, digest, value)
+
+    def _write(self, digest, value):
+        try:
+            tensors = {}
+            try:
+                structure = _flatten(value, tensors, {})
+            except NotPersistable:
+                with self.lock:
+                    self.skipped += 1
+                return
+            path = self._path(digest)
+            # Other processes may write the same entry at the same time
+            tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            safetensors.torch.save_file(tensors, tmp_path, metadata={"format": FORMAT_VERSION, "structure": json.dumps(structure)})
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self.lock:
+                self.entries[digest] = [size, time.time()]
+                self.total_bytes += size
+                self.writes += 1
+                over_budget = self.total_bytes > self.max_bytes
+            if over_budget:
+                # Execution processes (--execution-subprocess) share the directory, so the budget
+                # is enforced on everything in it, not just the entries this process wrote. The
+                # directory is read without the lock, get() doesn't wait for it.
+                entries, total_bytes = self._read_directory()
+                with self.lock:
+                    self.entries = entries
+                    self.total_bytes = total_bytes
+                    self._evict()
+        except Exception as e:
+            logging.warning(f"Disk cache: failed to write entry {digest}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(digest)
+
+    def _read_directory(self):
+        """Returns the entries of the files in the directory and their total size."""
+        entries = {}
+        total_bytes = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or not entry.name.endswith(FILE_EXTENSION):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            digest = entry.name[:-len(FILE_EXTENSION)]
+            entries[digest] = [stat.st_size, stat.st_mtime]
+            total_bytes += stat.st_size
+        return entries, total_bytes
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        for digest, _ in sorted(self.entries.items(), key=lambda x: x[1][1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._remove(digest)
+            self.evictions += 1
+
+    def _remove(self, digest):
+        with self.lock:
+            entry = self.entries.pop(digest, None)
+            if entry is not None:
+                self.total_bytes -= entry[0]
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            # On Windows files that are memory mapped by a loaded entry can't be removed
+            logging.debug(f"Disk cache: failed to remove entry {digest}: {e}")
+
+    def flush(self):
+        """Block until all queued writes have finished."""
+        self.writer.submit(lambda: None).result()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+            }
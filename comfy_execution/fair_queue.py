@@ -0,0 +1,81 @@
+"""
+Weighted fair queuing of prompts across clients.
+
+Every queued prompt belongs to a client: its user with --multi-user, its client id otherwise.
+With --fair-queue the prompt queue keeps the order of each client's prompts but picks the
+client whose prompt runs next by deficit round robin: when a client's turn comes it is
+credited its weight (from --fair-queue-weights, 1 by default) and runs one prompt per whole
+credit, so one client queueing hundreds of prompts doesn't hold everyone else back.
+"""
+import collections
+import math
+
+
+def parse_weights(value):
+    """Parses --fair-queue-weights, a comma separated list of client=weight."""
+    weights = {}
+    if not value:
+        return weights
+    for entry in value.split(","):
+        client, _, weight = entry.rpartition("=")
+        weight = float(weight)
+        if not client or weight <= 0:
+            raise ValueError("Invalid fair queue weight: {}".format(entry))
+        weights[client.strip()] = weight
+    return weights
+
+
+class DeficitRoundRobin:
+    def __init__(self, weights=None, default_weight=1.0):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.active = collections.deque()
+        self.deficit = {}
+        self.current = None
+
+    def get_weight(self, owner):
+        return self.weights.get(owner, self.default_weight)
+
+    def next_owner(self, pending, blocked=()):
+        """
+        Returns the owner whose oldest prompt runs next. pending are the owners with queued
+        prompts, new ones join the round in that order. blocked are those that can't run a
+        prompt right now, they keep their place in the round. Returns None if every pending
+        owner is blocked.
+        """
+        for owner in list(self.deficit):
+            if owner not in pending:
+                self.active.remove(owner)
+                del self.deficit[owner]
+                if self.current == owner:
+                    self.current = None
+        for owner in pending:
+            if owner not in self.deficit:
+                self.deficit[owner] = 0.0
+                self.active.append(owner)
+        if all(owner in blocked for owner in self.active):
+            return None
+
+        while True:
+            owner = self.active[0]
+            if owner not in blocked:
+                if owner != self.current:
+                    self.current = owner
+                    self.deficit[owner] += self.get_weight(owner)
+                if self.deficit[owner] >= 1:
+                    self.deficit[owner] -= 1
+                    return owner
+            self.active.rotate(-1)
+            self.current = None
+
+    def estimate_position(self, owner, index, depths):
+        """
+        Estimates how many queued prompts run before the prompt at index in the queue of
+        owner, given the number of queued prompts of every owner.
+        """
+        rounds = (index + 1) / self.get_weight(owner)
+        ahead = index
+        for other, depth in depths.items():
+            if other != owner:
+                ahead += min(depth, math.floor(rounds * self.get_weight(other)))
+        return ahead
@@ -0,0 +1,91 @@
+"""
+Content fingerprints for node inputs that aren't plain JSON values.
+
+Cache keys are built from a node's literal inputs. Values like tensors (which appear as
+literal inputs of expanded subgraphs) or custom objects would otherwise make a node
+uncacheable. A class can describe its own identity by implementing
+``__comfy_fingerprint__(self)``, returning any value made of primitives, lists, tuples,
+dicts, tensors or other fingerprintable objects.
+"""
+import hashlib
+import logging
+from enum import Enum
+
+import numpy as np
+import torch
+
+from comfy.cli_args import args
+
+
+class TensorFingerprintMode(Enum):
+    NONE = "none"
+    FULL = "full"
+    SAMPLED = "sampled"
+
+
+TENSOR_FINGERPRINT_MODE = TensorFingerprintMode(args.cache_tensor_fingerprint)
+# Tensors up to this size are hashed in full
+FULL_HASH_MAX_BYTES = round(args.cache_tensor_fingerprint_max_mb * 1024 * 1024)
+# Number of evenly spaced elements hashed for larger tensors in sampled mode
+SAMPLED_HASH_ELEMENTS = 65536
+
+
+def _hash_bytes(data: np.ndarray) -> bytes:
+    return hashlib.blake2b(memoryview(np.ascontiguousarray(data).reshape(-1).view(np.uint8)), digest_size=32).digest()
+
+
+def fingerprint_tensor(t: torch.Tensor):
+    if TENSOR_FINGERPRINT_MODE == TensorFingerprintMode.NONE:
+        return None
+    t = t.detach()
+    flat = t.reshape(-1)
+    nbytes = flat.numel() * flat.element_size()
+    if nbytes <= FULL_HASH_MAX_BYTES:
+        method = "full"
+    elif TENSOR_FINGERPRINT_MODE == TensorFingerprintMode.SAMPLED:
+        # Sampled fingerprints can collide for tensors that only differ between the samples.
+        # They are meant for workflows where large tensor inputs are known to be distinct.
+        method = "sampled"
+        indices = torch.linspace(0, flat.numel() - 1, SAMPLED_HASH_ELEMENTS, device=flat.device).long()
+        flat = flat[indices]
+    else:
+        return None
+    data = flat.cpu().contiguous().view(torch.uint8).numpy()
+    return ("torch.Tensor", str(t.dtype), tuple(t.shape), method, _hash_bytes(data))
+
+
+def fingerprint_ndarray(a: np.ndarray):
+    if TENSOR_FINGERPRINT_MODE == TensorFingerprintMode.NONE or a.dtype.hasobject:
+        return None
+    if a.nbytes <= FULL_HASH_MAX_BYTES:
+        method = "full"
+        data = a
+    elif TENSOR_FINGERPRINT_MODE == TensorFingerprintMode.SAMPLED:
+        method = "sampled"
+        flat = a.reshape(-1)
+        data = flat[np.linspace(0, flat.size - 1, SAMPLED_HASH_ELEMENTS).astype(np.int64)]
+    else:
+        return None
+    return ("numpy.ndarray", str(a.dtype), tuple(a.shape), method, _hash_bytes(data))
+
+
+def get_fingerprint(obj):
+    """
+    Returns a plain value that identifies obj by content, or None if obj can't be fingerprinted
+    within the configured cost limits.
+    """
+    if isinstance(obj, torch.Tensor):
+        return fingerprint_tensor(obj)
+    elif isinstance(obj, np.ndarray):
+        return fingerprint_ndarray(obj)
+    fingerprint_func = getattr(obj, "__comfy_fingerprint__", None)
+    if fingerprint_func is not None and callable(fingerprint_func):
+        try:
+            value = fingerprint_func()
+        except Exception as e:
+            logging.warning(f"__comfy_fingerprint__ failed for {type(obj).__qualname__}: {e}")
+            return None
+        if value is None or value is obj:
+            return None
+        return (f"{type(obj).__module__}.{type(obj).__qualname__}", value)
+    return None
@@ -5,6 +5,7 @@ import nodes
 import asyncio
 import inspect
 from comfy_execution.graph_utils import is_link, ExecutionBlocker
+from comfy_execution.parallel import is_offloadable
 from comfy.comfy_types.node_typing import ComfyNodeABC, InputTypeDict, InputTypeOptions
 
 # NOTE: ExecutionBlocker code got moved to graph_utils.py to prevent torch being imported too soon during unit tests
@@ -27,10 +28,17 @@ class DynamicPrompt:
         self.ephemeral_prompt = {}
         self.ephemeral_parents = {}
         self.ephemeral_display = {}
+        # Nodes merged into an identical node by merge_duplicate_nodes(), and the nodes whose
+        # inputs were rewired to the remaining node or replaced by override_inputs()
+        self.duplicate_of = {}
+        self.duplicates = {}
+        self.rewired_nodes = {}
 
     def get_node(self, node_id):
         if node_id in self.ephemeral_prompt:
             return self.ephemeral_prompt[node_id]
+        if node_id in self.rewired_nodes:
+            return self.rewired_nodes[node_id]
         if node_id in self.original_prompt:
             return self.original_prompt[node_id]
         raise NodeNotFoundError(f"Node {node_id} not found")
@@ -62,6 +70,34 @@ class DynamicPrompt:
     def get_original_prompt(self):
         return self.original_prompt
 
+    def merge_duplicate_nodes(self, duplicate_of):
+        """
+        Rewires every link to a node in duplicate_of to the node it duplicates, so only that
+        node is executed. The original prompt is left untouched since nodes can receive it as
+        a hidden input.
+        """
+        for node_id in self.original_prompt:
+            node = self.get_node(node_id)
+            inputs = node.get("inputs", {})
+            if not any(is_link(v) and v[0] in duplicate_of for v in inputs.values()):
+                continue
+            new_inputs = {k: [duplicate_of[v[0]], v[1]] if is_link(v) and v[0] in duplicate_of else v for k, v in inputs.items()}
+            self.rewired_nodes[node_id] = {**node, "inputs": new_inputs}
+        for duplicate_id, node_id in duplicate_of.items():
+            self.duplicate_of[duplicate_id] = node_id
+            self.duplicates.setdefault(node_id, []).append(duplicate_id)
+
+    def get_duplicates(self, node_id):
+        return self.duplicates.get(node_id, [])
+
+    def override_inputs(self, node_id, inputs):
+        """
+        Replaces inputs of a node for this execution only, leaving the original prompt as it
+        was submitted.
+        """
+        node = self.get_node(node_id)
+        self.rewired_nodes[node_id] = {**node, "inputs": {**node["inputs"], **inputs}}
+
 def get_input_info(
     class_def: Type[ComfyNodeABC],
     input_name: str,
@@ -190,10 +226,11 @@ class ExecutionList(TopologicalSort):
     ExecutionList implements a topological dissolve of the graph. After a node is staged for execution,
     it can still be returned to the graph after having further dependencies added.
     """
-    def __init__(self, dynprompt, output_cache):
+    def __init__(self, dynprompt, output_cache, prefer_offloadable=False):
         super().__init__(dynprompt)
         self.output_cache = output_cache
         self.staged_node_id = None
+        self.prefer_offloadable = prefer_offloadable
 
     def is_cached(self, node_id):
         return self.output_cache.get(node_id) is not None
@@ -245,9 +282,12 @@ class ExecutionList(TopologicalSort):
 
         # If an available node is async, do that first.
         # This will execute the asynchronous function earlier, reducing the overall time.
+        # The same goes for nodes that will run on the worker pool.
         def is_async(node_id):
             class_type = self.dynprompt.get_node(node_id)["class_type"]
             class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+            if self.prefer_offloadable and is_offloadable(class_def):
+                return True
             return inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION))
 
         for node_id in node_list:
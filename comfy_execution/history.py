@@ -0,0 +1,182 @@
+"""
+In-memory prompt history.
+
+Entries are frozen when they're added so readers can share them without copying them, and
+are indexed by completion order: every entry gets an increasing cursor, and a Fenwick tree
+counting the entries that weren't removed finds the entry at an offset in O(log n).
+"""
+import bisect
+
+# Removed slots are only compacted away once there are more of them than entries
+MIN_COMPACT_SIZE = 64
+
+
+class FrozenDict(dict):
+    """A dict that can't be modified. It's still a dict, so it serializes to JSON as one."""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("History entries can't be modified")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenList(list):
+    """A list that can't be modified, so readers still get lists where the entry had them."""
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("History entries can't be modified")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = clear = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(obj):
+    """
+    Returns an immutable copy of a JSON-like value: dicts become FrozenDicts and lists
+    FrozenLists, tuples stay tuples of frozen values.
+    """
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(x) for x in obj)
+    if isinstance(obj, tuple):
+        return tuple(freeze(x) for x in obj)
+    return obj
+
+
+class HistoryIndex:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # prompt id -> (cursor, slot, entry)
+        self.entries = {}
+        # Per slot, in completion order: its cursor and prompt id (None once removed)
+        self.cursors = []
+        self.prompt_ids = []
+        # 1-based Fenwick tree over the slots, 1 for slots holding an entry
+        self.tree = [0]
+        self.next_cursor = 1
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, prompt_id):
+        return prompt_id in self.entries
+
+    def get(self, prompt_id, default=None):
+        entry = self.entries.get(prompt_id, None)
+        return entry[2] if entry is not None else default
+
+    def get_cursor(self):
+        """The cursor of the newest entry, 0 if no entry was ever added."""
+        return self.next_cursor - 1
+
+    def add(self, prompt_id, entry):
+        """Adds entry (frozen if it isn't already) as the newest one and returns it."""
+        if not isinstance(entry, FrozenDict):
+            entry = freeze(entry)
+        self.remove(prompt_id)
+        cursor = self.next_cursor
+        self.next_cursor += 1
+        self.cursors.append(cursor)
+        self.prompt_ids.append(prompt_id)
+        # The new node covers the slots (i - lowbit(i), i]
+        i = len(self.prompt_ids)
+        count = 1
+        step = 1
+        while step < (i & -i):
+            count += self.tree[i - step]
+            step <<= 1
+        self.tree.append(count)
+        self.entries[prompt_id] = (cursor, i - 1, entry)
+        return entry
+
+    def remove(self, prompt_id):
+        entry = self.entries.pop(prompt_id, None)
+        if entry is None:
+            return None
+        slot = entry[1]
+        self.prompt_ids[slot] = None
+        i = slot + 1
+        while i < len(self.tree):
+            self.tree[i] -= 1
+            i += i & -i
+        removed = len(self.prompt_ids) - len(self.entries)
+        if removed > MIN_COMPACT_SIZE and removed > len(self.entries):
+            self._compact()
+        return entry[2]
+
+    def pop_oldest(self):
+        if len(self.entries) == 0:
+            return None
+        return self.remove(self.prompt_ids[self._find(0)])
+
+    def _compact(self):
+        entries = [self.entries[x] for x in self.prompt_ids if x is not None]
+        prompt_ids = [x for x in self.prompt_ids if x is not None]
+        next_cursor = self.next_cursor
+        self.clear()
+        self.next_cursor = next_cursor
+        for prompt_id, (cursor, _, entry) in zip(prompt_ids, entries):
+            self.next_cursor = cursor
+            self.add(prompt_id, entry)
+        self.next_cursor = next_cursor
+
+    def _find(self, index):
+        """Returns the slot of the entry at index (0 is the oldest)."""
+        position = 0
+        remaining = index + 1
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step > 0:
+            if position + step < len(self.tree) and self.tree[position + step] < remaining:
+                position += step
+                remaining -= self.tree[position]
+            step >>= 1
+        return position
+
+    def _iterate(self, slot, max_items):
+        out = {}
+        while slot < len(self.prompt_ids) and (max_items is None or len(out) < max_items):
+            prompt_id = self.prompt_ids[slot]
+            if prompt_id is not None:
+                out[prompt_id] = self.entries[prompt_id][2]
+            slot += 1
+        return out
+
+    def get_page(self, max_items=None, offset=-1):
+        """
+        Returns {prompt_id: entry} for max_items entries starting at offset, oldest first. A
+        negative offset returns the newest max_items entries.
+        """
+        if offset < 0 and max_items is not None:
+            offset = len(self.entries) - max_items
+        offset = max(offset, 0)
+        if offset >= len(self.entries):
+            return {}
+        return self._iterate(self._find(offset), max_items)
+
+    def get_since(self, cursor, max_items=None):
+        """
+        Returns ({prompt_id: entry}, cursor) for the entries added after cursor, oldest first,
+        and the cursor to pass to get the entries after them.
+        """
+        out = self._iterate(bisect.bisect_right(self.cursors, cursor), max_items)
+        if len(out) > 0:
+            cursor = self.entries[next(reversed(out))][0]
+        return out, cursor
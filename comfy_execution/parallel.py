@@ -0,0 +1,58 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+import torch
+
+from comfy_execution.utils import CurrentNodeContext
+
+
+class ResourceClass(Enum):
+    """
+    The resource a node's FUNCTION is bound by. Node classes declare it with a RESOURCE_CLASS
+    attribute (e.g. RESOURCE_CLASS = "io"). Only CPU and IO nodes are run on the worker pool;
+    everything else, including any node that touches the GPU, runs serialized on the executor
+    thread. Nodes that expand subgraphs or write to shared state (like counters in output
+    filenames) must not declare CPU or IO.
+    """
+    DEVICE = "device"
+    CPU = "cpu"
+    IO = "io"
+
+
+def get_resource_class(class_def) -> ResourceClass:
+    try:
+        return ResourceClass(getattr(class_def, "RESOURCE_CLASS", ResourceClass.DEVICE.value))
+    except ValueError:
+        return ResourceClass.DEVICE
+
+
+def is_offloadable(class_def) -> bool:
+    return get_resource_class(class_def) != ResourceClass.DEVICE
+
+
+class NodeWorkerPool:
+    """
+    Runs the FUNCTION of CPU and IO bound nodes on worker threads. The returned task is awaited
+    by the executor like the result of an async node, so independent branches of the graph
+    keep executing while the worker runs.
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="node_worker")
+
+    def submit(self, f, prompt_id, unique_id, list_index, inputs) -> asyncio.Task:
+        def run():
+            # inference_mode is thread local, so it has to be entered again on the worker
+            with torch.inference_mode(), CurrentNodeContext(prompt_id, unique_id, list_index):
+                return f(**inputs)
+        context = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        async def wait_for_worker():
+            return await loop.run_in_executor(self.executor, context.run, run)
+        return asyncio.create_task(wait_for_worker())
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,280 @@
+"""
+Runs prompts in a child process so that a crashing or leaking node can't take the server down
+and node execution doesn't compete with the server for the GIL.
+
+The parent side (ProcessPromptExecutor) has the same interface as PromptExecutor and is used by
+a prompt worker thread in its place. The child keeps its PromptExecutor, and so its caches,
+across prompts and is only restarted when it dies. Messages sent by the child go through a
+torch.multiprocessing queue, which hands tensors over in shared memory instead of pickling their
+data. Preview images are converted to tensors for the same reason.
+"""
+import gc
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from PIL import Image
+
+import folder_paths
+from comfy_execution.utils import get_prompt_worker_context
+
+# How often the parent checks for interrupts and a dead child while waiting for messages
+POLL_INTERVAL = 0.1
+
+
+class ExecutionProcessExited(Exception):
+    pass
+
+
+class SharedImage:
+    """A PIL image handed over as a tensor so the pixels travel through shared memory."""
+
+    def __init__(self, image: Image.Image):
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+        self.pixels = torch.from_numpy(np.array(image))
+
+    def to_image(self) -> Image.Image:
+        return Image.fromarray(self.pixels.numpy())
+
+
+def share_payload(value):
+    if isinstance(value, Image.Image):
+        return SharedImage(value)
+    elif isinstance(value, tuple):
+        return tuple(share_payload(x) for x in value)
+    elif isinstance(value, list):
+        return [share_payload(x) for x in value]
+    elif isinstance(value, dict):
+        return {k: share_payload(v) for k, v in value.items()}
+    return value
+
+
+def restore_payload(value):
+    if isinstance(value, SharedImage):
+        return value.to_image()
+    elif isinstance(value, tuple):
+        return tuple(restore_payload(x) for x in value)
+    elif isinstance(value, list):
+        return [restore_payload(x) for x in value]
+    elif isinstance(value, dict):
+        return {k: restore_payload(v) for k, v in value.items()}
+    return value
+
+
+class ProcessServerProxy:
+    """
+    Stands in for PromptServer in the execution process and forwards everything sent to clients
+    to the parent process.
+    """
+
+    def __init__(self, events):
+        from aiohttp import web
+        self.events = events
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.sockets_metadata = {}
+        # Custom nodes register their routes on import. They are only served by the parent.
+        self.routes = web.RouteTableDef()
+
+    def send_sync(self, event, data, sid=None):
+        self.events.put(("message", event, share_payload(data), sid))
+
+    def send_progress_text(self, text, node_id, sid=None):
+        from server import PromptServer
+        PromptServer.send_progress_text(self, text, node_id, sid)
+
+    def queue_updated(self):
+        pass
+
+
+def serve(executor, requests, events):
+    """Executes requests from the parent until told to exit. Runs in the child process."""
+    # Imported where it's used, importing it initializes the torch device
+    import comfy.model_management
+    worker = get_prompt_worker_context()
+    commands = queue.Queue()
+
+    def read_requests():
+        while True:
+            request = requests.get()
+            if request[0] == "interrupt":
+                # Interrupts have to reach the executor while it is busy with a prompt
+                comfy.model_management.interrupt_current_processing(flag=worker.interrupt_flag)
+                continue
+            commands.put(request)
+            if request[0] == "exit":
+                return
+
+    threading.Thread(target=read_requests, daemon=True, name="execution_requests").start()
+    events.put(("ready",))
+
+    while True:
+        request = commands.get()
+        kind = request[0]
+        if kind == "execute":
+            _, prompt, prompt_id, extra_data, execute_outputs, sockets_metadata = request
+            executor.server.sockets_metadata = sockets_metadata
+            executor.server.last_prompt_id = prompt_id
+            executor.execute(prompt, prompt_id, extra_data, execute_outputs)
+            events.put(("done", executor.success, executor.history_result, executor.status_messages))
+        elif kind == "reset":
+            executor.reset()
+        elif kind == "unload_models":
+            comfy.model_management.unload_all_models()
+        elif kind == "collect_garbage":
+            gc.collect()
+            comfy.model_management.soft_empty_cache()
+        elif kind == "exit":
+            return
+
+
+def get_directories():
+    """The directories of the parent process, applied in the child with set_directories()."""
+    return {
+        "output": folder_paths.get_output_directory(),
+        "temp": folder_paths.get_temp_directory(),
+        "input": folder_paths.get_input_directory(),
+        "user": folder_paths.get_user_directory(),
+    }
+
+
+def set_directories(directories):
+    folder_paths.set_output_directory(directories["output"])
+    folder_paths.set_temp_directory(directories["temp"])
+    folder_paths.set_input_directory(directories["input"])
+    folder_paths.set_user_directory(directories["user"])
+
+
+class ProcessPromptExecutor:
+    """
+    Executes prompts in a child process started with target(requests, events, worker_name, device,
+    directories). The target is expected to apply the directories with set_directories(), load
+    the nodes, set up a PromptExecutor with a ProcessServerProxy and call serve().
+    """
+
+    def __init__(self, server, worker, target):
+        self.server = server
+        self.worker = worker
+        self.target = target
+        self.context = mp.get_context("spawn")
+        self.process = None
+        self.restarts = 0
+        self.history_result = {}
+        self.success = True
+        self.status_messages = []
+        self.start()
+
+    def start(self):
+        self.requests = self.context.Queue()
+        self.events = self.context.Queue()
+        self.process = self.context.Process(
+            target=self.target,
+            args=(self.requests, self.events, self.worker.name, self.worker.device, get_directories()),
+            name=f"prompt_worker_{self.worker.name}",
+        )
+        self.process.start()
+        event = self.next_event()
+        if event[0] != "ready":
+            raise RuntimeError(f"Unexpected message from execution process: {event[0]}")
+        logging.info(f"Prompt worker {self.worker.name}: execution process {self.process.pid} ready")
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        logging.warning(f"Prompt worker {self.worker.name}: restarting execution process (restart #{self.restarts})")
+        self.start()
+
+    def stop(self, timeout=5.0):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.requests.put(("exit",))
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+        self.process = None
+
+    def next_event(self):
+        import comfy.model_management
+        while True:
+            try:
+                return self.events.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                pass
+            if comfy.model_management.processing_interrupted():
+                comfy.model_management.interrupt_current_processing(False)
+                self.requests.put(("interrupt",))
+            if not self.process.is_alive():
+                raise ExecutionProcessExited(f"Execution process exited with code {self.process.exitcode}")
+
+    def add_message(self, event, data: dict, broadcast: bool):
+        data = {
+            **data,
+            "timestamp": int(time.time() * 1000),
+        }
+        self.status_messages.append((event, data))
+        if self.server.client_id is not None or broadcast:
+            self.server.send_sync(event, data, self.server.client_id)
+
+    def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
+        import comfy.model_management
+        comfy.model_management.interrupt_current_processing(False)
+        self.server.client_id = extra_data.get("client_id", None)
+        self.history_result = {}
+        self.success = True
+        self.status_messages = []
+        executed = set()
+        try:
+            if self.process is None or not self.process.is_alive():
+                self.restart()
+            sockets_metadata = {}
+            if self.server.client_id in self.server.sockets_metadata:
+                sockets_metadata[self.server.client_id] = self.server.sockets_metadata[self.server.client_id]
+            self.requests.put(("execute", prompt, prompt_id, extra_data, execute_outputs, sockets_metadata))
+            while True:
+                event = self.next_event()
+                if event[0] == "message":
+                    _, message_event, data, sid = event
+                    if message_event == "executing" and isinstance(data, dict):
+                        self.server.last_node_id = data.get("display_node", data.get("node", None))
+                        if data.get("node", None) is not None:
+                            executed.add(data["node"])
+                    self.server.send_sync(message_event, restore_payload(data), sid)
+                elif event[0] == "done":
+                    _, self.success, self.history_result, self.status_messages = event
+                    return
+        except ExecutionProcessExited as e:
+            logging.error(f"Prompt worker {self.worker.name}: {e} while executing prompt {prompt_id}")
+            self.success = False
+            node_id = self.server.last_node_id
+            node_type = prompt[node_id]["class_type"] if node_id in prompt else None
+            self.add_message("execution_error", {
+                "prompt_id": prompt_id,
+                "node_id": node_id,
+                "node_type": node_type,
+                "executed": list(executed),
+                "exception_message": str(e),
+                "exception_type": "ExecutionProcessExited",
+                "traceback": [],
+                "current_inputs": {},
+                "current_outputs": [],
+            }, broadcast=False)
+            self.restart()
+        finally:
+            self.server.last_node_id = None
+
+    def reset(self):
+        self.requests.put(("reset",))
+
+    def unload_models(self):
+        self.requests.put(("unload_models",))
+
+    def collect_garbage(self):
+        self.requests.put(("collect_garbage",))
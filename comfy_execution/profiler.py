@@ -0,0 +1,197 @@
+"""
+Per-node execution profiling.
+
+When enabled (--profile-execution, or "profile": true in a prompt's extra_data) the executor
+records for each node its wall time, process CPU time, peak RAM and device memory, whether
+it was served from the cache and the size of the tensors it produced. The result is stored
+in the history entry under "profile" and can be exported as a Chrome/Perfetto trace.
+"""
+import threading
+import time
+
+import psutil
+import torch
+
+from comfy_execution.caching import get_storage_sizes
+
+# Interval at which RSS (and allocated device memory) is sampled while nodes are running
+RAM_SAMPLE_INTERVAL = 0.01
+
+
+class NodeProfile:
+    __slots__ = ("node_id", "class_type", "cached", "start", "end", "cpu_start", "cpu_time",
+                 "ram_start", "ram_peak", "device_memory_baseline", "device_memory_peak", "output_bytes")
+
+    def __init__(self, node_id, class_type, cached=False):
+        self.node_id = node_id
+        self.class_type = class_type
+        self.cached = cached
+        self.start = time.time()
+        self.end = None
+        self.cpu_start = time.process_time()
+        self.cpu_time = 0.0
+        self.ram_start = 0
+        self.ram_peak = 0
+        # Peak allocated device memory of the process when the node started
+        self.device_memory_baseline = None
+        self.device_memory_peak = None
+        self.output_bytes = 0
+
+    def as_dict(self):
+        return {
+            "class_type": self.class_type,
+            "cached": self.cached,
+            "start": self.start,
+            "wall_time": (self.end or self.start) - self.start,
+            "cpu_time": self.cpu_time,
+            "ram_start": self.ram_start,
+            "ram_peak": self.ram_peak,
+            "device_memory_peak": self.device_memory_peak,
+            "output_bytes": self.output_bytes,
+        }
+
+
+class PromptProfiler:
+    """
+    Collects NodeProfiles for one prompt. A node's interval runs from the first time the
+    executor starts it until its outputs are stored, so for async nodes and nodes that expand
+    into subgraphs it includes the time spent waiting on them. CPU time is that of the whole
+    process during the interval, and so is peak device memory: it's the process wide peak when
+    the node reached a new one, otherwise the highest sampled allocation.
+    """
+
+    def __init__(self, prompt_id, device=None):
+        if device is None:
+            # Imported here, importing it initializes the torch device
+            import comfy.model_management
+            device = comfy.model_management.get_torch_device()
+        self.prompt_id = prompt_id
+        self.start = time.time()
+        self.end = None
+        self.nodes = {}
+        self.active = {}
+        self.lock = threading.Lock()
+        self.process = psutil.Process()
+        self.device = device
+        self.sampling = threading.Event()
+        self.sampler = None
+
+    def _rss(self):
+        return self.process.memory_info().rss
+
+    def _device_memory(self):
+        if self.device.type == "cuda":
+            return torch.cuda.memory_allocated(self.device)
+        return None
+
+    def _sample_ram(self):
+        while self.sampling.is_set():
+            rss = self._rss()
+            device_memory = self._device_memory()
+            with self.lock:
+                for profile in self.active.values():
+                    profile.ram_peak = max(profile.ram_peak, rss)
+                    if device_memory is not None:
+                        profile.device_memory_peak = max(profile.device_memory_peak, device_memory)
+            time.sleep(RAM_SAMPLE_INTERVAL)
+
+    def node_cached(self, node_id, class_type):
+        profile = NodeProfile(node_id, class_type, cached=True)
+        profile.end = profile.start
+        with self.lock:
+            self.nodes[node_id] = profile
+
+    def node_started(self, node_id, class_type):
+        with self.lock:
+            if node_id in self.active:
+                return
+            profile = NodeProfile(node_id, class_type)
+            profile.ram_start = profile.ram_peak = self._rss()
+            # The peak stats of the device aren't reset, other nodes (parallel workers, other
+            # prompt workers) and code outside of the profiler rely on them
+            if self.device.type == "cuda":
+                profile.device_memory_baseline = torch.cuda.max_memory_allocated(self.device)
+                profile.device_memory_peak = self._device_memory()
+            self.active[node_id] = profile
+        if self.sampler is None:
+            self.sampling.set()
+            self.sampler = threading.Thread(target=self._sample_ram, daemon=True, name="profiler_ram_sampler")
+            self.sampler.start()
+
+    def node_finished(self, node_id, output_data):
+        with self.lock:
+            profile = self.active.pop(node_id, None)
+        if profile is None:
+            return
+        profile.end = time.time()
+        profile.cpu_time = time.process_time() - profile.cpu_start
+        profile.ram_peak = max(profile.ram_peak, self._rss())
+        if self.device.type == "cuda":
+            # A new process wide peak was reached while the node ran. Otherwise the node's peak
+            # is below the previous one and only known from the samples.
+            peak = torch.cuda.max_memory_allocated(self.device)
+            if peak > profile.device_memory_baseline:
+                profile.device_memory_peak = peak
+            else:
+                profile.device_memory_peak = max(profile.device_memory_peak, self._device_memory())
+        profile.output_bytes = sum(get_storage_sizes(output_data).values())
+        with self.lock:
+            self.nodes[node_id] = profile
+
+    def finish(self):
+        self.end = time.time()
+        self.sampling.clear()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+        with self.lock:
+            # Nodes that never finished (errors, interrupts) are recorded up to now
+            for node_id, profile in self.active.items():
+                profile.end = self.end
+                profile.cpu_time = time.process_time() - profile.cpu_start
+                self.nodes[node_id] = profile
+            self.active = {}
+
+    def get_result(self):
+        with self.lock:
+            nodes = {node_id: profile.as_dict() for node_id, profile in self.nodes.items()}
+        return {
+            "prompt_id": self.prompt_id,
+            "start": self.start,
+            "wall_time": (self.end or time.time()) - self.start,
+            "device": str(self.device),
+            "nodes": nodes,
+        }
+
+
+def to_chrome_trace(profile):
+    """
+    Converts a stored profile to the Chrome trace event format, which can be loaded in
+    chrome://tracing or ui.perfetto.dev. Overlapping nodes are placed on separate tracks.
+    """
+    events = [{
+        "name": "process_name", "ph": "M", "pid": 0,
+        "args": {"name": f"prompt {profile['prompt_id']}"},
+    }]
+    lanes = []
+    for node_id, node in sorted(profile["nodes"].items(), key=lambda x: x[1]["start"]):
+        start = node["start"]
+        end = start + node["wall_time"]
+        for lane, lane_end in enumerate(lanes):
+            if lane_end <= start:
+                break
+        else:
+            lane = len(lanes)
+            lanes.append(end)
+        lanes[lane] = end
+        events.append({
+            "name": node["class_type"],
+            "cat": "cached" if node["cached"] else "node",
+            "ph": "X",
+            "ts": (start - profile["start"]) * 1e6,
+            "dur": node["wall_time"] * 1e6,
+            "pid": 0,
+            "tid": lane,
+            "args": {"node_id": node_id, **{k: v for k, v in node.items() if k not in ("class_type", "start")}},
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import threading
+import time
 from typing import TypedDict, Dict, Optional, Tuple
 from typing_extensions import override
 from PIL import Image
@@ -11,6 +13,8 @@ if TYPE_CHECKING:
     from comfy_execution.graph import DynamicPrompt
 from protocol import BinaryEventTypes
 from comfy_api import feature_flags
+from comfy.cli_args import args
+from comfy_execution.utils import get_prompt_worker_context
 
 PreviewImageTuple = Tuple[str, Image.Image, Optional[int]]
 
@@ -150,47 +154,108 @@ class CLIProgressHandler(ProgressHandler):
 class WebUIProgressHandler(ProgressHandler):
     """
     Handler that sends progress updates to the WebUI via WebSockets.
+
+    Only the nodes whose state changed since the last progress_state message are sent to
+    clients that support it ("supports_progress_state_delta" feature flag), those messages
+    have "delta": true. Other clients get the state of every node. Updates of the progress
+    of a node are coalesced to at most --max-progress-state-rate messages per second, the
+    start and end of a node are sent right away. A client gets the state of every node when
+    it connects or sends a {"type": "get_progress_state"} message.
     """
 
     def __init__(self, server_instance):
         super().__init__("webui")
         self.server_instance = server_instance
+        self.client_id = server_instance.client_id if server_instance is not None else None
+        self.registry = None
+        # Updates can come from the prompt worker and the flushes from the event loop
+        self.lock = threading.Lock()
+        # Node id -> state last sent to the client
+        self.sent: Dict[str, dict] = {}
+        self.dirty = set()
+        self.prompt_id = None
+        self.last_send = 0.0
+        self.flush_scheduled = False
+        rate = args.max_progress_state_rate
+        self.interval = 1.0 / rate if rate > 0 else 0.0
 
     def set_registry(self, registry: "ProgressRegistry"):
         self.registry = registry
 
-    def _send_progress_state(self, prompt_id: str, nodes: Dict[str, NodeProgressState]):
-        """Send the current progress state to the client"""
-        if self.server_instance is None:
-            return
-
-        # Only send info for non-pending nodes
-        active_nodes = {
-            node_id: {
-                "value": state["value"],
-                "max": state["max"],
-                "state": state["state"].value,
-                "node_id": node_id,
-                "prompt_id": prompt_id,
-                "display_node_id": self.registry.dynprompt.get_display_node_id(node_id),
-                "parent_node_id": self.registry.dynprompt.get_parent_node_id(node_id),
-                "real_node_id": self.registry.dynprompt.get_real_node_id(node_id),
-            }
-            for node_id, state in nodes.items()
-            if state["state"] != NodeState.Pending
+    def _get_node_state(self, prompt_id: str, node_id: str, state: NodeProgressState):
+        return {
+            "value": state["value"],
+            "max": state["max"],
+            "state": state["state"].value,
+            "node_id": node_id,
+            "prompt_id": prompt_id,
+            "display_node_id": self.registry.dynprompt.get_display_node_id(node_id),
+            "parent_node_id": self.registry.dynprompt.get_parent_node_id(node_id),
+            "real_node_id": self.registry.dynprompt.get_real_node_id(node_id),
         }
 
-        # Send a combined progress_state message with all node states
-        # Include client_id to ensure message is only sent to the initiating client
-        self.server_instance.send_sync(
-            "progress_state", {"prompt_id": prompt_id, "nodes": active_nodes}, self.server_instance.client_id
-        )
+    def _send_progress_state(self, prompt_id: str, node_ids, immediate=False):
+        """Send the state of the changed nodes to the client"""
+        if self.server_instance is None:
+            return
+        with self.lock:
+            self.prompt_id = prompt_id
+            self.dirty.update(node_ids)
+            delay = self.last_send + self.interval - time.monotonic()
+            if delay > 0 and not immediate:
+                if not self.flush_scheduled:
+                    self.flush_scheduled = True
+                    loop = getattr(self.server_instance, "loop", None)
+                    if loop is not None:
+                        loop.call_soon_threadsafe(loop.call_later, delay, self.flush)
+                    else:
+                        # The server proxy of an execution process (--execution-subprocess) has no event loop
+                        timer = threading.Timer(delay, self.flush)
+                        timer.daemon = True
+                        timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Send the state of the nodes that changed since the last progress_state message"""
+        with self.lock:
+            self.flush_scheduled = False
+            changed = {}
+            for node_id in self.dirty:
+                state = self.registry.nodes.get(node_id, None)
+                # Only send info for non-pending nodes
+                if state is None or state["state"] == NodeState.Pending:
+                    continue
+                node_state = self._get_node_state(self.prompt_id, node_id, state)
+                if self.sent.get(node_id, None) != node_state:
+                    self.sent[node_id] = node_state
+                    changed[node_id] = node_state
+            self.dirty.clear()
+            if len(changed) == 0:
+                return
+            self.last_send = time.monotonic()
+            if feature_flags.supports_feature(self.server_instance.sockets_metadata, self.client_id, "supports_progress_state_delta"):
+                message = {"prompt_id": self.prompt_id, "nodes": changed, "delta": True}
+            else:
+                message = {"prompt_id": self.prompt_id, "nodes": dict(self.sent)}
+            # Send a combined progress_state message, while holding the lock so the messages
+            # are queued in order
+            # Include client_id to ensure message is only sent to the initiating client
+            self.server_instance.send_sync("progress_state", message, self.client_id)
+
+    def send_snapshot(self, sid: str):
+        """Send the state of every node to the client sid"""
+        if self.server_instance is None or self.prompt_id is None:
+            return
+        self.flush()
+        with self.lock:
+            self.server_instance.send_sync("progress_state", {"prompt_id": self.prompt_id, "nodes": dict(self.sent)}, sid)
 
     @override
     def start_handler(self, node_id: str, state: NodeProgressState, prompt_id: str):
-        # Send progress state of all nodes
+        # Send the new state right away
         if self.registry:
-            self._send_progress_state(prompt_id, self.registry.nodes)
+            self._send_progress_state(prompt_id, [node_id], immediate=True)
 
     @override
     def update_handler(
@@ -202,9 +267,8 @@ class WebUIProgressHandler(ProgressHandler):
         prompt_id: str,
         image: PreviewImageTuple | None = None,
     ):
-        # Send progress state of all nodes
         if self.registry:
-            self._send_progress_state(prompt_id, self.registry.nodes)
+            self._send_progress_state(prompt_id, [node_id])
         if image:
             # Only send new format if client supports it
             if feature_flags.supports_feature(
@@ -231,9 +295,9 @@ class WebUIProgressHandler(ProgressHandler):
 
     @override
     def finish_handler(self, node_id: str, state: NodeProgressState, prompt_id: str):
-        # Send progress state of all nodes
+        # Send the new state right away
         if self.registry:
-            self._send_progress_state(prompt_id, self.registry.nodes)
+            self._send_progress_state(prompt_id, [node_id], immediate=True)
 
 class ProgressRegistry:
     """
@@ -319,18 +383,24 @@ class ProgressRegistry:
         for handler in self.handlers.values():
             handler.reset()
 
-# Global registry instance
+# Global registry instance, used when executing outside of a prompt worker
 global_progress_registry: ProgressRegistry | None = None
 
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
+    worker = get_prompt_worker_context()
+    registry = worker.progress_registry if worker is not None else global_progress_registry
 
     # Reset existing handlers if registry exists
-    if global_progress_registry is not None:
-        global_progress_registry.reset_handlers()
+    if registry is not None:
+        registry.reset_handlers()
 
     # Create new registry
-    global_progress_registry = ProgressRegistry(prompt_id, dynprompt)
+    registry = ProgressRegistry(prompt_id, dynprompt)
+    if worker is not None:
+        worker.progress_registry = registry
+    else:
+        global_progress_registry = registry
 
 
 def add_progress_handler(handler: ProgressHandler) -> None:
@@ -341,6 +411,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    worker = get_prompt_worker_context()
+    if worker is not None and worker.progress_registry is not None:
+        return worker.progress_registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
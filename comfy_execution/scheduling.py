@@ -0,0 +1,125 @@
+"""
+Model affinity aware queue ordering.
+
+With --model-affinity-window N the prompt queue doesn't always run the oldest prompt next:
+among the oldest prompt and the N following ones it runs the one that needs the fewest model
+files that aren't already loaded by the worker, so alternating workflows using different
+checkpoints don't swap models on every prompt. A prompt is passed over at most N times, after
+which it runs regardless of the models it needs.
+
+The model files of a prompt are the values of its inputs that name a model file. A file is
+resident for a worker if a model loaded while that worker executed a prompt using the file is
+still in comfy.model_management.current_loaded_models. When prompts are executed in a
+subprocess the loaded models aren't visible, and the files of the last prompt executed by the
+worker are assumed to be resident instead.
+"""
+import heapq
+import os
+import threading
+import weakref
+
+import folder_paths
+from comfy.cli_args import args
+
+
+def get_prompt_models(prompt):
+    """Returns the model files named by the inputs of the nodes of a prompt."""
+    models = set()
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                models.add(value)
+    return frozenset(models)
+
+
+def get_loaded_models():
+    # Imported where it's used, importing it initializes the torch device
+    import comfy.model_management
+    return comfy.model_management.current_loaded_models
+
+
+class ModelAffinityScheduler:
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        # Per prompt id: the model files it uses and how many times it was passed over
+        self.prompt_models = {}
+        self.passed_over = {}
+        # Per worker name: model file -> weak references to the LoadedModels it caused
+        self.loaded = {}
+        self.last_models = {}
+        # Per running prompt id: (worker name, model files, LoadedModels before it started)
+        self.running = {}
+        self.stats = {
+            "prompts_scheduled": 0,
+            "prompts_reordered": 0,
+            "model_swaps": 0,
+            "model_swaps_saved": 0,
+        }
+
+    def get_models(self, item):
+        if item[1] not in self.prompt_models:
+            self.prompt_models[item[1]] = get_prompt_models(item[2])
+        return self.prompt_models[item[1]]
+
+    def get_resident_models(self, worker_name):
+        if args.execution_subprocess:
+            return self.last_models.get(worker_name, frozenset())
+        current = get_loaded_models()
+        resident = set()
+        for model_file, refs in self.loaded.get(worker_name, {}).items():
+            for ref in refs:
+                loaded_model = ref()
+                if loaded_model is not None and loaded_model.model is not None and any(x is loaded_model for x in current):
+                    resident.add(model_file)
+                    break
+        return resident
+
+    def choose(self, queue, worker_name):
+        """
+        Returns the item of the heap queue to execute next on the worker. The caller removes
+        it from the queue.
+        """
+        with self.lock:
+            candidates = heapq.nsmallest(self.window + 1, queue)
+            resident = self.get_resident_models(worker_name)
+            missing = [len(self.get_models(x) - resident) for x in candidates]
+            chosen = 0
+            if missing[0] > 0 and self.passed_over.get(candidates[0][1], 0) < self.window:
+                chosen = min(range(len(candidates)), key=lambda i: (missing[i], i))
+
+            for x in candidates[:chosen]:
+                self.passed_over[x[1]] = self.passed_over.get(x[1], 0) + 1
+            item = candidates[chosen]
+            self.stats["prompts_scheduled"] += 1
+            self.stats["model_swaps"] += missing[chosen]
+            if chosen != 0:
+                self.stats["prompts_reordered"] += 1
+                self.stats["model_swaps_saved"] += missing[0] - missing[chosen]
+
+            self.passed_over.pop(item[1], None)
+            before = [weakref.ref(x) for x in get_loaded_models()]
+            self.running[item[1]] = (worker_name, self.prompt_models.pop(item[1]), before)
+            return item
+
+    def prompt_done(self, prompt_id):
+        with self.lock:
+            running = self.running.pop(prompt_id, None)
+            if running is None:
+                return
+            worker_name, models, before = running
+            self.last_models[worker_name] = models
+            before = [x() for x in before]
+            new = [weakref.ref(x) for x in get_loaded_models() if not any(x is y for y in before)]
+            loaded = self.loaded.setdefault(worker_name, {})
+            for model_file in models:
+                loaded[model_file] = [x for x in loaded.get(model_file, []) if x() is not None] + new
+
+    def forget(self, prompt_id):
+        with self.lock:
+            self.prompt_models.pop(prompt_id, None)
+            self.passed_over.pop(prompt_id, None)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
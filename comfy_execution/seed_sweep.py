@@ -0,0 +1,154 @@
+"""
+Seed sweeps.
+
+Clients often queue many prompts that are identical except for the seed of their sampler.
+With --seed-sweep-batch-size the queue hands such prompts to a worker together: they are
+executed as the first prompt, with the sampler given the list of all the seeds. The sampler
+denoises one copy of its latent per seed (see common_ksampler), the nodes after it work on
+the whole batch and the results are split back into one history entry per prompt.
+
+Only prompts with a single sampler declaring SEED_SWEEP_INPUT are coalesced, and only when
+that sampler is deterministic given its initial noise, so every image is the one the prompt
+would have produced on its own.
+"""
+import contextvars
+import json
+from typing import NamedTuple, Optional
+
+import nodes
+from comfy_execution.graph_utils import is_link
+
+# Samplers that draw new noise at every step draw it for the whole batch at once, so their
+# results depend on the other prompts of the batch.
+STOCHASTIC_SAMPLERS = ("ancestral", "sde", "ddpm", "lcm", "seeds_", "sa_solver")
+
+# The sweep being executed, used by output nodes to write the metadata of the right prompt
+current_seed_sweep = contextvars.ContextVar("current_seed_sweep", default=None)
+
+
+class SweepKey(NamedTuple):
+    key: str
+    node_id: str
+    seed_input: str
+    seed: int
+
+
+def is_deterministic_sampler(sampler_name):
+    return isinstance(sampler_name, str) and not any(x in sampler_name for x in STOCHASTIC_SAMPLERS)
+
+
+def get_sweep_key(item) -> Optional[SweepKey]:
+    """
+    Returns the key shared by all the queue items that only differ from item in the seed of
+    their sampler, or None if item can't be part of a sweep.
+    """
+    prompt, extra_data, outputs_to_execute = item[2], item[3], item[4]
+    if outputs_to_execute is None:
+        # Not validated yet (--lazy-prompt-validation)
+        return None
+    sweep_node = None
+    for node_id, node in prompt.items():
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node["class_type"])
+        if getattr(class_def, "SEED_SWEEP_INPUT", None) is None:
+            continue
+        if sweep_node is not None:
+            return None
+        sweep_node = node_id
+    if sweep_node is None:
+        return None
+
+    node = prompt[sweep_node]
+    seed_input = nodes.NODE_CLASS_MAPPINGS[node["class_type"]].SEED_SWEEP_INPUT
+    seed = node["inputs"].get(seed_input)
+    if not isinstance(seed, int) or isinstance(seed, bool) or not is_deterministic_sampler(node["inputs"].get("sampler_name")):
+        return None
+
+    normalized = {**prompt, sweep_node: {**node, "inputs": {**node["inputs"], seed_input: None}}}
+    key = json.dumps([normalized, extra_data.get("client_id"), sorted(outputs_to_execute)], sort_keys=True)
+    return SweepKey(key, sweep_node, seed_input, seed)
+
+
+def create_sweep_item(items, sweep_key):
+    """Builds the queue item executing the prompts of items as one seed sweep."""
+    first = items[0]
+    sweep = {
+        "node_id": sweep_key.node_id,
+        "seed_input": sweep_key.seed_input,
+        "seeds": [x[2][sweep_key.node_id]["inputs"][sweep_key.seed_input] for x in items],
+        "prompt_ids": [x[1] for x in items],
+        "prompts": [x[2] for x in items],
+        "extra_pnginfo": [x[3].get("extra_pnginfo", None) for x in items],
+    }
+    return (first[0], first[1], first[2], {**first[3], "seed_sweep": sweep}, first[4])
+
+
+def apply_seed_sweep(dynprompt, sweep):
+    dynprompt.override_inputs(sweep["node_id"], {sweep["seed_input"]: list(sweep["seeds"])})
+
+
+def get_batch_metadata(batch_number, batch_size, prompt, extra_pnginfo):
+    """
+    Returns the prompt and extra_pnginfo to store with image batch_number of a batch. During
+    a seed sweep these are the ones of the prompt the image belongs to.
+    """
+    sweep = current_seed_sweep.get()
+    if sweep is None or batch_size % len(sweep["seeds"]) != 0:
+        return prompt, extra_pnginfo
+    index = batch_number // (batch_size // len(sweep["seeds"]))
+    return sweep["prompts"][index], sweep["extra_pnginfo"][index]
+
+
+def get_downstream_nodes(prompt, node_id):
+    consumers = {}
+    for x, node in prompt.items():
+        for value in node["inputs"].values():
+            if is_link(value):
+                consumers.setdefault(value[0], set()).add(x)
+    downstream = set()
+    pending = [node_id]
+    while pending:
+        for x in consumers.get(pending.pop(), ()):
+            if x not in downstream:
+                downstream.add(x)
+                pending.append(x)
+    return downstream
+
+
+def split_history_result(history_result, sweep):
+    """
+    Splits the history result of a seed sweep into one result per prompt. The lists in the
+    UI output of nodes after the sampler are divided in equal parts, other outputs are
+    shared by all the prompts.
+    """
+    count = len(sweep["seeds"])
+    downstream = get_downstream_nodes(sweep["prompts"][0], sweep["node_id"])
+    results = []
+    for index in range(count):
+        outputs = {}
+        for node_id, output in history_result.get("outputs", {}).items():
+            if node_id not in downstream:
+                outputs[node_id] = output
+                continue
+            outputs[node_id] = {}
+            for key, value in output.items():
+                if isinstance(value, list) and len(value) % count == 0:
+                    size = len(value) // count
+                    value = value[index * size:(index + 1) * size]
+                outputs[node_id][key] = value
+        results.append({**history_result, "outputs": outputs})
+    return results
+
+
+def send_sweep_results(server, client_id, prompt_ids, results, success):
+    """
+    Sends the messages of the prompts of a sweep other than the one it was executed as, so
+    clients see each of their prompts finish with its own outputs.
+    """
+    if client_id is None:
+        return
+    for prompt_id, result in zip(prompt_ids, results):
+        for node_id, output in result["outputs"].items():
+            display_node = result.get("meta", {}).get(node_id, {}).get("display_node", node_id)
+            server.send_sync("executed", { "node": node_id, "display_node": display_node, "output": output, "prompt_id": prompt_id }, client_id)
+        if success:
+            server.send_sync("execution_success", { "prompt_id": prompt_id }, client_id)
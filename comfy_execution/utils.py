@@ -44,3 +44,27 @@ class CurrentNodeContext:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.token is not None:
             current_executing_context.reset(self.token)
+
+class PromptWorkerContext:
+    """
+    State owned by one prompt worker. It is set once in the worker thread's context and is
+    visible to everything executing on behalf of that worker, including the asyncio tasks and
+    node worker pool threads it starts, since those copy the context.
+
+    Attributes:
+        name: The name reported in the queue and history for prompts run by this worker
+        device: The torch device the worker's models are loaded to, or None for the default device
+    """
+    def __init__(self, name: str, device=None):
+        self.name = name
+        self.device = device
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.progress_registry = None
+        self.interrupt_flag = None
+
+current_prompt_worker: contextvars.ContextVar[Optional[PromptWorkerContext]] = contextvars.ContextVar("current_prompt_worker", default=None)
+
+def get_prompt_worker_context() -> Optional[PromptWorkerContext]:
+    return current_prompt_worker.get(None)
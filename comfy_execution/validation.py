@@ -1,5 +1,9 @@
 from __future__ import annotations
 
+from collections import OrderedDict
+
+import folder_paths
+
 
 def validate_node_input(
     received_type: str, input_type: str, strict: bool = False
@@ -37,3 +41,67 @@ def validate_node_input(
     else:
         # In non-strict mode, there must be at least one type in common
         return len(received_types.intersection(input_types)) > 0
+
+
+class InputTypesCache:
+    """
+    Caches the result of INPUT_TYPES() per node class so that validating a prompt doesn't
+    rescan model folders and the input directory for every node. The cache is dropped whenever
+    folder_paths reports a folder change. Node classes whose input types depend on anything
+    else can opt out with CACHE_INPUT_TYPES = False.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = {}
+
+    def get(self, class_def):
+        if not getattr(class_def, "CACHE_INPUT_TYPES", True):
+            return class_def.INPUT_TYPES()
+        version = folder_paths.get_folder_version()
+        if version != self.version:
+            self.entries = {}
+            self.version = version
+        input_types = self.entries.get(class_def, None)
+        if input_types is None:
+            input_types = class_def.INPUT_TYPES()
+            self.entries[class_def] = input_types
+        return input_types
+
+
+def freeze_literal(value):
+    """Returns a hashable, type tagged copy of a literal (JSON) input value."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return (type(value).__name__, value)
+    elif isinstance(value, list):
+        return ("list", tuple(freeze_literal(x) for x in value))
+    elif isinstance(value, dict):
+        return ("dict", tuple(sorted((str(k), freeze_literal(v)) for k, v in value.items())))
+    raise TypeError(f"Unsupported literal input type {type(value).__name__}")
+
+
+class ValidationMemo:
+    """
+    An LRU of the checks validate_inputs makes on the literal inputs of a node, keyed by the
+    node class and its literal inputs. Checks involving links are always made.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def set(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+input_types_cache = InputTypesCache()
+validation_memo = ValidationMemo()
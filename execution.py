@@ -1,3 +1,4 @@
+import collections
 import copy
 import heapq
 import inspect
@@ -6,12 +7,14 @@ import sys
 import threading
 import time
 import traceback
+import weakref
 from enum import Enum
 from typing import List, Literal, NamedTuple, Optional, Union
 import asyncio
 
 import torch
 
+import comfy.metrics
 import comfy.model_management
 import nodes
 from comfy_execution.caching import (
@@ -21,6 +24,8 @@ from comfy_execution.caching import (
     DependencyAwareCache,
     HierarchicalCache,
     LRUCache,
+    RAMBudgetLRUCache,
+    find_duplicate_nodes,
 )
 from comfy_execution.graph import (
     DynamicPrompt,
@@ -29,9 +34,23 @@ from comfy_execution.graph import (
     get_input_info,
 )
 from comfy_execution.graph_utils import GraphBuilder, is_link
-from comfy_execution.validation import validate_node_input
+from comfy_execution.history import HistoryIndex
+from comfy_execution.validation import validate_node_input, freeze_literal, input_types_cache, validation_memo
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
+from comfy_execution.parallel import NodeWorkerPool, is_offloadable
+from comfy_execution.profiler import PromptProfiler
+from comfy_execution.fair_queue import DeficitRoundRobin, parse_weights
+from comfy_execution.scheduling import ModelAffinityScheduler
+from comfy_execution.seed_sweep import (
+    apply_seed_sweep,
+    create_sweep_item,
+    current_seed_sweep,
+    get_sweep_key,
+    send_sweep_results,
+    split_history_result,
+)
+from comfy.cli_args import args
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
 from comfy_api.latest import io
 
@@ -44,6 +63,19 @@ class ExecutionResult(Enum):
 class DuplicateNodeError(Exception):
     pass
 
+# The executors of this process, for the cache metrics
+EXECUTORS = weakref.WeakSet()
+
+def get_cache_bytes():
+    ram = sum(getattr(e.caches.outputs, "total_bytes", 0) for e in list(EXECUTORS))
+    disk_caches = {id(e.disk_cache): e.disk_cache for e in list(EXECUTORS) if e.disk_cache is not None}
+    disk = sum(x.get_stats()["bytes"] for x in disk_caches.values())
+    return {("ram",): ram, ("disk",): disk}
+
+NODE_EXECUTION_SECONDS = comfy.metrics.Histogram("comfyui_node_execution_seconds", "Time spent executing a node, excluding the nodes whose outputs were cached.", ["class_type"])
+CACHE_REQUESTS = comfy.metrics.Counter("comfyui_cache_requests_total", "Nodes whose outputs were found in the cache (hit) or had to be executed (miss).", ["result"])
+CACHE_BYTES = comfy.metrics.Gauge("comfyui_cache_bytes", "Size of the cached node outputs, only measured by the RAM budget (--cache-ram) and disk caches.", ["tier"], function=get_cache_bytes)
+
 class IsChangedCache:
     def __init__(self, prompt_id: str, dynprompt: DynamicPrompt, outputs_cache: BasicCache):
         self.prompt_id = prompt_id
@@ -92,10 +124,11 @@ class CacheType(Enum):
     CLASSIC = 0
     LRU = 1
     DEPENDENCY_AWARE = 2
+    RAM_BUDGET = 3
 
 
 class CacheSet:
-    def __init__(self, cache_type=None, cache_size=None):
+    def __init__(self, cache_type=None, cache_size=None, disk_cache=None):
         if cache_type == CacheType.DEPENDENCY_AWARE:
             self.init_dependency_aware_cache()
             logging.info("Disabling intermediate node cache.")
@@ -104,9 +137,15 @@ class CacheSet:
                 cache_size = 0
             self.init_lru_cache(cache_size)
             logging.info("Using LRU cache")
+        elif cache_type == CacheType.RAM_BUDGET:
+            self.init_ram_budget_cache(cache_size)
+            logging.info("Using LRU cache with a RAM budget of {:.2f} GB".format(cache_size / (1024 * 1024 * 1024)))
         else:
             self.init_classic_cache()
 
+        if disk_cache is not None:
+            self.outputs.set_disk_cache(disk_cache)
+
         self.all = [self.outputs, self.ui, self.objects]
 
     # Performs like the old cache -- dump data ASAP
@@ -120,6 +159,13 @@ class CacheSet:
         self.ui = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
         self.objects = HierarchicalCache(CacheKeySetID)
 
+    # cache_size is the budget in bytes
+    def init_ram_budget_cache(self, cache_size):
+        self.outputs = RAMBudgetLRUCache(CacheKeySetInputSignature, max_bytes=cache_size)
+        # UI results don't hold tensors, so they are only bounded by count
+        self.ui = LRUCache(CacheKeySetInputSignature, max_size=10000)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
     # only hold cached items while the decendents have not executed
     def init_dependency_aware_cache(self):
         self.outputs = DependencyAwareCache(CacheKeySetInputSignature)
@@ -214,7 +260,7 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, worker_pool=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -272,6 +318,8 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                     results.append(result)
                 else:
                     results.append(task)
+            elif worker_pool is not None:
+                results.append(worker_pool.submit(f, prompt_id, unique_id, index, inputs))
             else:
                 with CurrentNodeContext(prompt_id, unique_id, index):
                     result = f(**inputs)
@@ -311,8 +359,8 @@ def merge_result_data(results, obj):
             output.append([o[i] for o in results])
     return output
 
-async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, worker_pool=None):
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, worker_pool=worker_pool)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -392,7 +440,18 @@ def format_value(x):
     else:
         return str(x)
 
-async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes):
+def report_duplicates(server, dynprompt, unique_id, prompt_id, output_ui):
+    """Reports the nodes merged into unique_id as executed. Returns their ids."""
+    duplicates = dynprompt.get_duplicates(unique_id)
+    for duplicate_id in duplicates:
+        if server.client_id is not None:
+            server.send_sync("executing", { "node": duplicate_id, "display_node": duplicate_id, "prompt_id": prompt_id }, server.client_id)
+            if output_ui:
+                server.send_sync("executed", { "node": duplicate_id, "display_node": duplicate_id, "output": output_ui, "prompt_id": prompt_id }, server.client_id)
+        get_progress_state().finish_progress(duplicate_id)
+    return duplicates
+
+async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, worker_pool=None, profiler=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -401,12 +460,21 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     class_type = dynprompt.get_node(unique_id)['class_type']
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
     if caches.outputs.get(unique_id) is not None:
+        CACHE_REQUESTS.inc("hit")
         if server.client_id is not None:
             cached_output = caches.ui.get(unique_id) or {}
             server.send_sync("executed", { "node": unique_id, "display_node": display_node_id, "output": cached_output.get("output",None), "prompt_id": prompt_id }, server.client_id)
         get_progress_state().finish_progress(unique_id)
+        if profiler is not None:
+            profiler.node_cached(unique_id, class_type)
+        report_duplicates(server, dynprompt, unique_id, prompt_id, cached_output.get("output", None) if server.client_id is not None else None)
         return (ExecutionResult.SUCCESS, None, None)
 
+    if unique_id not in pending_async_nodes and unique_id not in pending_subgraph_results:
+        CACHE_REQUESTS.inc("miss")
+    if profiler is not None:
+        profiler.node_started(unique_id, class_type)
+    start_time = time.perf_counter()
     input_data_all = None
     try:
         if unique_id in pending_async_nodes:
@@ -493,7 +561,9 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+            if worker_pool is not None and not is_offloadable(class_def):
+                worker_pool = None
+            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, worker_pool=worker_pool)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -554,6 +624,9 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             pending_subgraph_results[unique_id] = cached_outputs
             return (ExecutionResult.PENDING, None, None)
         caches.outputs.set(unique_id, output_data)
+        NODE_EXECUTION_SECONDS.observe(time.perf_counter() - start_time, class_type)
+        if profiler is not None:
+            profiler.node_finished(unique_id, output_data)
     except comfy.model_management.InterruptProcessingException as iex:
         logging.info("Processing interrupted")
 
@@ -593,18 +666,22 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
 
     get_progress_state().finish_progress(unique_id)
     executed.add(unique_id)
+    executed.update(report_duplicates(server, dynprompt, unique_id, prompt_id, output_ui))
 
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, cache_type=False, cache_size=None):
+    def __init__(self, server, cache_type=False, cache_size=None, disk_cache=None, parallel_workers=0):
         self.cache_size = cache_size
         self.cache_type = cache_type
+        self.disk_cache = disk_cache
         self.server = server
+        self.worker_pool = NodeWorkerPool(parallel_workers) if parallel_workers > 0 else None
         self.reset()
+        EXECUTORS.add(self)
 
     def reset(self):
-        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size)
+        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size, disk_cache=self.disk_cache)
         self.status_messages = []
         self.success = True
 
@@ -659,11 +736,23 @@ class PromptExecutor:
         self.status_messages = []
         self.add_message("execution_start", { "prompt_id": prompt_id}, broadcast=False)
 
+        profiler = None
+        if args.profile_execution or extra_data.get("profile", False):
+            profiler = PromptProfiler(prompt_id)
+
         with torch.inference_mode():
             dynamic_prompt = DynamicPrompt(prompt)
+            seed_sweep = extra_data.get("seed_sweep", None)
+            if seed_sweep is not None:
+                apply_seed_sweep(dynamic_prompt, seed_sweep)
+                current_seed_sweep.set(seed_sweep)
             reset_progress_state(prompt_id, dynamic_prompt)
             add_progress_handler(WebUIProgressHandler(self.server))
             is_changed_cache = IsChangedCache(prompt_id, dynamic_prompt, self.caches.outputs)
+            # Identical nodes are executed once, with their consumers rewired to the remaining node
+            duplicate_of = await find_duplicate_nodes(dynamic_prompt, list(prompt.keys()), is_changed_cache)
+            dynamic_prompt.merge_duplicate_nodes(duplicate_of)
+            execute_outputs = list(dict.fromkeys(duplicate_of.get(x, x) for x in execute_outputs))
             for cache in self.caches.all:
                 await cache.set_prompt(dynamic_prompt, prompt.keys(), is_changed_cache)
                 cache.clean_unused()
@@ -680,7 +769,7 @@ class PromptExecutor:
             pending_subgraph_results = {}
             pending_async_nodes = {} # TODO - Unify this with pending_subgraph_results
             executed = set()
-            execution_list = ExecutionList(dynamic_prompt, self.caches.outputs)
+            execution_list = ExecutionList(dynamic_prompt, self.caches.outputs, prefer_offloadable=self.worker_pool is not None)
             current_outputs = self.caches.outputs.all_node_ids()
             for node_id in list(execute_outputs):
                 execution_list.add_node(node_id)
@@ -692,7 +781,7 @@ class PromptExecutor:
                     break
 
                 assert node_id is not None, "Node ID should not be None at this point"
-                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
+                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, self.worker_pool, profiler)
                 self.success = result != ExecutionResult.FAILURE
                 if result == ExecutionResult.FAILURE:
                     self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
@@ -717,6 +806,9 @@ class PromptExecutor:
                 "outputs": ui_outputs,
                 "meta": meta_outputs,
             }
+            if profiler is not None:
+                profiler.finish()
+                self.history_result["profile"] = profiler.get_result()
             self.server.last_node_id = None
             if comfy.model_management.DISABLE_SMART_MEMORY:
                 comfy.model_management.unload_all_models()
@@ -731,7 +823,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
     class_type = prompt[unique_id]['class_type']
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
+    class_inputs = input_types_cache.get(obj_class)
     valid_inputs = set(class_inputs.get('required',{})).union(set(class_inputs.get('optional',{})))
 
     errors = []
@@ -751,10 +843,30 @@ async def validate_inputs(prompt_id, prompt, item, validated):
         validate_has_kwargs = argspec.varkw is not None
     received_types = {}
 
+    # The checks on literal inputs only depend on the class and the values, so their outcome
+    # is memoized. Nodes with custom validation are always validated in full.
+    memo_key = None
+    memo = None
+    if validate_function is None and getattr(obj_class, "CACHE_INPUT_TYPES", True):
+        try:
+            literal_inputs = tuple(sorted((k, freeze_literal(v)) for k, v in inputs.items() if not is_link(v)))
+            linked_inputs = tuple(sorted(k for k, v in inputs.items() if is_link(v)))
+            memo_key = (obj_class, input_types_cache.version, literal_inputs, linked_inputs)
+            memo = validation_memo.get(memo_key)
+        except TypeError:
+            memo_key = None
+    if memo is not None:
+        literal_errors, converted_inputs = memo
+        errors.extend(copy.deepcopy(literal_errors))
+        inputs.update(copy.deepcopy(converted_inputs))
+    literal_errors = []
+
     for x in valid_inputs:
         input_type, input_category, extra_info = get_input_info(obj_class, x, class_inputs)
         assert extra_info is not None
         if x not in inputs:
+            if memo is not None:
+                continue
             if input_category == "required":
                 error = {
                     "type": "required_input_missing",
@@ -764,7 +876,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                         "input_name": x
                     }
                 }
-                errors.append(error)
+                literal_errors.append(error)
             continue
 
         val = inputs[x]
@@ -830,6 +942,8 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                 validated[o_id] = (False, reasons, o_id)
                 continue
         else:
+            if memo is not None:
+                continue
             try:
                 # Unwraps values wrapped in __value__ key. This is used to pass
                 # list widget value to execution, as by default list value is
@@ -862,7 +976,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                         "exception_message": str(ex)
                     }
                 }
-                errors.append(error)
+                literal_errors.append(error)
                 continue
 
             if x not in validate_function_inputs and not validate_has_kwargs:
@@ -877,7 +991,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                             "received_value": val,
                         }
                     }
-                    errors.append(error)
+                    literal_errors.append(error)
                     continue
                 if "max" in extra_info and val > extra_info["max"]:
                     error = {
@@ -890,7 +1004,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                             "received_value": val,
                         }
                     }
-                    errors.append(error)
+                    literal_errors.append(error)
                     continue
 
                 if isinstance(input_type, list):
@@ -917,9 +1031,15 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                                 "received_value": val,
                             }
                         }
-                        errors.append(error)
+                        literal_errors.append(error)
                         continue
 
+    if memo is None:
+        errors.extend(literal_errors)
+        if memo_key is not None:
+            converted_inputs = {x: inputs[x] for x in valid_inputs if x in inputs and not is_link(inputs[x])}
+            validation_memo.set(memo_key, (copy.deepcopy(literal_errors), copy.deepcopy(converted_inputs)))
+
     if len(validate_function_inputs) > 0 or validate_has_kwargs:
         input_data_all, _, hidden_inputs = get_input_data(inputs, obj_class, unique_id)
         input_filtered = {}
@@ -963,7 +1083,11 @@ def full_type_name(klass):
         return klass.__qualname__
     return module + '.' + klass.__qualname__
 
-async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[str], None]):
+def get_prompt_outputs(prompt, partial_execution_list: Union[list[str], None]):
+    """
+    Checks that every node of the prompt exists and returns (outputs, error), the output nodes
+    to execute or the error if there are none. Doesn't validate the inputs of the nodes.
+    """
     outputs = set()
     for x in prompt:
         if 'class_type' not in prompt[x]:
@@ -973,7 +1097,7 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
                 "details": f"Node ID '#{x}'",
                 "extra_info": {}
             }
-            return (False, error, [], {})
+            return (None, error)
 
         class_type = prompt[x]['class_type']
         class_ = nodes.NODE_CLASS_MAPPINGS.get(class_type, None)
@@ -984,7 +1108,7 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
                 "details": f"Node ID '#{x}'",
                 "extra_info": {}
             }
-            return (False, error, [], {})
+            return (None, error)
 
         if hasattr(class_, 'OUTPUT_NODE') and class_.OUTPUT_NODE is True:
             if partial_execution_list is None or x in partial_execution_list:
@@ -997,6 +1121,29 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
             "details": "",
             "extra_info": {}
         }
+        return (None, error)
+    return (outputs, None)
+
+def get_validation_error_message(prompt_id, prompt, error, node_errors):
+    """The execution_error message of a prompt that failed validation when it was about to be executed."""
+    node_id = next(iter(node_errors), None)
+    return {
+        "prompt_id": prompt_id,
+        "node_id": node_id,
+        "node_type": prompt[node_id]["class_type"] if node_id is not None else None,
+        "executed": [],
+        "exception_message": "{}: {}".format(error["message"], error["details"]),
+        "exception_type": error["type"],
+        "traceback": [],
+        "current_inputs": {},
+        "current_outputs": [],
+        "node_errors": node_errors,
+        "timestamp": int(time.time() * 1000),
+    }
+
+async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[str], None]):
+    outputs, error = get_prompt_outputs(prompt, partial_execution_list)
+    if error is not None:
         return (False, error, [], {})
 
     good_outputs = set()
@@ -1074,6 +1221,29 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
 
 MAXIMUM_HISTORY_SIZE = 10000
 
+class QueueItem(NamedTuple):
+    """
+    A queued prompt. Items are shared by the queue, its snapshots and the worker executing
+    them without being copied, so they must never be modified.
+    """
+    number: float
+    prompt_id: str
+    prompt: dict
+    extra_data: dict
+    outputs_to_execute: list
+
+class QueueSnapshot(NamedTuple):
+    version: int
+    running: tuple
+    pending: tuple
+    running_workers: dict
+    clients: dict
+
+def strip_sensitive_data(item):
+    if not any(x in item.extra_data for x in SENSITIVE_EXTRA_DATA_KEYS):
+        return item
+    return item._replace(extra_data={k: v for k, v in item.extra_data.items() if k not in SENSITIVE_EXTRA_DATA_KEYS})
+
 class PromptQueue:
     def __init__(self, server):
         self.server = server
@@ -1082,27 +1252,232 @@ class PromptQueue:
         self.task_counter = 0
         self.queue = []
         self.currently_running = {}
-        self.history = {}
+        self.running_workers = {}
+        self.history = HistoryIndex()
         self.flags = {}
+        self.workers = {}
+        self.worker_flags = {}
+        self.sweep_keys = {}
+        self.seed_sweeps = {}
+        self.scheduler = None
+        if args.model_affinity_window > 0:
+            self.scheduler = ModelAffinityScheduler(args.model_affinity_window)
+        # The client each queued or running prompt belongs to
+        self.owners = {}
+        # Number of queued prompts of each client, in the order they started having some
+        self.pending_owners = {}
+        self.fair_queue = None
+        if args.fair_queue:
+            self.fair_queue = DeficitRoundRobin(parse_weights(args.fair_queue_weights))
+        # Records the queue and history in the database with --persistent-queue
+        self.store = None
+        # Incremented on every change to the queue, snapshot is rebuilt when it's out of date
+        self.version = 0
+        self.snapshot = QueueSnapshot(-1, (), (), {}, {})
+        # Size in bytes of the request of each queued prompt, for --max-queued-mb
+        self.sizes = {}
+        self.queued_bytes = 0
+        # When each running task started, for the average execution time
+        self.start_times = {}
+        self.average_execution_time = 0.0
+
+    def queue_changed(self):
+        self.version += 1
+        self.server.queue_updated()
+
+    def set_store(self, store):
+        """Restores the queue from store and records every change to the queue and history in it."""
+        with self.mutex:
+            self.store = store
+            for item, owner in store.load_queue():
+                self.owners[item[1]] = owner
+                self.add_pending(owner)
+                heapq.heappush(self.queue, QueueItem._make(item))
+            if len(self.queue) > 0:
+                logging.info("Restored {} queued prompts".format(len(self.queue)))
+                self.queue_changed()
+                self.not_empty.notify_all()
+
+    def register_worker(self, worker):
+        with self.mutex:
+            self.workers[worker.name] = worker
+            self.worker_flags[worker.name] = {}
 
-    def put(self, item):
+    def put(self, item, owner=None, size=0):
+        item = QueueItem._make(item)
         with self.mutex:
+            self.owners[item.prompt_id] = owner if owner is not None else item.extra_data.get("client_id", None)
+            self.add_pending(self.owners[item.prompt_id])
+            self.sizes[item.prompt_id] = size
+            self.queued_bytes += size
             heapq.heappush(self.queue, item)
-            self.server.queue_updated()
+            if self.store is not None:
+                self.store.add_queued(strip_sensitive_data(item), self.owners[item.prompt_id])
+            self.queue_changed()
             self.not_empty.notify()
 
-    def get(self, timeout=None):
+    def get(self, timeout=None, worker=None):
         with self.not_empty:
-            while len(self.queue) == 0:
+            item = self.pop_next(worker)
+            while item is None:
                 self.not_empty.wait(timeout=timeout)
-                if timeout is not None and len(self.queue) == 0:
+                item = self.pop_next(worker)
+                if item is None and timeout is not None:
                     return None
-            item = heapq.heappop(self.queue)
-            i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
-            self.task_counter += 1
-            self.server.queue_updated()
-            return (item, i)
+            items = self.take_seed_sweep(item)
+            task_ids = []
+            for x in items:
+                self.queued_bytes -= self.sizes.pop(x[1], 0)
+                i = self.task_counter
+                self.currently_running[i] = x
+                if worker is not None:
+                    self.running_workers[i] = worker
+                if self.store is not None:
+                    self.store.set_running(x[1])
+                self.task_counter += 1
+                task_ids.append(i)
+            if len(items) > 1:
+                item = create_sweep_item(items, self.sweep_keys.pop(item[1]))
+                self.seed_sweeps[task_ids[0]] = (task_ids, item[3]["seed_sweep"], item[3].get("client_id", None))
+            self.start_times[task_ids[0]] = time.perf_counter()
+            self.queue_changed()
+            return (item, task_ids[0])
+
+    def add_pending(self, owner):
+        self.pending_owners[owner] = self.pending_owners.get(owner, 0) + 1
+
+    def remove_pending(self, owner):
+        count = self.pending_owners.get(owner, 0) - 1
+        if count > 0:
+            self.pending_owners[owner] = count
+        else:
+            self.pending_owners.pop(owner, None)
+
+    def pop_next(self, worker=None):
+        """Removes and returns the queued prompt to run next, or None if none can run now."""
+        item = self.choose_next(worker)
+        if item is not None:
+            self.remove_pending(self.owners.get(item[1], None))
+        return item
+
+    def choose_next(self, worker=None):
+        if len(self.queue) == 0:
+            return None
+        candidates = self.queue
+        if self.fair_queue is not None or args.max_running_per_client > 0:
+            blocked = set()
+            if args.max_running_per_client > 0:
+                running = collections.Counter(self.owners.get(x[1], None) for x in self.currently_running.values())
+                blocked = set(owner for owner, count in running.items() if count >= args.max_running_per_client)
+            if self.fair_queue is not None:
+                owner = self.fair_queue.next_owner(self.pending_owners, blocked)
+                candidates = [x for x in self.queue if self.owners.get(x[1], None) == owner]
+            else:
+                candidates = [x for x in self.queue if self.owners.get(x[1], None) not in blocked]
+            if len(candidates) == 0:
+                return None
+
+        if self.scheduler is not None:
+            item = self.scheduler.choose(candidates, worker.name if worker is not None else None)
+        elif candidates is self.queue:
+            return heapq.heappop(self.queue)
+        else:
+            item = min(candidates)
+        self.queue.remove(item)
+        heapq.heapify(self.queue)
+        return item
+
+    def get_client_depths(self):
+        """Returns the number of pending and running prompts of every client."""
+        with self.mutex:
+            depths = {}
+            for key, items in (("pending", self.queue), ("running", self.currently_running.values())):
+                for x in items:
+                    owner = self.owners.get(x[1], None)
+                    depths.setdefault(owner, {"pending": 0, "running": 0})[key] += 1
+            return depths
+
+    def set_outputs_to_execute(self, item_id, outputs_to_execute):
+        """Stores the outputs of a running prompt that was validated after it was queued."""
+        with self.mutex:
+            item_ids = [item_id]
+            seed_sweep = self.seed_sweeps.get(item_id, None)
+            if seed_sweep is not None:
+                item_ids = seed_sweep[0]
+            for i in item_ids:
+                item = self.currently_running.get(i, None)
+                if item is not None:
+                    self.currently_running[i] = item._replace(outputs_to_execute=outputs_to_execute)
+            self.queue_changed()
+
+    def get_pending_count(self, owner):
+        with self.mutex:
+            return self.pending_owners.get(owner, 0)
+
+    def get_queue_depth(self):
+        return len(self.queue)
+
+    def get_queued_bytes(self):
+        return self.queued_bytes
+
+    def get_average_execution_time(self):
+        """Moving average of the time in seconds it took to execute the recent prompts."""
+        return self.average_execution_time
+
+    def get_worker_count(self):
+        return max(1, len(self.workers))
+
+    def estimate_position(self, prompt_id):
+        """Estimates how many queued prompts will start before prompt_id."""
+        with self.mutex:
+            item = next((x for x in self.queue if x[1] == prompt_id), None)
+            if item is None:
+                return 0
+            if self.fair_queue is None:
+                return sum(1 for x in self.queue if x < item)
+            owner = self.owners.get(prompt_id, None)
+            depths = self.pending_owners
+            index = sum(1 for x in self.queue if x < item and self.owners.get(x[1], None) == owner)
+            return self.fair_queue.estimate_position(owner, index, depths)
+
+    def get_scheduler_stats(self):
+        if self.scheduler is None:
+            return None
+        return self.scheduler.get_stats()
+
+    def get_sweep_key(self, item):
+        if item[1] not in self.sweep_keys:
+            self.sweep_keys[item[1]] = get_sweep_key(item)
+        return self.sweep_keys[item[1]]
+
+    def take_seed_sweep(self, item):
+        """
+        Removes the queued prompts that only differ from item in the seed of their sampler, up
+        to --seed-sweep-batch-size prompts in total. Returns them in queue order after item.
+        """
+        if args.seed_sweep_batch_size < 2 or self.get_sweep_key(item) is None:
+            self.sweep_keys.pop(item[1], None)
+            return [item]
+        key = self.sweep_keys[item[1]].key
+        items = [item]
+        for x in sorted(self.queue):
+            if len(items) >= args.seed_sweep_batch_size:
+                break
+            sweep_key = self.get_sweep_key(x)
+            if sweep_key is not None and sweep_key.key == key:
+                items.append(x)
+        if len(items) > 1:
+            taken = set(x[1] for x in items)
+            self.queue = [x for x in self.queue if x[1] not in taken]
+            heapq.heapify(self.queue)
+            for x in items[1:]:
+                self.sweep_keys.pop(x[1], None)
+                self.remove_pending(self.owners.get(x[1], None))
+                if self.scheduler is not None:
+                    self.scheduler.forget(x[1])
+        else:
+            self.sweep_keys.pop(item[1], None)
+        return items
 
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
@@ -1111,42 +1486,89 @@ class PromptQueue:
 
     def task_done(self, item_id, history_result,
                   status: Optional['PromptQueue.ExecutionStatus']):
+        with self.mutex:
+            if self.scheduler is not None:
+                self.scheduler.prompt_done(self.currently_running[item_id][1])
+            start_time = self.start_times.pop(item_id, None)
+            if start_time is not None:
+                elapsed = time.perf_counter() - start_time
+                if self.average_execution_time == 0:
+                    self.average_execution_time = elapsed
+                else:
+                    self.average_execution_time = 0.9 * self.average_execution_time + 0.1 * elapsed
+            seed_sweep = self.seed_sweeps.pop(item_id, None)
+            if seed_sweep is None:
+                self.add_history(item_id, history_result, status)
+                return
+            # The prompts of a seed sweep each get their part of the results
+            task_ids, sweep, client_id = seed_sweep
+            results = split_history_result(history_result, sweep)
+            for i, result in zip(task_ids, results):
+                self.add_history(i, result, status)
+            send_sweep_results(self.server, client_id, sweep["prompt_ids"][1:], results[1:], status is not None and status.completed)
+
+    def add_history(self, item_id, history_result,
+                    status: Optional['PromptQueue.ExecutionStatus']):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
+            worker = self.running_workers.pop(item_id, None)
+            owner = self.owners.pop(prompt[1], None)
+            # A client that was at its limit of running prompts may have queued prompts
+            self.not_empty.notify_all()
             if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
+                self.history.pop_oldest()
 
             status_dict: Optional[dict] = None
             if status is not None:
                 status_dict = copy.deepcopy(status._asdict())
 
             # Remove sensitive data from extra_data before storing in history
-            for sensitive_val in SENSITIVE_EXTRA_DATA_KEYS:
-                if sensitive_val in prompt[3]:
-                    prompt[3].pop(sensitive_val)
+            prompt = strip_sensitive_data(prompt)
 
-            self.history[prompt[1]] = {
+            entry = {
                 "prompt": prompt,
                 "outputs": {},
                 'status': status_dict,
             }
-            self.history[prompt[1]].update(history_result)
-            self.server.queue_updated()
+            if worker is not None:
+                entry['worker'] = worker.name
+            entry.update(history_result)
+            # Frozen, so readers can share it without copying
+            entry = self.history.add(prompt[1], entry)
+            if self.store is not None:
+                self.store.add_history(prompt[1], owner, entry)
+            self.queue_changed()
+
+    def get_snapshot(self):
+        """
+        Returns a QueueSnapshot of the running and pending prompts (without sensitive data),
+        only rebuilt after the queue changed. Reading an up to date snapshot takes no lock.
+        """
+        snapshot = self.snapshot
+        if snapshot.version == self.version:
+            return snapshot
+        with self.mutex:
+            if self.snapshot.version != self.version:
+                self.snapshot = QueueSnapshot(
+                    version=self.version,
+                    running=tuple(strip_sensitive_data(x) for x in self.currently_running.values()),
+                    pending=tuple(strip_sensitive_data(x) for x in sorted(self.queue)),
+                    running_workers=self.get_running_workers(),
+                    clients=self.get_client_depths(),
+                )
+            return self.snapshot
 
-    # Note: slow
     def get_current_queue(self):
-        with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+        snapshot = self.get_snapshot()
+        return (snapshot.running, snapshot.pending)
 
-    # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
+        return self.get_current_queue()
+
+    def get_running_workers(self):
+        """Returns the worker executing each running prompt, keyed by prompt id."""
         with self.mutex:
-            running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
-            return (running, queued)
+            return {self.currently_running[i][1]: worker for i, worker in self.running_workers.items()}
 
     def get_tasks_remaining(self):
         with self.mutex:
@@ -1154,64 +1576,105 @@ class PromptQueue:
 
     def wipe_queue(self):
         with self.mutex:
+            for x in self.queue:
+                self.owners.pop(x[1], None)
+                if self.scheduler is not None:
+                    self.scheduler.forget(x[1])
+            if self.store is not None:
+                self.store.remove_queued([x[1] for x in self.queue])
             self.queue = []
-            self.server.queue_updated()
+            self.pending_owners = {}
+            self.sweep_keys = {}
+            self.sizes = {}
+            self.queued_bytes = 0
+            self.queue_changed()
 
     def delete_queue_item(self, function):
         with self.mutex:
             for x in range(len(self.queue)):
                 if function(self.queue[x]):
+                    self.sweep_keys.pop(self.queue[x][1], None)
+                    self.queued_bytes -= self.sizes.pop(self.queue[x][1], 0)
+                    if self.scheduler is not None:
+                        self.scheduler.forget(self.queue[x][1])
+                    if self.store is not None:
+                        self.store.remove_queued([self.queue[x][1]])
                     if len(self.queue) == 1:
                         self.wipe_queue()
                     else:
-                        self.queue.pop(x)
+                        self.remove_pending(self.owners.pop(self.queue.pop(x)[1], None))
                         heapq.heapify(self.queue)
-                    self.server.queue_updated()
+                    self.queue_changed()
                     return True
         return False
 
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        if self.store is not None:
+            return self.get_stored_history(prompt_id, max_items, offset, map_function)
         with self.mutex:
             if prompt_id is None:
-                out = {}
-                i = 0
-                if offset < 0 and max_items is not None:
-                    offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        p = self.history[k]
-                        if map_function is not None:
-                            p = map_function(p)
-                        out[k] = p
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
-                return out
+                out = self.history.get_page(max_items=max_items, offset=offset)
             elif prompt_id in self.history:
-                p = self.history[prompt_id]
-                if map_function is None:
-                    p = copy.deepcopy(p)
-                else:
-                    p = map_function(p)
-                return {prompt_id: p}
+                out = {prompt_id: self.history.get(prompt_id)}
             else:
-                return {}
+                out = {}
+        if map_function is not None:
+            out = {k: map_function(v) for k, v in out.items()}
+        return out
+
+    def get_history_since(self, cursor, max_items=None):
+        """
+        Returns the history entries of the prompts that completed after cursor, oldest first,
+        and the cursor to pass to get the next ones.
+        """
+        if self.store is not None:
+            return self.store.get_history_since(cursor, max_items=max_items)
+        with self.mutex:
+            return self.history.get_since(cursor, max_items=max_items)
+
+    def get_stored_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        """get_history() with --persistent-queue, pages of the history are read from the database."""
+        if prompt_id is None:
+            out = self.store.get_history_page(max_items=max_items, offset=offset)
+        else:
+            with self.mutex:
+                p = self.history.get(prompt_id, None)
+            if p is None:
+                p = self.store.get_history(prompt_id)
+            out = {prompt_id: p} if p is not None else {}
+        if map_function is not None:
+            out = {k: map_function(v) for k, v in out.items()}
+        return out
 
     def wipe_history(self):
         with self.mutex:
-            self.history = {}
+            self.history.clear()
+            if self.store is not None:
+                self.store.delete_history()
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
-            self.history.pop(id_to_delete, None)
+            self.history.remove(id_to_delete)
+            if self.store is not None:
+                self.store.delete_history(id_to_delete)
 
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            for flags in self.worker_flags.values():
+                flags[name] = data
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def get_flags(self, reset=True, worker=None):
         with self.mutex:
+            if worker is not None:
+                # Every worker gets its own copy of the flags so that each one frees its own caches and device
+                flags = self.worker_flags[worker.name]
+                if reset:
+                    self.worker_flags[worker.name] = {}
+                    self.flags = {}
+                    return flags
+                return flags.copy()
             if reset:
                 ret = self.flags
                 self.flags = {}
@@ -114,6 +114,7 @@ def set_temp_directory(temp_dir: str) -> None:
 def set_input_directory(input_dir: str) -> None:
     global input_directory
     input_directory = input_dir
+    notify_folder_changed()
 
 def get_output_directory() -> str:
     global output_directory
@@ -228,6 +229,7 @@ def add_model_folder_path(folder_name: str, full_folder_path: str, is_default: b
                 paths.append(full_folder_path)
     else:
         folder_names_and_paths[folder_name] = ([full_folder_path], set())
+    notify_folder_changed()
 
 def get_folder_paths(folder_name: str) -> list[str]:
     folder_name = map_legacy(folder_name)
@@ -358,6 +360,44 @@ def get_filename_list(folder_name: str) -> list[str]:
     cache_helper.set(folder_name, out)
     return list(out[0])
 
+# Data derived from folder contents (like the input types of nodes) is cached against this
+# version, which changes whenever the model folders, their configuration or the input
+# directory change. Folders are checked at most once every FOLDER_CHECK_INTERVAL seconds,
+# changes made through ComfyUI itself call notify_folder_changed() to be visible immediately.
+FOLDER_CHECK_INTERVAL = 1.0
+folder_version = 0
+folder_version_checked = 0.0
+folder_state = None
+
+def notify_folder_changed() -> None:
+    global folder_version
+    folder_version += 1
+
+def get_folder_state() -> tuple[bool, tuple]:
+    changed = False
+    for folder_name in list(filename_list_cache):
+        if cached_filename_list_(folder_name) is None:
+            # Rescanned on the next get_filename_list call
+            filename_list_cache.pop(folder_name, None)
+            changed = True
+    try:
+        input_mtime = os.path.getmtime(get_input_directory())
+    except OSError:
+        input_mtime = None
+    paths = tuple((k, tuple(v[0])) for k, v in folder_names_and_paths.items())
+    return changed, (get_input_directory(), input_mtime, paths)
+
+def get_folder_version() -> int:
+    global folder_version, folder_version_checked, folder_state
+    now = time.monotonic()
+    if now - folder_version_checked >= FOLDER_CHECK_INTERVAL:
+        folder_version_checked = now
+        changed, state = get_folder_state()
+        if changed or state != folder_state:
+            folder_state = state
+            notify_folder_changed()
+    return folder_version
+
 def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
     def map_filename(filename: str) -> tuple[int, str]:
         prefix_len = len(os.path.basename(filename_prefix))
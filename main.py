@@ -12,7 +12,7 @@ import utils.extra_config
 import logging
 import sys
 from comfy_execution.progress import get_progress_state
-from comfy_execution.utils import get_executing_context
+from comfy_execution.utils import get_executing_context, PromptWorkerContext, current_prompt_worker
 from comfy_api import feature_flags
 
 if __name__ == "__main__":
@@ -109,6 +109,7 @@ import asyncio
 import shutil
 import threading
 import gc
+import atexit
 
 
 if os.name == "nt":
@@ -144,9 +145,11 @@ if 'torch' in sys.modules:
     logging.warning("WARNING: Potential Error in code: Torch already imported, torch should never be imported before this point.")
 
 import comfy.utils
+import torch
 
 import execution
 import server
+from comfy_execution.process_executor import ProcessPromptExecutor
 from protocol import BinaryEventTypes
 import nodes
 import comfy.model_management
@@ -166,15 +169,88 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
-    current_time: float = 0.0
+def get_prompt_workers():
+    devices = [None]
+    if args.prompt_worker_devices is not None:
+        device_type = comfy.model_management.get_torch_device().type
+        devices = []
+        for x in args.prompt_worker_devices.split(","):
+            x = x.strip()
+            if x.isdigit():
+                devices.append(torch.device(device_type, int(x)))
+            elif x:
+                devices.append(torch.device(x))
+    workers = []
+    for i in range(max(args.prompt_workers, 1)):
+        workers.append(PromptWorkerContext(str(i), device=devices[i % len(devices)]))
+    return workers
+
+
+def create_disk_cache():
+    if args.cache_disk_directory is None:
+        return None
+    from comfy_execution.disk_cache import DiskCache
+    return DiskCache(os.path.abspath(args.cache_disk_directory), round(args.cache_disk_size * 1024 * 1024 * 1024))
+
+
+def create_prompt_executor(server_instance, disk_cache=None):
     cache_type = execution.CacheType.CLASSIC
+    cache_size = args.cache_lru
     if args.cache_lru > 0:
         cache_type = execution.CacheType.LRU
+    elif args.cache_ram_budget > 0:
+        cache_type = execution.CacheType.RAM_BUDGET
+        cache_size = round(args.cache_ram_budget * 1024 * 1024 * 1024)
     elif args.cache_none:
         cache_type = execution.CacheType.DEPENDENCY_AWARE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru)
+    return execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=cache_size, disk_cache=disk_cache, parallel_workers=args.parallel_execution_workers)
+
+
+def execution_process(requests, events, worker_name, device, directories):
+    """Entry point of the child process used by a prompt worker with --execution-subprocess."""
+    from comfy_execution.process_executor import ProcessServerProxy, serve, set_directories
+    # Outputs and temp previews must land where the server serves them from
+    set_directories(directories)
+    worker = PromptWorkerContext(worker_name, device=device)
+    current_prompt_worker.set(worker)
+    worker.interrupt_flag = comfy.model_management.register_interrupt_flag()
+    comfy.model_management.register_models_in_use()
+    if device is not None:
+        comfy.model_management.set_thread_torch_device(device)
+
+    server_proxy = ProcessServerProxy(events)
+    server.PromptServer.instance = server_proxy
+    hook_breaker_ac10a0.save_functions()
+    asyncio.run(nodes.init_extra_nodes(
+        init_custom_nodes=(not args.disable_all_custom_nodes) or len(args.whitelist_custom_nodes) > 0,
+        init_api_nodes=not args.disable_api_nodes
+    ))
+    hook_breaker_ac10a0.restore_functions()
+    hijack_progress(server_proxy)
+
+    serve(create_prompt_executor(server_proxy, disk_cache=create_disk_cache()), requests, events)
+
+
+def prompt_worker(q, server_instance, worker=None, disk_cache=None):
+    if worker is None:
+        worker = PromptWorkerContext("0")
+    # Everything this thread executes (including the tasks and node worker threads it starts)
+    # reports progress, interrupts and client state through the worker context
+    current_prompt_worker.set(worker)
+    worker.interrupt_flag = comfy.model_management.register_interrupt_flag()
+    comfy.model_management.register_models_in_use()
+    if worker.device is not None:
+        comfy.model_management.set_thread_torch_device(worker.device)
+        logging.info("Prompt worker {} using device: {}".format(worker.name, worker.device))
+    q.register_worker(worker)
+
+    current_time: float = 0.0
+    if args.execution_subprocess:
+        e = ProcessPromptExecutor(server_instance, worker, execution_process)
+        atexit.register(e.stop)
+    else:
+        e = create_prompt_executor(server_instance, disk_cache=disk_cache)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -184,23 +260,43 @@ def prompt_worker(q, server_instance):
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, worker=worker)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
             prompt_id = item[1]
             server_instance.last_prompt_id = prompt_id
 
-            e.execute(item[2], prompt_id, item[3], item[4])
-            need_gc = True
-            q.task_done(item_id,
-                        e.history_result,
-                        status=execution.PromptQueue.ExecutionStatus(
-                            status_str='success' if e.success else 'error',
-                            completed=e.success,
-                            messages=e.status_messages))
+            valid = (True,)
+            if item[4] is None:
+                # Queued with --lazy-prompt-validation, its inputs are only validated now
+                valid = asyncio.run(execution.validate_prompt(prompt_id, item[2], item[3].get("partial_execution_targets", None)))
+                item = item._replace(outputs_to_execute=valid[2])
+                q.set_outputs_to_execute(item_id, valid[2])
+
+            if valid[0]:
+                e.execute(item[2], prompt_id, item[3], item[4])
+                need_gc = True
+                q.task_done(item_id,
+                            e.history_result,
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='success' if e.success else 'error',
+                                completed=e.success,
+                                messages=e.status_messages))
+            else:
+                logging.warning("invalid prompt: {}".format(valid[1]))
+                mes = execution.get_validation_error_message(prompt_id, item[2], valid[1], valid[3])
+                server_instance.send_sync("execution_error", mes, item[3].get("client_id", None))
+                q.task_done(item_id,
+                            {"outputs": {}, "meta": {}},
+                            status=execution.PromptQueue.ExecutionStatus(
+                                status_str='error',
+                                completed=False,
+                                messages=[("execution_error", mes)]))
             if server_instance.client_id is not None:
                 server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+            # The other workers can unload the models of this prompt now
+            comfy.model_management.release_models_in_use()
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
@@ -212,11 +308,16 @@ def prompt_worker(q, server_instance):
             else:
                 logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+            if disk_cache is not None:
+                logging.debug("Disk cache stats: {}".format(disk_cache.get_stats()))
+
+        flags = q.get_flags(worker=worker)
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
             comfy.model_management.unload_all_models()
+            if args.execution_subprocess:
+                e.unload_models()
             need_gc = True
             last_gc_collect = 0
 
@@ -230,6 +331,8 @@ def prompt_worker(q, server_instance):
             if (current_time - last_gc_collect) > gc_collect_interval:
                 gc.collect()
                 comfy.model_management.soft_empty_cache()
+                if args.execution_subprocess:
+                    e.collect_garbage()
                 last_gc_collect = current_time
                 need_gc = False
                 hook_breaker_ac10a0.restore_functions()
@@ -290,6 +393,20 @@ def setup_database():
         logging.error(f"Failed to initialize database. Please ensure you have installed the latest requirements. If the error persists, please report this as in future the database will be required: {e}")
 
 
+def setup_persistent_queue(prompt_server):
+    from app.database.db import can_create_session, create_session
+    if not can_create_session():
+        logging.error("The database is not available, the prompt queue and history will not be persisted.")
+        return
+    from app.database.prompt_store import PromptStore
+    store = PromptStore(create_session, execution.MAXIMUM_HISTORY_SIZE)
+    number = store.get_max_number()
+    if number is not None:
+        prompt_server.number = max(prompt_server.number, int(number) + 1)
+    prompt_server.prompt_queue.set_store(store)
+    atexit.register(store.flush)
+
+
 def start_comfyui(asyncio_loop=None):
     """
     Starts the ComfyUI server using the provided asyncio event loop or creates a new one.
@@ -322,11 +439,17 @@ def start_comfyui(asyncio_loop=None):
 
     cuda_malloc_warning()
     setup_database()
+    if args.persistent_queue:
+        setup_persistent_queue(prompt_server)
 
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    # The disk cache is shared, the in-memory caches belong to each worker. Execution processes
+    # open their own.
+    disk_cache = None if args.execution_subprocess else create_disk_cache()
+    for worker in get_prompt_workers():
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server, worker, disk_cache)).start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -42,6 +42,7 @@ import importlib
 import folder_paths
 import latent_preview
 import node_helpers
+import comfy_execution.seed_sweep
 
 def before_node_execution():
     comfy.model_management.throw_exception_if_processing_interrupted()
@@ -1477,11 +1478,21 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
     latent_image = latent["samples"]
     latent_image = comfy.sample.fix_empty_latent_channels(model, latent_image)
 
+    seeds = None
+    if isinstance(seed, list):
+        # Seed sweep (see comfy_execution/seed_sweep.py): one copy of the latent per seed
+        seeds = seed
+        seed = seeds[0]
+        latent_image = latent_image.repeat((len(seeds),) + (1,) * (latent_image.ndim - 1))
+
     if disable_noise:
         noise = torch.zeros(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, device="cpu")
     else:
         batch_inds = latent["batch_index"] if "batch_index" in latent else None
-        noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
+        if seeds is not None:
+            noise = comfy.sample.prepare_seed_sweep_noise(latent_image, seeds, batch_inds)
+        else:
+            noise = comfy.sample.prepare_noise(latent_image, seed, batch_inds)
 
     noise_mask = None
     if "noise_mask" in latent:
@@ -1494,6 +1505,8 @@ def common_ksampler(model, seed, steps, cfg, sampler_name, scheduler, positive,
                                   force_full_denoise=force_full_denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seed)
     out = latent.copy()
     out["samples"] = samples
+    if seeds is not None and "batch_index" in latent:
+        out["batch_index"] = latent["batch_index"] * len(seeds)
     return (out, )
 
 class KSampler:
@@ -1517,6 +1530,7 @@ class KSampler:
     RETURN_TYPES = ("LATENT",)
     OUTPUT_TOOLTIPS = ("The denoised latent.",)
     FUNCTION = "sample"
+    SEED_SWEEP_INPUT = "seed"
 
     CATEGORY = "sampling"
     DESCRIPTION = "Uses the provided model, positive and negative conditioning to denoise the latent image."
@@ -1546,6 +1560,7 @@ class KSamplerAdvanced:
 
     RETURN_TYPES = ("LATENT",)
     FUNCTION = "sample"
+    SEED_SWEEP_INPUT = "noise_seed"
 
     CATEGORY = "sampling"
 
@@ -1595,11 +1610,12 @@ class SaveImage:
             metadata = None
             if not args.disable_metadata:
                 metadata = PngInfo()
-                if prompt is not None:
-                    metadata.add_text("prompt", json.dumps(prompt))
-                if extra_pnginfo is not None:
-                    for x in extra_pnginfo:
-                        metadata.add_text(x, json.dumps(extra_pnginfo[x]))
+                image_prompt, image_extra_pnginfo = comfy_execution.seed_sweep.get_batch_metadata(batch_number, len(images), prompt, extra_pnginfo)
+                if image_prompt is not None:
+                    metadata.add_text("prompt", json.dumps(image_prompt))
+                if image_extra_pnginfo is not None:
+                    for x in image_extra_pnginfo:
+                        metadata.add_text(x, json.dumps(image_extra_pnginfo[x]))
 
             filename_with_batch_num = filename.replace("%batch_num%", str(batch_number))
             file = f"{filename_with_batch_num}_{counter:05}_.png"
@@ -1641,6 +1657,7 @@ class LoadImage:
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
+    RESOURCE_CLASS = "io"
     def load_image(self, image):
         image_path = folder_paths.get_annotated_filepath(image)
 
@@ -1718,6 +1735,7 @@ class LoadImageMask:
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
+    RESOURCE_CLASS = "io"
     def load_image(self, image, channel):
         image_path = folder_paths.get_annotated_filepath(image)
         i = node_helpers.pillow(Image.open, image_path)
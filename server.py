@@ -1,6 +1,9 @@
 import os
 import sys
 import asyncio
+import collections
+import functools
+import time
 import traceback
 
 import nodes
@@ -14,9 +17,9 @@ import struct
 import ssl
 import socket
 import ipaddress
-from PIL import Image, ImageOps
+import email.utils
+from PIL import Image
 from PIL.PngImagePlugin import PngInfo
-from io import BytesIO
 
 import aiohttp
 from aiohttp import web
@@ -25,6 +28,7 @@ import logging
 import mimetypes
 from comfy.cli_args import args
 import comfy.utils
+import comfy.metrics
 import comfy.model_management
 from comfy_api import feature_flags
 import node_helpers
@@ -38,15 +42,26 @@ from app.custom_node_manager import CustomNodeManager
 from typing import Optional, Union
 from api_server.routes.internal.internal_routes import InternalRoutes
 from protocol import BinaryEventTypes
+from comfy_execution.utils import get_prompt_worker_context
+from comfy_execution.admission import AdmissionController
+from app.coordinator import Coordinator
+from app.object_info import ObjectInfoCache
+from app.view_cache import ViewCache, etag_matches, get_etag, get_variant
+from app.view_cache import get_content_type as get_view_content_type
+from app.preview_encoder import MIME_TYPES as PREVIEW_MIME_TYPES
+from app.preview_encoder import PreviewEncoder, PREVIEWS_SKIPPED, get_preview_format
+from app.websocket_queue import ClientSendQueue, WEBSOCKET_DROPPED, get_message_key
 
 # Import cache control middleware
 from middleware.cache_middleware import cache_control
 
-async def send_socket_catch_exception(function, message):
-    try:
-        await function(message)
-    except (aiohttp.ClientError, aiohttp.ClientPayloadError, ConnectionResetError, BrokenPipeError, ConnectionError) as err:
-        logging.warning("send error: {}".format(err))
+# Seconds between two measurements of the event loop lag, the last minute of them is kept
+LOOP_LAG_INTERVAL = 0.1
+
+PROMPT_VALIDATION_SECONDS = comfy.metrics.Histogram("comfyui_prompt_validation_seconds", "Time spent validating a prompt queued with POST /prompt.")
+PROMPTS_REJECTED = comfy.metrics.Counter("comfyui_prompts_rejected_total", "Prompts rejected by POST /prompt.", ["reason"])
+QUEUE_DEPTH = comfy.metrics.Gauge("comfyui_queue_depth", "Prompts in the queue.", ["state"])
+LOOP_LAG_SECONDS = comfy.metrics.Gauge("comfyui_event_loop_lag_seconds", "Largest delay of the event loop of the server over the last minute.")
 
 @web.middleware
 async def compress_body(request: web.Request, handler):
@@ -56,6 +71,9 @@ async def compress_body(request: web.Request, handler):
         return response
     if response.content_type not in ["application/json", "text/plain"]:
         return response
+    if "Content-Encoding" in response.headers:
+        # Already compressed
+        return response
     if response.body and "gzip" in accept_encoding:
         response.enable_compression()
     return response
@@ -140,7 +158,29 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+def prompt_worker_state(name):
+    """
+    Execution state that is tracked per prompt worker. Outside of a worker (e.g. on the event
+    loop) the value most recently set by any worker is returned.
+    """
+    shared_name = "_" + name
+    def getter(self):
+        worker = get_prompt_worker_context()
+        if worker is not None:
+            return getattr(worker, name)
+        return getattr(self, shared_name, None)
+    def setter(self, value):
+        worker = get_prompt_worker_context()
+        if worker is not None:
+            setattr(worker, name, value)
+        setattr(self, shared_name, value)
+    return property(getter, setter)
+
 class PromptServer():
+    client_id = prompt_worker_state("client_id")
+    last_node_id = prompt_worker_state("last_node_id")
+    last_prompt_id = prompt_worker_state("last_prompt_id")
+
     def __init__(self, loop):
         PromptServer.instance = self
 
@@ -154,10 +194,25 @@ class PromptServer():
         self.internal_routes = InternalRoutes(self)
         self.supports = ["custom_nodes_from_web"]
         self.prompt_queue = execution.PromptQueue(self)
+        self.admission = AdmissionController(max_queue_size=args.max_queue_size,
+                                             max_queued_bytes=round(args.max_queued_mb * 1024 * 1024),
+                                             max_queued_per_client=args.max_queued_per_client,
+                                             max_prompts_per_minute=args.max_prompts_per_minute)
         self.loop = loop
         self.messages = asyncio.Queue()
+        self.preview_encoder = PreviewEncoder()
+        self.preview_tasks = set()
         self.client_session:Optional[aiohttp.ClientSession] = None
         self.number = 0
+        # Identifies this process in ETags, queue versions restart from 0 with the server
+        self.instance_id = uuid.uuid4().hex
+        self.queue_response = None
+        self.loop_lag = collections.deque(maxlen=round(60 / LOOP_LAG_INTERVAL))
+        self.view_cache = None
+        # With --coordinator-backends prompts are executed by other instances
+        self.coordinator = None
+        if args.coordinator_backends:
+            self.coordinator = Coordinator(self, args.coordinator_backends)
 
         middlewares = [cache_control]
         if args.enable_compress_response_body:
@@ -172,6 +227,7 @@ class PromptServer():
         self.app = web.Application(client_max_size=max_upload_size, middlewares=middlewares)
         self.sockets = dict()
         self.sockets_metadata = dict()
+        self.socket_queues = dict()
         self.web_root = (
             FrontendManager.init_frontend(args.front_end_version)
             if args.front_end_root is None
@@ -193,11 +249,16 @@ class PromptServer():
             if sid:
                 # Reusing existing session, remove old
                 self.sockets.pop(sid, None)
+                old_queue = self.socket_queues.pop(sid, None)
+                if old_queue is not None:
+                    old_queue.close()
             else:
                 sid = uuid.uuid4().hex
 
             # Store WebSocket for backward compatibility
             self.sockets[sid] = ws
+            send_queue = ClientSendQueue(ws)
+            self.socket_queues[sid] = send_queue
             # Store metadata separately
             self.sockets_metadata[sid] = {"feature_flags": {}}
 
@@ -205,8 +266,10 @@ class PromptServer():
                 # Send initial state to the new client
                 await self.send("status", {"status": self.get_queue_info(), "sid": sid}, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                for state in list(self.prompt_queue.workers.values()) or [self]:
+                    if state.client_id == sid and state.last_node_id is not None:
+                        await self.send("executing", { "node": state.last_node_id }, sid)
+                self.send_progress_state_snapshot(sid)
 
                 # Flag to track if we've received the first message
                 first_message = True
@@ -233,6 +296,8 @@ class PromptServer():
                                 logging.debug(
                                     f"Feature flags negotiated for client {sid}: {client_flags}"
                                 )
+                            elif data.get("type") == "get_progress_state":
+                                self.send_progress_state_snapshot(sid)
                             first_message = False
                         except json.JSONDecodeError:
                             logging.warning(
@@ -241,8 +306,13 @@ class PromptServer():
                         except Exception as e:
                             logging.error(f"Error processing WebSocket message: {e}")
             finally:
-                self.sockets.pop(sid, None)
-                self.sockets_metadata.pop(sid, None)
+                # Another connection may have reused the sid in the meantime
+                if self.sockets.get(sid, None) is ws:
+                    self.sockets.pop(sid, None)
+                    self.sockets_metadata.pop(sid, None)
+                if self.socket_queues.get(sid, None) is send_queue:
+                    self.socket_queues.pop(sid, None)
+                send_queue.close()
             return ws
 
         @routes.get("/")
@@ -356,6 +426,7 @@ class PromptServer():
                     else:
                         with open(filepath, "wb") as f:
                             f.write(image.file.read())
+                    folder_paths.notify_folder_changed()
 
                 return web.json_response({"name" : filename, "subfolder": subfolder, "type": image_upload_type})
             else:
@@ -443,62 +514,19 @@ class PromptServer():
                 file = os.path.join(output_dir, filename)
 
                 if os.path.isfile(file):
-                    if 'preview' in request.rel_url.query:
-                        with Image.open(file) as img:
-                            preview_info = request.rel_url.query['preview'].split(';')
-                            image_format = preview_info[0]
-                            if image_format not in ['webp', 'jpeg'] or 'a' in request.rel_url.query.get('channel', ''):
-                                image_format = 'webp'
-
-                            quality = 90
-                            if preview_info[-1].isdigit():
-                                quality = int(preview_info[-1])
-
-                            buffer = BytesIO()
-                            if image_format in ['jpeg'] or request.rel_url.query.get('channel', '') == 'rgb':
-                                img = img.convert("RGB")
-                            img.save(buffer, format=image_format, quality=quality)
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type=f'image/{image_format}',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    if 'channel' not in request.rel_url.query:
-                        channel = 'rgba'
-                    else:
-                        channel = request.rel_url.query["channel"]
-
-                    if channel == 'rgb':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                r, g, b, a = img.split()
-                                new_img = Image.merge('RGB', (r, g, b))
-                            else:
-                                new_img = img.convert("RGB")
-
-                            buffer = BytesIO()
-                            new_img.save(buffer, format='PNG')
-                            buffer.seek(0)
-
-                            return web.Response(body=buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
-
-                    elif channel == 'a':
-                        with Image.open(file) as img:
-                            if img.mode == "RGBA":
-                                _, _, _, a = img.split()
-                            else:
-                                a = Image.new('L', img.size, 255)
-
-                            # alpha img
-                            alpha_img = Image.new('RGBA', img.size)
-                            alpha_img.putalpha(a)
-                            alpha_buffer = BytesIO()
-                            alpha_img.save(alpha_buffer, format='PNG')
-                            alpha_buffer.seek(0)
-
-                            return web.Response(body=alpha_buffer.read(), content_type='image/png',
-                                                headers={"Content-Disposition": f"filename=\"{filename}\""})
+                    variant = get_variant(request.rel_url.query)
+                    if variant is not None:
+                        stat = os.stat(file)
+                        headers = {
+                            "Content-Disposition": f"filename=\"{filename}\"",
+                            "ETag": get_etag(file, stat, variant),
+                            "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+                            "Cache-Control": "no-cache",
+                        }
+                        if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+                            return web.Response(status=304, headers=headers)
+                        body, _ = await self.get_view_cache().get(file, stat, variant)
+                        return web.Response(body=body, content_type=get_view_content_type(variant), headers=headers)
                     else:
                         # Get content type from mimetype, defaulting to 'application/octet-stream'
                         content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
@@ -540,6 +568,15 @@ class PromptServer():
                 return web.Response(status=404)
             return web.json_response(dt["__metadata__"])
 
+        @routes.get("/metrics")
+        async def get_metrics(request):
+            running, pending = self.prompt_queue.get_current_queue()
+            QUEUE_DEPTH.set(len(pending), "pending")
+            QUEUE_DEPTH.set(len(running), "running")
+            LOOP_LAG_SECONDS.set(max(self.loop_lag, default=0.0))
+            return web.Response(text=comfy.metrics.render(), content_type="text/plain", charset="utf-8",
+                                headers={"Cache-Control": "no-store"})
+
         @routes.get("/system_stats")
         async def system_stats(request):
             device = comfy.model_management.get_torch_device()
@@ -624,17 +661,19 @@ class PromptServer():
                 info['api_node'] = obj_class.API_NODE
             return info
 
+        self.object_info = ObjectInfoCache(node_info, nodes.NODE_CLASS_MAPPINGS)
+
         @routes.get("/object_info")
         async def get_object_info(request):
-            with folder_paths.cache_helper:
-                out = {}
-                for x in nodes.NODE_CLASS_MAPPINGS:
-                    try:
-                        out[x] = node_info(x)
-                    except Exception:
-                        logging.error(f"[ERROR] An error occurred while retrieving information for the '{x}' node.")
-                        logging.error(traceback.format_exc())
-                return web.json_response(out)
+            # Only rebuilt for the node classes that changed, off the event loop
+            response = await asyncio.get_running_loop().run_in_executor(None, self.object_info.get)
+            headers = {"ETag": response.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+            if etag_matches(request.headers.get("If-None-Match"), response.etag):
+                return web.Response(status=304, headers=headers)
+            body, encoding = response.get_body(request.headers.get("Accept-Encoding", ""))
+            if encoding is not None:
+                headers["Content-Encoding"] = encoding
+            return web.Response(body=body, content_type="application/json", headers=headers)
 
         @routes.get("/object_info/{node_class}")
         async def get_object_info_node(request):
@@ -650,31 +689,53 @@ class PromptServer():
             if max_items is not None:
                 max_items = int(max_items)
 
+            since = request.rel_url.query.get("since", None)
+            if self.coordinator is not None:
+                if since is not None:
+                    # The cursors of the backends aren't comparable, there's no single one to return
+                    return web.json_response({"error": "since isn't supported by a coordinator"}, status=400)
+                return web.json_response(await self.coordinator.get_history(max_items=max_items))
+
+            if since is not None:
+                # Incremental: the entries that completed after the cursor of a previous response
+                try:
+                    since = int(since)
+                except ValueError:
+                    return web.json_response({"error": "since must be an integer cursor"}, status=400)
+                if since < 0:
+                    return web.json_response({"error": "since must not be negative"}, status=400)
+                history, cursor = await self.read_history(self.prompt_queue.get_history_since, since, max_items=max_items)
+                return web.json_response(history, headers={"Comfy-History-Cursor": str(cursor)})
+
             offset = request.rel_url.query.get("offset", None)
             if offset is not None:
                 offset = int(offset)
             else:
                 offset = -1
 
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
+            return web.json_response(await self.read_history(self.prompt_queue.get_history, max_items=max_items, offset=offset))
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            if self.coordinator is not None:
+                return web.json_response(await self.coordinator.get_history(prompt_id=prompt_id))
+            return web.json_response(await self.read_history(self.prompt_queue.get_history, prompt_id=prompt_id))
 
         @routes.get("/queue")
         async def get_queue(request):
-            queue_info = {}
-            current_queue = self.prompt_queue.get_current_queue_volatile()
-            queue_info['queue_running'] = current_queue[0]
-            queue_info['queue_pending'] = current_queue[1]
-            return web.json_response(queue_info)
+            if self.coordinator is not None:
+                return web.json_response(await self.coordinator.get_queue())
+            body, etag = self.get_queue_response()
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
 
         @routes.post("/prompt")
         async def post_prompt(request):
             logging.info("got prompt")
             json_data =  await request.json()
+            size = len(await request.read())
             json_data = self.trigger_on_prompt(json_data)
 
             if "number" in json_data:
@@ -691,24 +752,55 @@ class PromptServer():
                 prompt = json_data["prompt"]
                 prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
 
-                partial_execution_targets = None
-                if "partial_execution_targets" in json_data:
-                    partial_execution_targets = json_data["partial_execution_targets"]
-
-                valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
                 extra_data = {}
                 if "extra_data" in json_data:
                     extra_data = json_data["extra_data"]
 
                 if "client_id" in json_data:
                     extra_data["client_id"] = json_data["client_id"]
+
+                owner = self.get_queue_owner(request, extra_data)
+                rejection = self.admission.check(self.prompt_queue, owner, size)
+                if rejection is not None:
+                    PROMPTS_REJECTED.inc(rejection.type)
+                    error = {
+                        "type": rejection.type,
+                        "message": "Too many queued prompts",
+                        "details": rejection.message,
+                        "extra_info": {"retry_after": rejection.retry_after}
+                    }
+                    return web.json_response({"error": error, "node_errors": {}}, status=429,
+                                             headers={"Retry-After": str(rejection.retry_after)})
+
+                partial_execution_targets = None
+                if "partial_execution_targets" in json_data:
+                    partial_execution_targets = json_data["partial_execution_targets"]
+
+                if self.coordinator is not None:
+                    # Validated by the backend the prompt is sent to
+                    status, response = await self.coordinator.queue_prompt(prompt_id, prompt, extra_data, partial_execution_targets,
+                                                                           front=json_data.get("front", False))
+                    return web.json_response(response, status=status)
+
+                if args.lazy_prompt_validation:
+                    # The inputs are validated by the worker before executing the prompt
+                    outputs, error = execution.get_prompt_outputs(prompt, partial_execution_targets)
+                    valid = (error is None, error, None, {})
+                    if partial_execution_targets is not None:
+                        extra_data["partial_execution_targets"] = partial_execution_targets
+                else:
+                    start = time.perf_counter()
+                    valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
+                    PROMPT_VALIDATION_SECONDS.observe(time.perf_counter() - start)
                 if valid[0]:
                     outputs_to_execute = valid[2]
-                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
-                    response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
+                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute), owner=owner, size=size)
+                    response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3],
+                                "queue_position": self.prompt_queue.estimate_position(prompt_id)}
                     return web.json_response(response)
                 else:
                     logging.warning("invalid prompt: {}".format(valid[1]))
+                    PROMPTS_REJECTED.inc("invalid_prompt")
                     return web.json_response({"error": valid[1], "node_errors": valid[3]}, status=400)
             else:
                 error = {
@@ -722,6 +814,9 @@ class PromptServer():
         @routes.post("/queue")
         async def post_queue(request):
             json_data =  await request.json()
+            if self.coordinator is not None:
+                await self.coordinator.request_all("POST", "/queue", json_data)
+                return web.Response(status=200)
             if "clear" in json_data:
                 if json_data["clear"]:
                     self.prompt_queue.wipe_queue()
@@ -742,6 +837,9 @@ class PromptServer():
 
             # Check if a specific prompt_id was provided for targeted interruption
             prompt_id = json_data.get('prompt_id')
+            if self.coordinator is not None:
+                await self.coordinator.interrupt(prompt_id)
+                return web.Response(status=200)
             if prompt_id:
                 currently_running, _ = self.prompt_queue.get_current_queue()
 
@@ -755,7 +853,12 @@ class PromptServer():
                         break
 
                 if should_interrupt:
-                    nodes.interrupt_processing()
+                    # Only stop the worker running this prompt
+                    worker = self.prompt_queue.get_running_workers().get(prompt_id, None)
+                    if worker is not None and worker.interrupt_flag is not None:
+                        comfy.model_management.interrupt_current_processing(flag=worker.interrupt_flag)
+                    else:
+                        nodes.interrupt_processing()
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
@@ -779,6 +882,9 @@ class PromptServer():
         @routes.post("/history")
         async def post_history(request):
             json_data =  await request.json()
+            if self.coordinator is not None:
+                await self.coordinator.request_all("POST", "/history", json_data)
+                return web.Response(status=200)
             if "clear" in json_data:
                 if json_data["clear"]:
                     self.prompt_queue.wipe_history()
@@ -792,6 +898,9 @@ class PromptServer():
     async def setup(self):
         timeout = aiohttp.ClientTimeout(total=None) # no timeout
         self.client_session = aiohttp.ClientSession(timeout=timeout)
+        self.loop_lag_task = asyncio.create_task(self.monitor_loop_lag())
+        if self.coordinator is not None:
+            self.coordinator.start()
 
     def add_routes(self):
         self.user_manager.add_routes(self.routes)
@@ -834,10 +943,43 @@ class PromptServer():
             web.static('/', self.web_root),
         ])
 
+    def get_queue_response(self):
+        """Returns the body of GET /queue and its ETag, serialized once per version of the queue."""
+        snapshot = self.prompt_queue.get_snapshot()
+        if self.queue_response is None or self.queue_response[0] != snapshot.version:
+            queue_info = {
+                'queue_running': snapshot.running,
+                'queue_pending': snapshot.pending,
+                'queue_running_workers': {prompt_id: worker.name for prompt_id, worker in snapshot.running_workers.items()},
+                'queue_clients': {str(owner): depth for owner, depth in snapshot.clients.items()},
+            }
+            etag = '"{}-{}"'.format(self.instance_id, snapshot.version)
+            self.queue_response = (snapshot.version, json.dumps(queue_info).encode("utf-8"), etag)
+        return self.queue_response[1], self.queue_response[2]
+
+    def get_view_cache(self):
+        if self.view_cache is None:
+            directory = args.view_cache_directory
+            if directory is None:
+                directory = os.path.join(folder_paths.get_temp_directory(), "view_cache")
+            self.view_cache = ViewCache(os.path.abspath(directory))
+        return self.view_cache
+
+    def get_queue_owner(self, request, extra_data):
+        """The client a prompt is queued for: its user with --multi-user, its client id otherwise."""
+        if args.multi_user:
+            try:
+                return self.user_manager.get_request_user_id(request)
+            except KeyError:
+                pass
+        return extra_data.get("client_id", request.remote)
+
     def get_queue_info(self):
         prompt_info = {}
         exec_info = {}
         exec_info['queue_remaining'] = self.prompt_queue.get_tasks_remaining()
+        if self.coordinator is not None:
+            exec_info['queue_remaining'] += self.coordinator.get_tasks_remaining()
         prompt_info['exec_info'] = exec_info
         return prompt_info
 
@@ -862,86 +1004,108 @@ class PromptServer():
         message.extend(data)
         return message
 
-    async def send_image(self, image_data, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.Resampling.LANCZOS
+    def has_listener(self, sid):
+        if sid is None:
+            return len(self.socket_queues) > 0
+        return sid in self.socket_queues
+
+    async def encode_preview(self, event, image_data, sid):
+        """Returns (image format, encoded image) of a preview for sid, or None when it shouldn't be sent."""
+        image_type, image, max_size = image_data
+        if not self.has_listener(sid):
+            PREVIEWS_SKIPPED.inc("no_client")
+            return None
+        client_flags = {}
+        if sid is not None:
+            client_flags = self.sockets_metadata.get(sid, {}).get("feature_flags", {})
+        image_format, quality = get_preview_format(client_flags, image_type, event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA)
+        image_bytes = await self.preview_encoder.encode((sid, event, image_format, quality), image, max_size, image_format, quality)
+        if image_bytes is None:
+            return None
+        return image_format, image_bytes
 
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
+    async def send_image(self, image_data, sid=None):
+        message = await self.encode_image(image_data, sid)
+        if message is not None:
+            self.queue_message(message, get_message_key(BinaryEventTypes.PREVIEW_IMAGE, None), sid)
+
+    async def encode_image(self, image_data, sid=None):
+        """Returns the PREVIEW_IMAGE message of a preview for sid, or None when it shouldn't be sent."""
+        preview = await self.encode_preview(BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, image_data, sid)
+        if preview is None:
+            return None
+        image_format, image_bytes = preview
         type_num = 1
-        if image_type == "JPEG":
+        if image_format == "JPEG":
             type_num = 1
-        elif image_type == "PNG":
+        elif image_format == "PNG":
             type_num = 2
 
-        bytesIO = BytesIO()
-        header = struct.pack(">I", type_num)
-        bytesIO.write(header)
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        preview_bytes = bytesIO.getvalue()
-        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes, sid=sid)
+        preview_bytes = struct.pack(">I", type_num) + image_bytes
+        return self.encode_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes)
 
     async def send_image_with_metadata(self, image_data, metadata=None, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.Resampling.LANCZOS
+        message = await self.encode_image_with_metadata(image_data, metadata, sid)
+        if message is not None:
+            self.queue_message(message, get_message_key(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, None), sid)
 
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
-
-        mimetype = "image/png" if image_type == "PNG" else "image/jpeg"
+    async def encode_image_with_metadata(self, image_data, metadata=None, sid=None):
+        """Returns the PREVIEW_IMAGE_WITH_METADATA message of a preview for sid, or None when it shouldn't be sent."""
+        preview = await self.encode_preview(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, image_data, sid)
+        if preview is None:
+            return None
+        image_format, image_bytes = preview
 
         # Prepare metadata
         if metadata is None:
             metadata = {}
-        metadata["image_type"] = mimetype
+        metadata["image_type"] = PREVIEW_MIME_TYPES[image_format]
 
         # Serialize metadata as JSON
-        import json
         metadata_json = json.dumps(metadata).encode('utf-8')
         metadata_length = len(metadata_json)
 
-        # Prepare image data
-        bytesIO = BytesIO()
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        image_bytes = bytesIO.getvalue()
-
         # Combine metadata and image
         combined_data = bytearray()
         combined_data.extend(struct.pack(">I", metadata_length))
         combined_data.extend(metadata_json)
         combined_data.extend(image_bytes)
 
-        await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, combined_data, sid=sid)
+        return self.encode_bytes(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, combined_data)
+
+    async def read_history(self, function, *args, **kwargs):
+        """Calls a history read of the prompt queue, in a thread when it reads from the database (--persistent-queue)."""
+        if self.prompt_queue.store is None:
+            return function(*args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    def send_progress_state_snapshot(self, sid):
+        """Sends the progress_state of every node of the prompts executing for the client sid."""
+        for state in self.prompt_queue.workers.values():
+            registry = state.progress_registry
+            if registry is None:
+                continue
+            handler = registry.handlers.get("webui", None)
+            if handler is not None and handler.client_id == sid:
+                handler.send_snapshot(sid)
+
+    def queue_message(self, message, key, sid=None):
+        """Puts the encoded message on the send queue of the client sid, or of every client."""
+        if sid is None:
+            for send_queue in list(self.socket_queues.values()):
+                send_queue.put(message, key)
+        elif sid in self.socket_queues:
+            self.socket_queues[sid].put(message, key)
+        else:
+            WEBSOCKET_DROPPED.inc("disconnected")
 
     async def send_bytes(self, event, data, sid=None):
         message = self.encode_bytes(event, data)
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_bytes, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_bytes, message)
+        self.queue_message(message, get_message_key(event, data), sid)
 
     async def send_json(self, event, data, sid=None):
-        message = {"type": event, "data": data}
-
-        if sid is None:
-            sockets = list(self.sockets.values())
-            for ws in sockets:
-                await send_socket_catch_exception(ws.send_json, message)
-        elif sid in self.sockets:
-            await send_socket_catch_exception(self.sockets[sid].send_json, message)
+        message = json.dumps({"type": event, "data": data})
+        self.queue_message(message, get_message_key(event, data), sid)
 
     def send_sync(self, event, data, sid=None):
         self.loop.call_soon_threadsafe(
@@ -950,10 +1114,50 @@ class PromptServer():
     def queue_updated(self):
         self.send_sync("status", { "status": self.get_queue_info() })
 
+    async def monitor_loop_lag(self):
+        """Records how late the event loop wakes up, i.e. how long handlers keep it busy."""
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.loop_lag.append(max(self.loop.time() - start - LOOP_LAG_INTERVAL, 0.0))
+
     async def publish_loop(self):
         while True:
             msg = await self.messages.get()
-            await self.send(*msg)
+            if msg[0] in (BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA):
+                self.queue_preview(*msg)
+            else:
+                await self.send(*msg)
+
+    def queue_preview(self, event, data, sid=None):
+        """
+        Queues a preview that is encoded in the thread pool. The publish loop doesn't wait for
+        the encoding, but the preview keeps its place in the send queues: the messages queued
+        after it are sent once it's encoded (or superseded), so clients get them in order.
+        """
+        if not self.has_listener(sid):
+            PREVIEWS_SKIPPED.inc("no_client")
+            return
+        message = self.loop.create_future()
+        self.queue_message(message, get_message_key(event, None), sid)
+        task = asyncio.create_task(self.encode_queued_preview(message, event, data, sid))
+        self.preview_tasks.add(task)
+        task.add_done_callback(self.preview_tasks.discard)
+
+    async def encode_queued_preview(self, message, event, data, sid=None):
+        encoded = None
+        try:
+            if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE:
+                encoded = await self.encode_image(data, sid)
+            else:
+                # data is (preview_image, metadata)
+                preview_image, metadata = data
+                encoded = await self.encode_image_with_metadata(preview_image, metadata, sid)
+        except Exception:
+            logging.warning("Failed to send a preview image")
+            logging.warning(traceback.format_exc())
+        finally:
+            message.set_result(encoded)
 
     async def start(self, address, port, verbose=True, call_on_start=None):
         await self.start_multi_address([(address, port)], call_on_start=call_on_start)
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from app import coordinator
+from app.coordinator import Backend, Coordinator, choose_backend, merge_histories
+
+
+def make_backend(url, depth=0, models=(), connected=True):
+    backend = Backend(url)
+    backend.queue_remaining = depth
+    backend.last_models = frozenset(models)
+    backend.connected = connected
+    return backend
+
+
+def make_entry(timestamp):
+    return {"outputs": {}, "status": {"messages": [["execution_start", {"timestamp": timestamp - 1}], ["execution_success", {"timestamp": timestamp}]]}}
+
+
+def test_choose_least_loaded_backend():
+    a = make_backend("http://a", depth=3)
+    b = make_backend("http://b", depth=1)
+    assert choose_backend([a, b], frozenset()) is b
+
+
+def test_choose_backend_with_models_loaded():
+    a = make_backend("http://a", depth=1, models=["sdxl.safetensors"])
+    b = make_backend("http://b", depth=0, models=["sd15.safetensors"])
+    assert choose_backend([a, b], frozenset(["sdxl.safetensors"])) is a
+    # Waiting for more prompts costs more than loading the model
+    a.queue_remaining = 3
+    assert choose_backend([a, b], frozenset(["sdxl.safetensors"])) is b
+
+
+def test_disconnected_backends_are_skipped():
+    a = make_backend("http://a", connected=False)
+    assert choose_backend([a], frozenset()) is None
+    b = make_backend("http://b", depth=10)
+    assert choose_backend([a, b], frozenset()) is b
+
+
+def test_merge_histories():
+    merged = merge_histories([{"1": make_entry(10), "3": make_entry(30)}, {"2": make_entry(20)}])
+    assert list(merged) == ["1", "2", "3"]
+    assert list(merge_histories([{"1": make_entry(10), "3": make_entry(30)}, {"2": make_entry(20)}], max_items=2)) == ["2", "3"]
+
+
+class FakeBackend:
+    """A ComfyUI instance that "executes" every prompt as soon as it's queued."""
+    def __init__(self, status=200):
+        self.status = status
+        self.sockets = {}
+        self.prompts = []
+        self.app = web.Application()
+        self.app.router.add_get("/ws", self.websocket)
+        self.app.router.add_post("/prompt", self.post_prompt)
+        self.app.router.add_get("/queue", self.get_queue)
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.sockets[request.rel_url.query["clientId"]] = ws
+        await ws.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": 0}}}})
+        async for _ in ws:
+            pass
+        return ws
+
+    async def post_prompt(self, request):
+        data = await request.json()
+        if self.status != 200:
+            return web.json_response({"error": {"type": "queue_full", "message": "The queue is full"}, "node_errors": {}}, status=self.status)
+        self.prompts.append(data)
+        ws = self.sockets[data["extra_data"]["client_id"]]
+        prompt_id = data["prompt_id"]
+        await ws.send_json({"type": "execution_start", "data": {"prompt_id": prompt_id}})
+        await ws.send_bytes(b"\x00\x00\x00\x01preview")
+        await ws.send_json({"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+        return web.json_response({"prompt_id": prompt_id, "number": 0, "node_errors": {}})
+
+    async def get_queue(self, request):
+        return web.json_response({"queue_running": [], "queue_pending": []})
+
+
+class FakeServer:
+    def __init__(self, session, sockets_metadata=None):
+        self.client_session = session
+        self.sockets_metadata = sockets_metadata or {}
+        self.sent = []
+
+    def queue_updated(self):
+        pass
+
+    async def send_json(self, event, data, sid=None):
+        self.sent.append((event, data, sid))
+
+    async def send_bytes(self, event, data, sid=None):
+        self.sent.append((event, data, sid))
+
+
+@pytest.mark.asyncio
+async def test_prompts_are_forwarded(monkeypatch):
+    monkeypatch.setattr(coordinator, "get_prompt_models", lambda prompt: frozenset())
+    backend = FakeBackend()
+    async with TestServer(backend.app) as test_server, aiohttp.ClientSession() as session:
+        server = FakeServer(session)
+        c = Coordinator(server, [str(test_server.make_url("/"))])
+        c.start()
+        while not c.backends[0].connected:
+            await asyncio.sleep(0.01)
+
+        status, response = await c.queue_prompt("p1", {"1": {"class_type": "SaveImage", "inputs": {}}}, {"client_id": "client"})
+        assert status == 200
+        assert response["prompt_id"] == "p1"
+        # The backend sees the coordinator as the client
+        assert backend.prompts[0]["extra_data"]["client_id"] == c.backends[0].client_id
+
+        while len(server.sent) < 3:
+            await asyncio.sleep(0.01)
+        assert server.sent == [
+            ("execution_start", {"prompt_id": "p1"}, "client"),
+            (1, b"preview", "client"),
+            ("executing", {"node": None, "prompt_id": "p1"}, "client"),
+        ]
+        assert c.clients == {}
+        assert c.get_tasks_remaining() == 0
+        for task in c.tasks:
+            task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_rejected_prompts_go_to_the_next_backend(monkeypatch):
+    monkeypatch.setattr(coordinator, "get_prompt_models", lambda prompt: frozenset())
+    full = FakeBackend(status=429)
+    backend = FakeBackend()
+    async with TestServer(full.app) as full_server, TestServer(backend.app) as test_server, aiohttp.ClientSession() as session:
+        c = Coordinator(FakeServer(session), [str(full_server.make_url("/")), str(test_server.make_url("/"))])
+        c.start()
+        while not all(x.connected for x in c.backends):
+            await asyncio.sleep(0.01)
+        # The full backend is chosen first, it's listed first and as loaded as the other
+        status, response = await c.queue_prompt("p1", {}, {"client_id": "client"})
+        assert status == 200
+        assert response["backend"] == c.backends[1].url
+        assert len(backend.prompts) == 1
+
+        c.backends[1].connected = False
+        status, response = await c.queue_prompt("p2", {}, {"client_id": "client"})
+        assert status == 429
+        assert response["error"]["type"] == "queue_full"
+        for task in c.tasks:
+            task.cancel()
+
+
+def make_preview_with_metadata(prompt_id, image_type="image/jpeg"):
+    metadata = json.dumps({"node_id": "1", "prompt_id": prompt_id, "image_type": image_type}).encode("utf-8")
+    return struct.pack(">II", 4, len(metadata)) + metadata + b"image"
+
+
+@pytest.mark.asyncio
+async def test_previews_go_to_the_client_of_their_prompt():
+    server = FakeServer(None, {"a": {"feature_flags": {"supports_preview_metadata": True}}, "b": {"feature_flags": {}}})
+    c = Coordinator(server, ["http://backend"])
+    backend = c.backends[0]
+    backend.prompts.update(["p1", "p2"])
+    c.clients.update({"p1": "a", "p2": "b"})
+    backend.executing = "p2"
+
+    await c.handle_binary(backend, make_preview_with_metadata("p1"))
+    assert server.sent[-1] == (4, make_preview_with_metadata("p1")[4:], "a")
+    # Clients without preview metadata support get the legacy message
+    await c.handle_binary(backend, make_preview_with_metadata("p2", "image/png"))
+    assert server.sent[-1] == (1, struct.pack(">I", 2) + b"image", "b")
+    # Without a prompt_id the preview belongs to the executing prompt
+    await c.handle_binary(backend, b"\x00\x00\x00\x01preview")
+    assert server.sent[-1] == (1, b"preview", "b")
+    # Previews of prompts that weren't sent by the coordinator are ignored
+    await c.handle_binary(backend, make_preview_with_metadata("other"))
+    assert len(server.sent) == 3
+
+
+def test_import_does_not_initialize_a_device():
+    # A coordinator doesn't execute prompts and must start on machines without an accelerator
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    code = "import sys, app.coordinator; sys.exit('comfy.model_management' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=root).returncode == 0
@@ -0,0 +1,79 @@
+import gzip
+import json
+
+import pytest
+
+import folder_paths
+from app.object_info import ObjectInfoCache
+
+
+def make_node(name, cache_input_types=True):
+    return type(name, (), {"CACHE_INPUT_TYPES": cache_input_types, "calls": 0})
+
+
+NODE_CLASS_MAPPINGS = {}
+
+
+@pytest.fixture
+def node_classes(monkeypatch):
+    monkeypatch.setattr(folder_paths, "get_folder_version", lambda: 0)
+    NODE_CLASS_MAPPINGS.clear()
+    NODE_CLASS_MAPPINGS.update({"A": make_node("A"), "B": make_node("B")})
+    return NODE_CLASS_MAPPINGS
+
+
+def node_info(name):
+    obj_class = NODE_CLASS_MAPPINGS[name]
+    obj_class.calls += 1
+    return {"name": name, "calls": obj_class.calls}
+
+
+def test_response_is_built_once(node_classes):
+    cache = ObjectInfoCache(node_info, node_classes)
+    response = cache.get()
+    assert json.loads(response.body) == {"A": {"name": "A", "calls": 1}, "B": {"name": "B", "calls": 1}}
+    assert cache.get() is response
+    assert cache.rebuilt == 2
+    body, encoding = response.get_body("gzip, deflate")
+    assert encoding == "gzip"
+    assert gzip.decompress(body) == response.body
+    assert response.get_body("identity") == (response.body, None)
+
+
+def test_only_registered_classes_are_rebuilt(node_classes):
+    cache = ObjectInfoCache(node_info, node_classes)
+    etag = cache.get().etag
+    node_classes["C"] = make_node("C")
+    response = cache.get()
+    assert cache.rebuilt == 3
+    assert list(json.loads(response.body)) == ["A", "B", "C"]
+    assert response.etag != etag
+
+    del node_classes["A"]
+    assert list(json.loads(cache.get().body)) == ["B", "C"]
+    assert cache.rebuilt == 3
+
+
+def test_folder_change_rebuilds_all(node_classes, monkeypatch):
+    cache = ObjectInfoCache(node_info, node_classes)
+    cache.get()
+    monkeypatch.setattr(folder_paths, "get_folder_version", lambda: 1)
+    assert json.loads(cache.get().body)["A"]["calls"] == 2
+    assert cache.rebuilt == 4
+
+
+def test_uncached_classes_are_rebuilt_on_every_request(node_classes):
+    node_classes["C"] = make_node("C", cache_input_types=False)
+    cache = ObjectInfoCache(node_info, node_classes)
+    cache.get()
+    assert json.loads(cache.get().body)["C"]["calls"] == 2
+    assert cache.rebuilt == 4
+
+
+def test_failing_node_is_skipped(node_classes):
+    def failing_node_info(name):
+        if name == "A":
+            raise ValueError("broken node")
+        return node_info(name)
+    cache = ObjectInfoCache(failing_node_info, node_classes)
+    assert list(json.loads(cache.get().body)) == ["B"]
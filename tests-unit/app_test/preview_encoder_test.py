@@ -0,0 +1,41 @@
+import asyncio
+import io
+
+import pytest
+from PIL import Image
+
+from app.preview_encoder import PreviewEncoder, encode_preview, get_preview_format
+
+
+def test_preview_format_negotiation():
+    assert get_preview_format({}, "JPEG", True) == ("JPEG", 95)
+    assert get_preview_format({"preview_format": "webp", "preview_quality": 60}, "JPEG", True) == ("WEBP", 60)
+    # The legacy preview message can't describe webp
+    assert get_preview_format({"preview_format": "webp"}, "JPEG", False) == ("JPEG", 95)
+    assert get_preview_format({"preview_format": "jpeg", "preview_quality": 50}, "PNG", False) == ("JPEG", 50)
+    assert get_preview_format({"preview_format": "gif", "preview_quality": 500}, "PNG", True) == ("PNG", 95)
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG", "WEBP"])
+def test_encode_preview(image_format):
+    data = encode_preview(Image.new("RGB", (256, 128), (255, 0, 0)), 64, image_format, 80)
+    with Image.open(io.BytesIO(data)) as img:
+        assert img.format == image_format
+        assert img.size == (64, 32)
+
+
+@pytest.mark.asyncio
+async def test_newer_frames_supersede_waiting_ones():
+    encoder = PreviewEncoder(max_workers=1)
+    image = Image.new("RGB", (512, 512))
+    results = await asyncio.gather(*[encoder.encode("client", image, 256, "PNG", 95) for _ in range(4)])
+    # The first frame is encoded right away, of the ones waiting for it only the newest is
+    assert [x is not None for x in results] == [True, False, False, True]
+
+
+@pytest.mark.asyncio
+async def test_frames_with_different_keys_are_all_encoded():
+    encoder = PreviewEncoder()
+    image = Image.new("RGB", (64, 64))
+    results = await asyncio.gather(*[encoder.encode(key, image, None, "JPEG", 95) for key in ("a", "b", "c")])
+    assert all(x is not None for x in results)
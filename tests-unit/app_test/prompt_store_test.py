@@ -0,0 +1,86 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database.models import Base
+from app.database import prompt_store
+from app.database.prompt_store import MAX_ATTEMPTS, PromptStore
+
+
+@pytest.fixture
+def create_session(tmp_path):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "comfyui.db"))
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)
+
+
+def make_item(number, prompt_id):
+    return (number, prompt_id, {"1": {"class_type": "SaveImage", "inputs": {}}}, {"client_id": "client"}, ["1"])
+
+
+def test_queue_survives_restart(create_session):
+    store = PromptStore(create_session, max_history_size=10)
+    store.add_queued(make_item(0, "a"), "client")
+    store.add_queued(make_item(1, "b"), "client")
+    store.add_queued(make_item(2, "c"), "client")
+    store.add_queued(make_item(2.5, "d"), "client")
+    store.set_running("a")
+    store.remove_queued(["c"])
+    store.flush()
+
+    restored = PromptStore(create_session, max_history_size=10).load_queue()
+    assert [(item[1], client) for item, client in restored] == [("a", "client"), ("b", "client"), ("d", "client")]
+    assert restored[0][0][2] == make_item(0, "a")[2]
+    numbers = [item[0] for item, _ in restored]
+    assert numbers == [0, 1, 2.5]
+    assert [type(x) for x in numbers] == [int, int, float]
+    assert PromptStore(create_session, max_history_size=10).get_max_number() == 2.5
+
+
+def test_prompts_interrupted_too_often_are_dropped(create_session):
+    store = PromptStore(create_session, max_history_size=10)
+    store.add_queued(make_item(0, "a"), "client")
+    for _ in range(MAX_ATTEMPTS - 1):
+        store.set_running("a")
+        assert len(store.load_queue()) == 1
+    store.set_running("a")
+    assert store.load_queue() == []
+
+
+def test_history_pages(create_session):
+    store = PromptStore(create_session, max_history_size=3)
+    for i in range(5):
+        store.add_queued(make_item(i, str(i)), "client")
+        store.add_history(str(i), "client", {"outputs": {}, "status": {"status_str": "success"}})
+
+    assert list(store.get_history_page()) == ["2", "3", "4"]
+    assert list(store.get_history_page(max_items=2)) == ["3", "4"]
+    assert list(store.get_history_page(max_items=1, offset=1)) == ["3"]
+    assert store.get_history("4") == {"outputs": {}, "status": {"status_str": "success"}}
+    assert store.get_history("0") is None
+    assert store.load_queue() == []
+
+    store.delete_history("4")
+    assert store.get_history("4") is None
+    store.delete_history()
+    assert store.get_history_page() == {}
+
+
+def test_reads_dont_wait_for_the_writer(create_session, monkeypatch):
+    store = PromptStore(create_session, max_history_size=3)
+    store.add_history("0", "client", {"outputs": {}})
+    store.flush()
+    monkeypatch.setattr(prompt_store, "WRITE_INTERVAL", 60)
+    for i in range(1, 4):
+        store.add_history(str(i), "client", {"outputs": {}})
+    store.delete_history("2")
+
+    # Served from the uncommitted changes, on top of the committed entry
+    assert list(store.get_history_page()) == ["0", "1", "3"]
+    assert list(store.get_history_page(max_items=2)) == ["1", "3"]
+    assert list(store.get_history_page(max_items=2, offset=1)) == ["1", "3"]
+    assert store.get_history("3") == {"outputs": {}}
+    assert store.get_history("2") is None
+    assert store.get_history("0") == {"outputs": {}}
+    # Entries without a row id yet are returned by get_history_since() once committed
+    assert list(store.get_history_since(0)[0]) == ["0"]
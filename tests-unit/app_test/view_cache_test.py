@@ -0,0 +1,114 @@
+import asyncio
+import io
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from app import view_cache
+from app.view_cache import ViewCache, etag_matches, get_etag, get_variant
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    path = str(tmp_path / "image.png")
+    Image.new("RGBA", (64, 64), (255, 0, 0, 128)).save(path)
+    return path
+
+
+def test_get_variant():
+    assert get_variant({}) is None
+    assert get_variant({"channel": "rgba"}) is None
+    assert get_variant({"preview": "webp;50"}) == ("preview", "webp", 50, False)
+    assert get_variant({"preview": "jpeg"}) == ("preview", "jpeg", 90, True)
+    assert get_variant({"preview": "png", "channel": "rgb"}) == ("preview", "webp", 90, True)
+    assert get_variant({"channel": "a"}) == ("a",)
+
+
+def test_etag_changes_with_file(image_file):
+    stat = os.stat(image_file)
+    etag = get_etag(image_file, stat, ("a",))
+    assert etag != get_etag(image_file, stat, ("rgb",))
+    Image.new("RGBA", (32, 32)).save(image_file)
+    os.utime(image_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert etag != get_etag(image_file, os.stat(image_file), ("a",))
+
+
+def test_etag_matches():
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches(None, '"b"')
+
+
+def test_variants_are_cached(image_file, tmp_path, monkeypatch):
+    encoded = []
+    encode_variant = view_cache.encode_variant
+
+    def counting_encode(file, variant):
+        encoded.append(variant)
+        return encode_variant(file, variant)
+    monkeypatch.setattr(view_cache, "encode_variant", counting_encode)
+
+    async def run():
+        cache = ViewCache(str(tmp_path / "cache"))
+        stat = os.stat(image_file)
+        variant = ("preview", "webp", 80, False)
+        # Concurrent requests share one encoding
+        results = await asyncio.gather(*[cache.get(image_file, stat, variant) for _ in range(4)])
+        assert len(encoded) == 1
+        assert all(x == results[0] for x in results)
+        with Image.open(io.BytesIO(results[0][0])) as img:
+            assert img.format == "WEBP"
+
+        # Cached on disk for a new cache
+        cache = ViewCache(str(tmp_path / "cache"))
+        data, etag = await cache.get(image_file, stat, variant)
+        assert data == results[0][0]
+        assert len(encoded) == 1
+        assert cache.get_stats()["hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_disk_eviction(image_file, tmp_path):
+    async def run():
+        cache = ViewCache(str(tmp_path / "cache"), max_disk_bytes=1)
+        stat = os.stat(image_file)
+        await cache.get(image_file, stat, ("a",))
+        await cache.get(image_file, stat, ("rgb",))
+        assert cache.get_stats()["disk_entries"] == 1
+        assert os.listdir(str(tmp_path / "cache")) == [get_etag(image_file, stat, ("rgb",)).strip('"')]
+
+    asyncio.run(run())
+
+
+def test_cancelled_request_doesnt_cancel_the_load(image_file, tmp_path, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    encode_variant = view_cache.encode_variant
+
+    def slow_encode(file, variant):
+        started.set()
+        release.wait(5)
+        return encode_variant(file, variant)
+    monkeypatch.setattr(view_cache, "encode_variant", slow_encode)
+
+    async def run():
+        cache = ViewCache(str(tmp_path / "cache"))
+        stat = os.stat(image_file)
+        first = asyncio.create_task(cache.get(image_file, stat, ("a",)))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        second = asyncio.create_task(cache.get(image_file, stat, ("a",)))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+        data, _ = await second
+        assert len(data) > 0
+        # Still stored in memory for the next requests
+        assert await cache.get(image_file, stat, ("a",)) == (data, get_etag(image_file, stat, ("a",)))
+        assert cache.get_stats()["memory_entries"] == 1
+
+    asyncio.run(run())
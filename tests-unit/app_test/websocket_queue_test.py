@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from app.websocket_queue import ClientSendQueue, get_message_key
+from protocol import BinaryEventTypes
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+        # Sends wait until the test allows them
+        self.ready = asyncio.Event()
+
+    async def send_str(self, data):
+        await self.ready.wait()
+        self.sent.append(data)
+
+    async def send_bytes(self, data):
+        await self.ready.wait()
+        self.sent.append(data)
+
+    async def close(self):
+        self.closed = True
+
+
+async def drain(ws):
+    ws.ready.set()
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_message_keys():
+    assert get_message_key("progress", {"prompt_id": "a", "node": "1", "value": 1}) == ("progress", "a", "1")
+    assert get_message_key("progress_state", {"prompt_id": "a", "nodes": {}}) == ("progress_state", "a")
+    assert get_message_key("progress_state", {"prompt_id": "a", "nodes": {}, "delta": True}) is None
+    assert get_message_key("status", {"status": {}}) == ("status",)
+    assert get_message_key(BinaryEventTypes.PREVIEW_IMAGE, b"") == ("preview",)
+    assert get_message_key("executing", {"node": "1"}) is None
+    assert get_message_key("execution_success", {"prompt_id": "a"}) is None
+    assert get_message_key(BinaryEventTypes.TEXT, b"") is None
+
+
+@pytest.mark.asyncio
+async def test_messages_are_sent_in_order():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws)
+    queue.put("a")
+    queue.put(b"b")
+    queue.put("c")
+    await drain(ws)
+    assert ws.sent == ["a", b"b", "c"]
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_newer_progress_supersedes_queued():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws)
+    queue.put("executing", None)
+    queue.put("progress 1", ("progress", "a", "1"))
+    queue.put("progress 2", ("progress", "a", "1"))
+    queue.put("other node", ("progress", "a", "2"))
+    queue.put("executed", None)
+    await drain(ws)
+    assert ws.sent == ["executing", "progress 2", "other node", "executed"]
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_overflow_drops_stale_messages_first():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws, max_size=4)
+    queue.put("preview", ("preview",))
+    queue.put("executing", None)
+    queue.put("progress", ("progress", "a", "1"))
+    queue.put("executed", None)
+    queue.put("execution_success", None)
+    await drain(ws)
+    assert ws.sent == ["executing", "progress", "executed", "execution_success"]
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_terminal_events_are_never_dropped():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws, max_size=2, max_pending=10)
+    for i in range(5):
+        queue.put("executed {}".format(i))
+    queue.put("progress", ("progress", "a", "1"))
+    await drain(ws)
+    assert ws.sent == ["executed {}".format(i) for i in range(5)]
+    assert not ws.closed
+    queue.close()
+
+
+@pytest.mark.asyncio
+async def test_client_that_falls_behind_is_disconnected():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws, max_size=2, max_pending=4)
+    for i in range(6):
+        queue.put("executed {}".format(i))
+    await asyncio.sleep(0)
+    assert queue.closed
+    assert ws.closed
+
+
+@pytest.mark.asyncio
+async def test_messages_wait_for_the_payload_before_them():
+    ws = FakeWebSocket()
+    queue = ClientSendQueue(ws)
+    preview = asyncio.get_running_loop().create_future()
+    skipped = asyncio.get_running_loop().create_future()
+    queue.put("executing 1")
+    queue.put(preview, ("preview",))
+    queue.put("executing 2")
+    await drain(ws)
+    # The preview being encoded keeps its place
+    assert ws.sent == ["executing 1"]
+    preview.set_result(b"preview")
+    await drain(ws)
+    assert ws.sent == ["executing 1", b"preview", "executing 2"]
+    # A preview that wasn't encoded is skipped
+    queue.put(skipped, ("preview",))
+    queue.put("executed")
+    skipped.set_result(None)
+    await drain(ws)
+    assert ws.sent[-1] == "executed"
+    assert len(ws.sent) == 4
+    queue.close()
@@ -0,0 +1,47 @@
+from comfy.metrics import Counter, Gauge, Histogram, render
+
+
+def test_counter():
+    registry = []
+    counter = Counter("test_requests_total", "Requests.", ["result"], registry=registry)
+    counter.inc("hit")
+    counter.inc("hit")
+    counter.inc("miss", amount=3)
+    assert render(registry) == (
+        "# HELP test_requests_total Requests.\n"
+        "# TYPE test_requests_total counter\n"
+        'test_requests_total{result="hit"} 2\n'
+        'test_requests_total{result="miss"} 3\n'
+    )
+
+
+def test_gauge_function():
+    registry = []
+    Gauge("test_bytes", "Bytes.", ["tier"], function=lambda: {"ram": 10, ("disk",): 20}, registry=registry)
+    Gauge("test_depth", "Depth.", function=lambda: 4, registry=registry)
+    lines = render(registry).splitlines()
+    assert 'test_bytes{tier="disk"} 20' in lines
+    assert 'test_bytes{tier="ram"} 10' in lines
+    assert "test_depth 4" in lines
+
+
+def test_histogram():
+    registry = []
+    histogram = Histogram("test_seconds", "Time.", ["class_type"], buckets=(0.1, 1.0), registry=registry)
+    histogram.observe(0.05, "A")
+    histogram.observe(0.5, "A")
+    histogram.observe(1.0, "A")
+    histogram.observe(5.0, "A")
+    lines = render(registry).splitlines()
+    assert 'test_seconds_bucket{class_type="A",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{class_type="A",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{class_type="A",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{class_type="A"} 6.55' in lines
+    assert 'test_seconds_count{class_type="A"} 4' in lines
+
+
+def test_label_escaping():
+    registry = []
+    counter = Counter("test_total", "Test.", ["name"], registry=registry)
+    counter.inc('a "quoted"\nname')
+    assert 'test_total{name="a \\"quoted\\"\\nname"} 1' in render(registry).splitlines()
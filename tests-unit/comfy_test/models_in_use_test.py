@@ -0,0 +1,78 @@
+import contextvars
+import threading
+
+import pytest
+
+try:
+    import comfy.model_management  # noqa: F401
+except Exception:
+    # Importing it initializes the torch device
+    pytest.skip("comfy.model_management can't initialize a torch device without an accelerator", allow_module_level=True)
+
+import comfy.model_management as mm
+
+
+class FakePatcher:
+    def __init__(self, model):
+        self.model = model
+
+    def is_clone(self, other):
+        return hasattr(other, "model") and self.model is other.model
+
+
+class FakeLoadedModel:
+    def __init__(self, patcher):
+        self.model = patcher
+
+
+def run_in_worker(function):
+    """Runs function in a new context, like a prompt worker thread."""
+    return contextvars.Context().run(function)
+
+
+def test_models_of_other_workers_are_reported():
+    patcher = FakePatcher(object())
+
+    def worker_a():
+        mm.register_models_in_use().ids.add(id(patcher))
+        # A worker's own models aren't protected from itself
+        assert id(patcher) not in mm.get_models_used_by_other_workers()
+        return mm.current_models_in_use.get()
+
+    a = run_in_worker(worker_a)
+
+    def worker_b():
+        mm.register_models_in_use()
+        assert id(patcher) in mm.get_models_used_by_other_workers()
+        a.ids.clear()
+        assert id(patcher) not in mm.get_models_used_by_other_workers()
+
+    run_in_worker(worker_b)
+
+
+def test_loading_a_clone_waits_for_release(monkeypatch):
+    weights = object()
+    used = FakePatcher(weights)
+    clone = FakePatcher(weights)
+    monkeypatch.setattr(mm, "current_loaded_models", [FakeLoadedModel(used)])
+    registered = threading.Event()
+    loaded = threading.Event()
+
+    def worker_a():
+        mm.register_models_in_use().ids.add(id(used))
+        registered.set()
+        assert not loaded.wait(0.2)
+        mm.release_models_in_use()
+
+    def worker_b():
+        registered.wait()
+        mm.register_models_in_use()
+        mm.wait_for_clones_in_use({clone})
+        loaded.set()
+
+    threads = [threading.Thread(target=run_in_worker, args=(f,)) for f in (worker_a, worker_b)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert loaded.is_set()
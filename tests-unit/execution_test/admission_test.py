@@ -0,0 +1,87 @@
+from comfy_execution import admission
+from comfy_execution.admission import AdmissionController
+
+
+class FakeQueue:
+    def __init__(self, depth=0, queued_bytes=0, pending=None, average_execution_time=0.0, workers=1):
+        self.depth = depth
+        self.queued_bytes = queued_bytes
+        self.pending = pending or {}
+        self.average_execution_time = average_execution_time
+        self.workers = workers
+
+    def get_queue_depth(self):
+        return self.depth
+
+    def get_queued_bytes(self):
+        return self.queued_bytes
+
+    def get_pending_count(self, owner):
+        return self.pending.get(owner, 0)
+
+    def get_average_execution_time(self):
+        return self.average_execution_time
+
+    def get_worker_count(self):
+        return self.workers
+
+
+def test_no_limits():
+    controller = AdmissionController()
+    queue = FakeQueue(depth=10000, queued_bytes=10 ** 9, pending={"a": 1000})
+    for _ in range(100):
+        assert controller.check(queue, "a", 10 ** 6) is None
+    assert controller.get_stats() == {}
+
+
+def test_queue_size():
+    controller = AdmissionController(max_queue_size=3)
+    assert controller.check(FakeQueue(depth=2), "a", 0) is None
+    rejection = controller.check(FakeQueue(depth=3, average_execution_time=4.2), "a", 0)
+    assert rejection.type == "queue_full"
+    assert rejection.retry_after == 5
+    assert controller.get_stats() == {"queue_full": 1}
+    # With several workers a prompt leaves the queue more often
+    assert controller.check(FakeQueue(depth=3, average_execution_time=4.2, workers=2), "a", 0).retry_after == 3
+
+
+def test_queued_bytes():
+    controller = AdmissionController(max_queued_bytes=1000)
+    assert controller.check(FakeQueue(queued_bytes=500), "a", 500) is None
+    rejection = controller.check(FakeQueue(queued_bytes=500), "a", 501)
+    assert rejection.type == "queue_full"
+    assert rejection.retry_after == 1
+
+
+def test_queued_per_client():
+    controller = AdmissionController(max_queued_per_client=2)
+    queue = FakeQueue(pending={"a": 2, "b": 1})
+    assert controller.check(queue, "a", 0).type == "queue_limit_exceeded"
+    assert controller.check(queue, "b", 0) is None
+
+
+def test_rate_limit(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    controller = AdmissionController(max_prompts_per_minute=3)
+    queue = FakeQueue()
+    # A burst of up to the limit is allowed
+    for _ in range(3):
+        assert controller.check(queue, "a", 0) is None
+    rejection = controller.check(queue, "a", 0)
+    assert rejection.type == "rate_limited"
+    assert rejection.retry_after == 20
+    # Other clients have their own limit
+    assert controller.check(queue, "b", 0) is None
+    # One prompt more can be queued every 20 seconds
+    now[0] += 20
+    assert controller.check(queue, "a", 0) is None
+    assert controller.check(queue, "a", 0).type == "rate_limited"
+    assert controller.get_stats() == {"rate_limited": 2}
+
+
+def test_rejected_prompts_take_no_token(monkeypatch):
+    monkeypatch.setattr(admission.time, "monotonic", lambda: 100.0)
+    controller = AdmissionController(max_queue_size=1, max_prompts_per_minute=1)
+    assert controller.check(FakeQueue(depth=1), "a", 0).type == "queue_full"
+    assert controller.check(FakeQueue(depth=0), "a", 0) is None
@@ -0,0 +1,96 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+# Imported before patching sys.modules, which drops the modules first imported while patched
+import torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+mock_nodes = MagicMock()
+mock_nodes.NODE_CLASS_MAPPINGS = {}
+
+with patch.dict('sys.modules', {'nodes': mock_nodes}):
+    import comfy_execution.caching as caching
+    from comfy_execution.caching import CacheKeySetInputSignature, Unhashable
+    from comfy_execution.graph import DynamicPrompt
+
+
+class StubNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+
+class StubIsChangedCache:
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    async def get(self, node_id):
+        return self.values.get(node_id, False)
+
+
+@pytest.fixture(autouse=True)
+def stub_nodes(monkeypatch):
+    # The real nodes module if comfy_execution.caching was imported before this test module
+    monkeypatch.setitem(caching.nodes.NODE_CLASS_MAPPINGS, "StubNode", StubNode)
+
+
+def node(**inputs):
+    return {"class_type": "StubNode", "inputs": inputs}
+
+
+def get_keys(prompt, is_changed=None):
+    dynprompt = DynamicPrompt(prompt)
+    key_set = CacheKeySetInputSignature(dynprompt, prompt.keys(), StubIsChangedCache(is_changed))
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return key_set
+
+
+def test_identical_subgraphs_share_keys():
+    keys = get_keys({
+        "1": node(value=1),
+        "2": node(a=["1", 0], value=2),
+        "10": node(value=1),
+        "20": node(a=["10", 0], value=2),
+    })
+    assert keys.get_data_key("2") == keys.get_data_key("20")
+    assert isinstance(keys.get_data_key("2"), bytes)
+
+
+def test_changes_propagate_to_descendants():
+    a = get_keys({"1": node(value=1), "2": node(a=["1", 0])})
+    b = get_keys({"1": node(value=5), "2": node(a=["1", 0])})
+    assert a.get_data_key("1") != b.get_data_key("1")
+    assert a.get_data_key("2") != b.get_data_key("2")
+
+
+def test_socket_and_input_name_matter():
+    keys = get_keys({
+        "1": node(value=1),
+        "2": node(a=["1", 0]),
+        "3": node(a=["1", 1]),
+        "4": node(b=["1", 0]),
+    })
+    assert len({keys.get_data_key("2"), keys.get_data_key("3"), keys.get_data_key("4")}) == 3
+
+
+def test_keys_are_stable_across_prompts():
+    prompt = {"1": node(text="a cat", cfg=7.5), "2": node(a=["1", 0], seed=3)}
+    assert get_keys(prompt).get_data_key("2") == get_keys(prompt).get_data_key("2")
+
+
+def test_unhashable_propagates():
+    keys = get_keys({"1": node(value=1), "2": node(a=["1", 0])}, is_changed={"1": float("NaN")})
+    assert isinstance(keys.get_data_key("1"), Unhashable)
+    assert isinstance(keys.get_data_key("2"), Unhashable)
+
+
+def test_deep_graph_does_not_recurse():
+    prompt = {"0": node(value=0)}
+    for i in range(1, 5000):
+        prompt[str(i)] = node(a=[str(i - 1), 0])
+    keys = get_keys(prompt)
+    assert isinstance(keys.get_data_key("4999"), bytes)
@@ -0,0 +1,113 @@
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.caching import Unhashable, signature_digest
+    from comfy_execution.disk_cache import DiskCache, is_persistable, key_digest
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    return DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+
+
+def test_key_digest_uses_signature_digest():
+    digest = signature_digest(["CLIPTextEncode", False, ("text", "a cat")])
+    assert key_digest(digest) == digest.hex()
+
+
+def test_key_digest_rejects_unhashable():
+    assert key_digest(Unhashable()) is None
+    assert key_digest(signature_digest(["Test", float("NaN")])) is None
+    assert key_digest(("1", "CheckpointLoaderSimple")) is None
+
+
+def test_round_trip(disk_cache):
+    samples = torch.arange(16, dtype=torch.float32).reshape(1, 4, 2, 2)
+    conditioning = [[torch.ones(1, 3, 8), {"pooled_output": torch.zeros(1, 8)}]]
+    value = [[{"samples": samples}], [conditioning], [42, "text", None]]
+    digest = key_digest(signature_digest(["Test"]))
+
+    disk_cache.put(digest, value)
+    disk_cache.flush()
+
+    loaded = disk_cache.get(digest)
+    assert torch.equal(loaded[0][0]["samples"], samples)
+    assert torch.equal(loaded[1][0][0][0], conditioning[0][0])
+    assert torch.equal(loaded[1][0][0][1]["pooled_output"], conditioning[0][1]["pooled_output"])
+    assert loaded[2] == [42, "text", None]
+    assert disk_cache.get_stats()["hits"] == 1
+    # Only the put of the output of a node that had to be executed counts as a miss
+    assert disk_cache.get(key_digest(signature_digest(["Other"]))) is None
+    assert disk_cache.get_stats()["misses"] == 1
+
+
+def test_loaded_tensors_are_memory_mapped(disk_cache):
+    value = [[torch.arange(6, dtype=torch.bfloat16).reshape(2, 3), torch.tensor(True), torch.tensor(7, dtype=torch.int8),
+              torch.zeros(0, 4), torch.tensor([1.5, 2.5], dtype=torch.float64)]]
+    digest = key_digest(signature_digest(["Test"]))
+    disk_cache.put(digest, value)
+    disk_cache.flush()
+
+    loaded = disk_cache.get(digest)
+    for original, tensor in zip(value[0], loaded[0]):
+        assert tensor.dtype == original.dtype
+        assert tensor.shape == original.shape
+        assert torch.equal(tensor, original)
+    # Views of the mapped file, not copies
+    assert loaded[0][0].untyped_storage().nbytes() == os.path.getsize(disk_cache._path(digest))
+
+
+def test_survives_restart(tmp_path):
+    digest = key_digest(signature_digest(["Test"]))
+    first = DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+    first.put(digest, [[torch.ones(2, 2)]])
+    first.flush()
+
+    second = DiskCache(str(tmp_path), max_bytes=1024 * 1024)
+    assert torch.equal(second.get(digest)[0][0], torch.ones(2, 2))
+
+
+def test_unpersistable_values_are_skipped(disk_cache):
+    digest = key_digest(signature_digest(["Test"]))
+    disk_cache.put(digest, [[object()]])
+    disk_cache.flush()
+    assert disk_cache.get(digest) is None
+    assert disk_cache.get_stats()["skipped"] == 1
+
+
+def test_persistability_is_checked_before_copying():
+    assert is_persistable([[torch.ones(2), {"a": (1, "b", None)}]])
+    assert not is_persistable([[torch.ones(2), object()]])
+    assert not is_persistable({1: torch.ones(2)})
+
+
+def test_eviction_respects_budget(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=3 * 1024 * 1024)
+    digests = [key_digest(signature_digest(["Test", i])) for i in range(5)]
+    for digest in digests:
+        # ~1MB per entry
+        cache.put(digest, [[torch.zeros(256 * 1024)]])
+        cache.flush()
+
+    stats = cache.get_stats()
+    assert stats["bytes"] <= 3 * 1024 * 1024
+    assert stats["evictions"] >= 2
+    assert cache.get(digests[-1]) is not None
+    assert cache.get(digests[0]) is None
+
+
+def test_budget_is_shared_by_caches_on_the_same_directory(tmp_path):
+    # Like the caches of several execution processes
+    caches = [DiskCache(str(tmp_path), max_bytes=3 * 1024 * 1024) for _ in range(2)]
+    for i in range(6):
+        cache = caches[i % 2]
+        cache.put(key_digest(signature_digest(["Test", i])), [[torch.zeros(256 * 1024)]])
+        cache.flush()
+
+    total = sum(f.stat().st_size for f in tmp_path.iterdir())
+    assert total <= 3 * 1024 * 1024
@@ -0,0 +1,37 @@
+from unittest.mock import MagicMock, patch
+
+# Imported before patching sys.modules, which drops the modules first imported while patched
+import torch  # noqa: F401
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.graph import DynamicPrompt
+
+
+def make_prompt():
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat", "clip": ["1", 1]}},
+        "4": {"class_type": "KSampler", "inputs": {"positive": ["2", 0], "negative": ["3", 0], "seed": 1}},
+    }
+
+
+def test_links_to_duplicates_are_rewired():
+    prompt = make_prompt()
+    dynprompt = DynamicPrompt(prompt)
+    dynprompt.merge_duplicate_nodes({"3": "2"})
+
+    assert dynprompt.get_node("4")["inputs"]["negative"] == ["2", 0]
+    assert dynprompt.get_node("4")["inputs"]["seed"] == 1
+    assert dynprompt.get_duplicates("2") == ["3"]
+    assert dynprompt.get_duplicates("3") == []
+
+
+def test_original_prompt_is_untouched():
+    prompt = make_prompt()
+    dynprompt = DynamicPrompt(prompt)
+    dynprompt.merge_duplicate_nodes({"3": "2"})
+
+    assert prompt["4"]["inputs"]["negative"] == ["3", 0]
+    assert dynprompt.get_original_prompt()["4"]["inputs"]["negative"] == ["3", 0]
@@ -0,0 +1,46 @@
+import pytest
+
+from comfy_execution.fair_queue import DeficitRoundRobin, parse_weights
+
+
+def dispatch(drr, depths, count, blocked=()):
+    depths = dict(depths)
+    order = []
+    for _ in range(count):
+        owner = drr.next_owner(dict.fromkeys(x for x, depth in depths.items() if depth > 0), blocked)
+        if owner is None:
+            break
+        depths[owner] -= 1
+        order.append(owner)
+    return order
+
+
+def test_round_robin_between_clients():
+    drr = DeficitRoundRobin()
+    assert dispatch(drr, {"a": 500, "b": 2}, 5) == ["a", "b", "a", "b", "a"]
+
+
+def test_weights():
+    drr = DeficitRoundRobin({"a": 2, "b": 0.5})
+    order = dispatch(drr, {"a": 100, "b": 100}, 10)
+    assert order.count("a") == 8
+    assert order.count("b") == 2
+
+
+def test_blocked_clients_are_skipped():
+    drr = DeficitRoundRobin()
+    assert dispatch(drr, {"a": 3, "b": 3}, 3, blocked={"a"}) == ["b", "b", "b"]
+    assert drr.next_owner({"a"}, blocked={"a"}) is None
+
+
+def test_estimate_position():
+    drr = DeficitRoundRobin()
+    assert drr.estimate_position("b", 0, {"a": 500, "b": 1}) == 1
+    assert drr.estimate_position("a", 2, {"a": 500, "b": 1}) == 3
+
+
+def test_parse_weights():
+    assert parse_weights("alice=2, bob=0.5") == {"alice": 2.0, "bob": 0.5}
+    assert parse_weights(None) == {}
+    with pytest.raises(ValueError):
+        parse_weights("alice=0")
@@ -0,0 +1,72 @@
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import torch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    import comfy_execution.fingerprint as fingerprint
+    from comfy_execution.caching import Unhashable, signature_digest
+    from comfy_execution.fingerprint import TensorFingerprintMode, get_fingerprint
+
+
+class Fingerprinted:
+    def __init__(self, value):
+        self.value = value
+
+    def __comfy_fingerprint__(self):
+        return {"value": self.value}
+
+
+class SelfFingerprinted:
+    def __comfy_fingerprint__(self):
+        return self
+
+
+def test_tensor_inputs_are_hashable():
+    a = signature_digest(["Node", ("samples", torch.ones(2, 3))])
+    b = signature_digest(["Node", ("samples", torch.ones(2, 3))])
+    assert isinstance(a, bytes)
+    assert a == b
+
+
+def test_tensor_content_dtype_and_shape_matter():
+    base = signature_digest([torch.zeros(6)])
+    assert base != signature_digest([torch.zeros(6).add_(1)])
+    assert base != signature_digest([torch.zeros(6, dtype=torch.float16)])
+    assert base != signature_digest([torch.zeros(2, 3)])
+
+
+def test_dict_of_tensors():
+    a = signature_digest([{"samples": torch.arange(4), "batch_index": [0, 1]}])
+    b = signature_digest([{"batch_index": [0, 1], "samples": torch.arange(4)}])
+    assert a == b
+
+
+def test_numpy_arrays():
+    assert signature_digest([np.arange(8)]) == signature_digest([np.arange(8)])
+    assert signature_digest([np.arange(8)]) != signature_digest([np.arange(8) * 2])
+    assert isinstance(signature_digest([np.array([object()])]), Unhashable)
+
+
+def test_fingerprint_hook():
+    assert signature_digest([Fingerprinted(1)]) == signature_digest([Fingerprinted(1)])
+    assert signature_digest([Fingerprinted(1)]) != signature_digest([Fingerprinted(2)])
+    assert signature_digest([Fingerprinted(1)]) != signature_digest([{"value": 1}])
+    assert isinstance(signature_digest([SelfFingerprinted()]), Unhashable)
+    assert isinstance(signature_digest([object()]), Unhashable)
+
+
+def test_large_tensors_respect_limits(monkeypatch):
+    monkeypatch.setattr(fingerprint, "FULL_HASH_MAX_BYTES", 1024)
+    large = torch.zeros(1024)
+    monkeypatch.setattr(fingerprint, "TENSOR_FINGERPRINT_MODE", TensorFingerprintMode.FULL)
+    assert get_fingerprint(large) is None
+
+    monkeypatch.setattr(fingerprint, "TENSOR_FINGERPRINT_MODE", TensorFingerprintMode.SAMPLED)
+    monkeypatch.setattr(fingerprint, "SAMPLED_HASH_ELEMENTS", 16)
+    assert get_fingerprint(large)[3] == "sampled"
+    assert get_fingerprint(large) == get_fingerprint(torch.zeros(1024))
+
+    monkeypatch.setattr(fingerprint, "TENSOR_FINGERPRINT_MODE", TensorFingerprintMode.NONE)
+    assert get_fingerprint(torch.zeros(4)) is None
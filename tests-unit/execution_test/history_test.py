@@ -0,0 +1,62 @@
+import copy
+import json
+import random
+
+import pytest
+
+from comfy_execution.history import HistoryIndex, freeze
+
+
+def test_entries_are_frozen():
+    history = HistoryIndex()
+    entry = history.add("a", {"prompt": (0, "a", {"1": {"inputs": {}}}, {}, []), "outputs": {"1": {"images": [{"filename": "a.png"}]}}})
+    with pytest.raises(TypeError):
+        entry["outputs"] = {}
+    with pytest.raises(TypeError):
+        entry["prompt"][2]["1"]["inputs"].update(seed=1)
+    assert copy.deepcopy(entry) is entry
+    assert json.loads(json.dumps(entry))["outputs"]["1"]["images"][0]["filename"] == "a.png"
+    with pytest.raises(TypeError):
+        entry["outputs"]["1"]["images"].append({"filename": "b.png"})
+    assert entry["outputs"]["1"]["images"] == [{"filename": "a.png"}]
+    assert isinstance(freeze({"a": [1]})["a"], list)
+    assert freeze({"a": (1, [2])}) == {"a": (1, [2])}
+
+
+def test_pages_match_insertion_order():
+    rng = random.Random(0)
+    history = HistoryIndex()
+    expected = []
+    for i in range(2000):
+        action = rng.random()
+        if action < 0.6 or len(expected) == 0:
+            history.add(str(i), {"i": i})
+            expected.append(str(i))
+        elif action < 0.8:
+            prompt_id = rng.choice(expected)
+            expected.remove(prompt_id)
+            history.remove(prompt_id)
+        else:
+            history.pop_oldest()
+            expected.pop(0)
+
+        if i % 50 == 0:
+            assert len(history) == len(expected)
+            assert list(history.get_page()) == expected
+            assert list(history.get_page(max_items=5)) == expected[-5:]
+            offset = rng.randint(0, len(expected))
+            assert list(history.get_page(max_items=7, offset=offset)) == expected[offset:offset + 7]
+
+
+def test_since_cursor():
+    history = HistoryIndex()
+    assert history.get_since(0) == ({}, 0)
+    for prompt_id in "abc":
+        history.add(prompt_id, {})
+    entries, cursor = history.get_since(0, max_items=2)
+    assert list(entries) == ["a", "b"]
+    history.remove("c")
+    history.add("d", {})
+    entries, cursor = history.get_since(cursor)
+    assert list(entries) == ["d"]
+    assert history.get_since(cursor) == ({}, cursor)
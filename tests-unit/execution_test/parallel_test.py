@@ -0,0 +1,52 @@
+import asyncio
+import threading
+
+import pytest
+import torch
+
+from comfy_execution.parallel import NodeWorkerPool, ResourceClass, get_resource_class, is_offloadable
+from comfy_execution.utils import get_executing_context
+
+
+class DeviceNode:
+    pass
+
+
+class IONode:
+    RESOURCE_CLASS = "io"
+
+
+class UnknownNode:
+    RESOURCE_CLASS = "quantum"
+
+
+def test_resource_class_defaults_to_device():
+    assert get_resource_class(DeviceNode) == ResourceClass.DEVICE
+    assert get_resource_class(UnknownNode) == ResourceClass.DEVICE
+    assert not is_offloadable(DeviceNode)
+
+
+def test_io_nodes_are_offloadable():
+    assert get_resource_class(IONode) == ResourceClass.IO
+    assert is_offloadable(IONode)
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_runs_off_loop():
+    pool = NodeWorkerPool(2)
+    loop_thread = threading.get_ident()
+
+    def f(value):
+        context = get_executing_context()
+        return (value, threading.get_ident(), torch.is_inference_mode_enabled(), context.node_id)
+
+    try:
+        task = pool.submit(f, "prompt", "5", 0, {"value": 3})
+        assert isinstance(task, asyncio.Task)
+        value, thread, inference_mode, node_id = await task
+    finally:
+        pool.shutdown()
+    assert value == 3
+    assert thread != loop_thread
+    assert inference_mode
+    assert node_id == "5"
@@ -0,0 +1,31 @@
+import numpy as np
+from PIL import Image
+
+from comfy_execution.process_executor import SharedImage, restore_payload, share_payload
+
+
+def test_preview_images_are_shared_as_tensors():
+    image = Image.fromarray(np.arange(4 * 4 * 3, dtype=np.uint8).reshape(4, 4, 3))
+    metadata = {"node_id": "3", "prompt_id": "abc"}
+    payload = share_payload((("JPEG", image, 512), metadata))
+
+    shared = payload[0][1]
+    assert isinstance(shared, SharedImage)
+    assert tuple(shared.pixels.shape) == (4, 4, 3)
+
+    restored = restore_payload(payload)
+    assert restored[0][0] == "JPEG"
+    assert restored[0][2] == 512
+    assert restored[1] == metadata
+    assert np.array_equal(np.array(restored[0][1]), np.array(image))
+
+
+def test_palette_images_are_converted():
+    image = Image.new("P", (2, 2))
+    restored = restore_payload(share_payload(image))
+    assert restored.mode == "RGBA"
+
+
+def test_plain_messages_are_unchanged():
+    data = {"node": "5", "display_node": "5", "prompt_id": "abc", "output": {"images": [{"filename": "a.png"}]}}
+    assert restore_payload(share_payload(data)) == data
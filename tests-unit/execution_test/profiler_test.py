@@ -0,0 +1,59 @@
+from unittest.mock import MagicMock, patch
+
+# Imported before patching sys.modules: psutil looks itself up there, so it must stay after
+# patch.dict restores it
+import psutil  # noqa: F401
+import torch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.profiler import PromptProfiler, to_chrome_trace
+
+
+def make_node(class_type, start, wall_time, cached=False):
+    return {
+        "class_type": class_type,
+        "cached": cached,
+        "start": start,
+        "wall_time": wall_time,
+        "cpu_time": 0.0,
+        "ram_start": 0,
+        "ram_peak": 0,
+        "device_memory_peak": None,
+        "output_bytes": 0,
+    }
+
+
+def test_profiler_records_nodes():
+    profiler = PromptProfiler("prompt", torch.device("cpu"))
+    profiler.node_cached("1", "CheckpointLoaderSimple")
+    profiler.node_started("2", "EmptyLatentImage")
+    profiler.node_finished("2", [[{"samples": torch.zeros(1, 4, 8, 8)}]])
+    profiler.node_started("3", "KSampler")
+    profiler.finish()
+
+    result = profiler.get_result()
+    assert result["nodes"]["1"]["cached"]
+    assert result["nodes"]["2"]["output_bytes"] == 4 * 8 * 8 * 4
+    assert result["nodes"]["2"]["ram_peak"] > 0
+    # Unfinished nodes are still reported
+    assert result["nodes"]["3"]["wall_time"] >= 0
+
+
+def test_chrome_trace_puts_overlapping_nodes_on_separate_tracks():
+    profile = {
+        "prompt_id": "prompt",
+        "start": 100.0,
+        "nodes": {
+            "1": make_node("A", 100.0, 1.0),
+            "2": make_node("B", 100.5, 1.0),
+            "3": make_node("C", 101.0, 0.5),
+        },
+    }
+    events = [e for e in to_chrome_trace(profile)["traceEvents"] if e["ph"] == "X"]
+    by_node = {e["args"]["node_id"]: e for e in events}
+    assert by_node["1"]["tid"] == 0
+    assert by_node["2"]["tid"] == 1
+    assert by_node["3"]["tid"] == 0
+    assert by_node["2"]["ts"] == 0.5 * 1e6
+    assert by_node["2"]["dur"] == 1e6
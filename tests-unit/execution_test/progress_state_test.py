@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+from comfy_execution.progress import ProgressRegistry, WebUIProgressHandler
+
+
+class FakeDynamicPrompt:
+    def get_display_node_id(self, node_id):
+        return node_id
+
+    def get_parent_node_id(self, node_id):
+        return None
+
+    def get_real_node_id(self, node_id):
+        return node_id
+
+
+class FakeLoop:
+    def __init__(self):
+        self.scheduled = []
+
+    def call_soon_threadsafe(self, function, *args):
+        function(*args)
+
+    def call_later(self, delay, function):
+        self.scheduled.append(function)
+
+
+class FakeServer:
+    def __init__(self, delta=False):
+        self.client_id = "client"
+        self.sockets_metadata = {"client": {"feature_flags": {"supports_progress_state_delta": delta}}}
+        self.loop = FakeLoop()
+        self.messages = []
+
+    def send_sync(self, event, data, sid=None):
+        self.messages.append((event, data, sid))
+
+
+def make_registry(server, rate):
+    registry = ProgressRegistry("prompt", FakeDynamicPrompt())
+    handler = WebUIProgressHandler(server)
+    handler.interval = 1.0 / rate if rate > 0 else 0.0
+    handler.set_registry(registry)
+    registry.register_handler(handler)
+    return registry, handler
+
+
+def test_only_changed_nodes_are_sent_as_deltas():
+    server = FakeServer(delta=True)
+    registry, _ = make_registry(server, 0)
+    registry.start_progress("1")
+    registry.finish_progress("1")
+    registry.start_progress("2")
+    registry.update_progress("2", 1, 10)
+    nodes = [data["nodes"] for _, data, _ in server.messages]
+    assert all(data["delta"] for _, data, _ in server.messages)
+    assert [list(x.keys()) for x in nodes] == [["1"], ["1"], ["2"], ["2"]]
+    assert nodes[-1]["2"]["value"] == 1
+
+
+def test_clients_without_delta_support_get_every_node():
+    server = FakeServer(delta=False)
+    registry, _ = make_registry(server, 0)
+    registry.start_progress("1")
+    registry.start_progress("2")
+    _, data, sid = server.messages[-1]
+    assert sid == "client"
+    assert "delta" not in data
+    assert set(data["nodes"].keys()) == {"1", "2"}
+
+
+def test_updates_are_coalesced():
+    server = FakeServer(delta=True)
+    registry, _ = make_registry(server, 10)
+    registry.start_progress("1")
+    for i in range(20):
+        registry.update_progress("1", i, 20)
+    # Only the start was sent, the updates wait for the flush
+    assert len(server.messages) == 1
+    assert len(server.loop.scheduled) == 1
+    server.loop.scheduled[0]()
+    assert len(server.messages) == 2
+    assert server.messages[-1][1]["nodes"]["1"]["value"] == 19
+    # The end of the node is sent right away
+    registry.finish_progress("1")
+    assert len(server.messages) == 3
+    assert server.messages[-1][1]["nodes"]["1"]["state"] == "finished"
+
+
+def test_updates_are_flushed_without_an_event_loop():
+    # Like the server proxy of an execution process
+    server = FakeServer(delta=True)
+    del server.loop
+    registry, _ = make_registry(server, 20)
+    registry.start_progress("1")
+    registry.update_progress("1", 1, 10)
+    registry.update_progress("1", 2, 10)
+    assert len(server.messages) == 1
+    deadline = time.monotonic() + 5
+    while len(server.messages) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert server.messages[-1][1]["nodes"]["1"]["value"] == 2
+
+
+@pytest.mark.parametrize("delta", [True, False])
+def test_snapshot_has_every_node(delta):
+    server = FakeServer(delta=delta)
+    registry, handler = make_registry(server, 0)
+    registry.start_progress("1")
+    registry.finish_progress("1")
+    registry.start_progress("2")
+    handler.send_snapshot("other")
+    _, data, sid = server.messages[-1]
+    assert sid == "other"
+    assert "delta" not in data
+    assert set(data["nodes"].keys()) == {"1", "2"}
+    assert data["nodes"]["1"]["state"] == "finished"
@@ -0,0 +1,149 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+try:
+    import comfy.model_management  # noqa: F401
+except Exception:
+    # Importing it initializes the torch device
+    pytest.skip("comfy.model_management can't initialize a torch device without an accelerator", allow_module_level=True)
+
+from comfy.cli_args import args
+from execution import PromptQueue
+from comfy_execution.utils import PromptWorkerContext
+
+
+def make_item(number, prompt_id, extra_data=None):
+    return (number, prompt_id, {}, extra_data or {}, [])
+
+
+def test_history_records_worker():
+    queue = PromptQueue(MagicMock())
+    workers = [PromptWorkerContext("0"), PromptWorkerContext("1")]
+    for worker in workers:
+        queue.register_worker(worker)
+    queue.put(make_item(0, "a"))
+    queue.put(make_item(1, "b"))
+
+    _, first = queue.get(worker=workers[0])
+    _, second = queue.get(worker=workers[1])
+    running = queue.get_running_workers()
+    assert running["a"] is workers[0]
+    assert running["b"] is workers[1]
+
+    queue.task_done(second, {}, status=None)
+    queue.task_done(first, {}, status=None)
+    assert queue.get_history("a")["a"]["worker"] == "0"
+    assert queue.get_history("b")["b"]["worker"] == "1"
+    assert queue.get_running_workers() == {}
+
+
+def test_outputs_of_lazily_validated_prompts_are_stored():
+    queue = PromptQueue(MagicMock())
+    queue.put((0, "a", {}, {}, None))
+    _, item_id = queue.get()
+    queue.set_outputs_to_execute(item_id, ["9"])
+    assert queue.get_current_queue_volatile()[0][0].outputs_to_execute == ["9"]
+    queue.task_done(item_id, {}, status=None)
+    outputs_to_execute = queue.get_history("a")["a"]["prompt"][4]
+    # Stored frozen, but still the list the worker set
+    assert isinstance(outputs_to_execute, list)
+    assert outputs_to_execute == ["9"]
+
+
+def test_flags_delivered_to_every_worker():
+    queue = PromptQueue(MagicMock())
+    workers = [PromptWorkerContext("0"), PromptWorkerContext("1")]
+    for worker in workers:
+        queue.register_worker(worker)
+    queue.set_flag("free_memory", True)
+
+    assert queue.get_flags(worker=workers[0]) == {"free_memory": True}
+    assert queue.get_flags(worker=workers[0]) == {}
+    assert queue.get_flags(worker=workers[1]) == {"free_memory": True}
+
+
+def test_fair_queue_interleaves_clients(monkeypatch):
+    monkeypatch.setattr(args, "fair_queue", True)
+    monkeypatch.setattr(args, "max_running_per_client", 1)
+    queue = PromptQueue(MagicMock())
+    for i in range(3):
+        queue.put(make_item(i, "a{}".format(i)), owner="a")
+    queue.put(make_item(3, "b0"), owner="b")
+    assert queue.estimate_position("b0") == 1
+    assert queue.get_client_depths() == {"a": {"pending": 3, "running": 0}, "b": {"pending": 1, "running": 0}}
+
+    first, first_id = queue.get()
+    second, _ = queue.get()
+    assert (first[1], second[1]) == ("a0", "b0")
+    # Both clients are at their limit of running prompts
+    assert queue.get(timeout=0) is None
+    queue.task_done(first_id, {}, status=None)
+    assert queue.get()[0][1] == "a1"
+
+
+def test_pending_count_per_client():
+    queue = PromptQueue(MagicMock())
+    for i in range(3):
+        queue.put(make_item(i, "a{}".format(i)), owner="a")
+    queue.put(make_item(3, "b0"), owner="b")
+    assert queue.pending_owners == {"a": 3, "b": 1}
+
+    queue.get()
+    queue.delete_queue_item(lambda x: x[1] == "b0")
+    assert queue.pending_owners == {"a": 2}
+    assert queue.get_pending_count("a") == 2
+    queue.wipe_queue()
+    assert queue.pending_owners == {}
+
+
+def test_snapshot_rebuilt_only_after_changes():
+    queue = PromptQueue(MagicMock())
+    queue.put(make_item(1, "b"))
+    queue.put(make_item(0, "a", {"client_id": "c", "api_key_comfy_org": "secret"}))
+    snapshot = queue.get_snapshot()
+    assert queue.get_snapshot() is snapshot
+    assert [x.prompt_id for x in snapshot.pending] == ["a", "b"]
+    assert snapshot.pending[0].extra_data == {"client_id": "c"}
+
+    item, _ = queue.get()
+    assert item.extra_data["api_key_comfy_org"] == "secret"
+    running, pending = queue.get_current_queue()
+    assert [x.prompt_id for x in running] == ["a"]
+    assert [x.prompt_id for x in pending] == ["b"]
+    assert queue.get_snapshot() is not snapshot
+
+
+def make_seed_sweep_item(number, prompt_id, seed, width=512):
+    prompt = {
+        "1": {"class_type": "EmptyLatentImage", "inputs": {"width": width, "height": 512, "batch_size": 1}},
+        "2": {"class_type": "KSampler", "inputs": {"seed": seed, "sampler_name": "euler", "latent_image": ["1", 0]}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": "ComfyUI"}},
+        "4": {"class_type": "PreviewImage", "inputs": {"images": ["1", 0]}},
+    }
+    return (number, prompt_id, prompt, {"client_id": "client"}, ["3"])
+
+
+def test_queue_coalesces_seed_sweeps(monkeypatch):
+    monkeypatch.setattr(args, "seed_sweep_batch_size", 2)
+    queue = PromptQueue(MagicMock())
+    queue.put(make_seed_sweep_item(0, "a", 1))
+    queue.put(make_seed_sweep_item(1, "b", 4, width=768))
+    queue.put(make_seed_sweep_item(2, "c", 2))
+    queue.put(make_seed_sweep_item(3, "d", 3))
+
+    item, task_id = queue.get()
+    sweep = item[3]["seed_sweep"]
+    assert sweep["seeds"] == [1, 2]
+    assert sweep["prompt_ids"] == ["a", "c"]
+    assert [x[1] for x in queue.get_current_queue()[1]] == ["b", "d"]
+
+    history_result = {"outputs": {
+        "3": {"images": [{"filename": "1.png"}, {"filename": "2.png"}]},
+        "4": {"images": [{"filename": "latent.png"}]},
+    }, "meta": {}}
+    queue.task_done(task_id, history_result, status=None)
+    assert queue.get_history("a")["a"]["outputs"]["3"]["images"] == [{"filename": "1.png"}]
+    assert queue.get_history("c")["c"]["outputs"]["3"]["images"] == [{"filename": "2.png"}]
+    assert queue.get_history("c")["c"]["outputs"]["4"]["images"] == [{"filename": "latent.png"}]
+    assert queue.get_history("c")["c"]["prompt"][2]["2"]["inputs"]["seed"] == 2
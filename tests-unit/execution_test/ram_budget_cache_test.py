@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+import torch
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    from comfy_execution.caching import CacheKeySetID, RAMBudgetLRUCache, get_storage_sizes
+    from comfy_execution.graph import DynamicPrompt
+
+
+def make_prompt(node_ids):
+    return DynamicPrompt({node_id: {"class_type": "Stub", "inputs": {}} for node_id in node_ids})
+
+
+def test_storage_sizes_deduplicate_views():
+    t = torch.zeros(1024, dtype=torch.float32)
+    value = [[{"samples": t, "view": t[:10]}], (t.view(32, 32),)]
+    sizes = get_storage_sizes(value)
+    assert len(sizes) == 1
+    assert sum(sizes.values()) == 4096
+
+
+def test_storage_sizes_ignore_non_tensors():
+    assert get_storage_sizes([[1, "a", None, object()]]) == {}
+
+
+@pytest.mark.asyncio
+async def test_evicts_oldest_until_within_budget():
+    cache = RAMBudgetLRUCache(CacheKeySetID, max_bytes=4096 * 2)
+
+    await cache.set_prompt(make_prompt(["1", "2"]), ["1", "2"], None)
+    cache.set("1", [[torch.zeros(1024)]])
+    cache.set("2", [[torch.zeros(1024)]])
+    assert cache.total_bytes == 8192
+
+    await cache.set_prompt(make_prompt(["3"]), ["3"], None)
+    cache.clean_unused()
+    cache.set("3", [[torch.zeros(1024)]])
+    assert cache.total_bytes <= 8192
+    assert len(cache.cache) == 2
+    assert cache.get_entry_sizes()[("3", "Stub")] == 4096
+
+
+@pytest.mark.asyncio
+async def test_current_generation_is_protected():
+    cache = RAMBudgetLRUCache(CacheKeySetID, max_bytes=1024)
+    await cache.set_prompt(make_prompt(["1", "2"]), ["1", "2"], None)
+    cache.set("1", [[torch.zeros(1024)]])
+    cache.set("2", [[torch.zeros(1024)]])
+    # Both outputs are needed by the running prompt, so neither may be dropped yet
+    assert cache.get("1") is not None
+    assert cache.get("2") is not None
+
+
+@pytest.mark.asyncio
+async def test_shared_storage_counted_once():
+    cache = RAMBudgetLRUCache(CacheKeySetID, max_bytes=1024 * 1024)
+    await cache.set_prompt(make_prompt(["1", "2"]), ["1", "2"], None)
+    t = torch.zeros(1024)
+    cache.set("1", [[t]])
+    cache.set("2", [[t[:512]]])
+    assert cache.total_bytes == 4096
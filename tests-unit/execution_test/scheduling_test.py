@@ -0,0 +1,65 @@
+import heapq
+
+import pytest
+
+from comfy_execution import scheduling
+from comfy_execution.scheduling import ModelAffinityScheduler, get_prompt_models
+
+
+class FakeLoadedModel:
+    model = object()
+
+
+def make_item(number, prompt_id, ckpt_name):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": ckpt_name}}}
+    return (number, prompt_id, prompt, {}, [])
+
+
+@pytest.fixture
+def loaded_models(monkeypatch):
+    models = []
+    monkeypatch.setattr(scheduling, "get_loaded_models", lambda: models)
+    return models
+
+
+def run(scheduler, queue, loaded_models, load=False):
+    item = scheduler.choose(queue, "0")
+    queue.remove(item)
+    heapq.heapify(queue)
+    if load:
+        loaded_models.append(FakeLoadedModel())
+    scheduler.prompt_done(item[1])
+    return item[1]
+
+
+def test_prompt_models():
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd15.safetensors"}},
+        "2": {"class_type": "LoraLoader", "inputs": {"lora_name": "style.safetensors", "model": ["1", 0], "strength_model": 1.0}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "a cat"}},
+    }
+    assert get_prompt_models(prompt) == {"sd15.safetensors", "style.safetensors"}
+
+
+def test_prefers_resident_models(loaded_models):
+    scheduler = ModelAffinityScheduler(2)
+    queue = [make_item(0, "a", "A.safetensors"), make_item(1, "b", "B.safetensors"),
+             make_item(2, "c", "A.safetensors"), make_item(3, "d", "B.safetensors")]
+    heapq.heapify(queue)
+
+    assert run(scheduler, queue, loaded_models, load=True) == "a"
+    assert run(scheduler, queue, loaded_models) == "c"
+    stats = scheduler.get_stats()
+    assert stats["prompts_reordered"] == 1
+    assert stats["model_swaps_saved"] == 1
+
+
+def test_passed_over_prompts_are_not_starved(loaded_models):
+    scheduler = ModelAffinityScheduler(1)
+    queue = [make_item(0, "a", "A.safetensors"), make_item(1, "b", "B.safetensors"),
+             make_item(2, "c", "A.safetensors"), make_item(3, "d", "A.safetensors")]
+    heapq.heapify(queue)
+
+    assert run(scheduler, queue, loaded_models, load=True) == "a"
+    assert run(scheduler, queue, loaded_models) == "c"
+    assert run(scheduler, queue, loaded_models) == "b"
@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+# Mock nodes module to prevent CUDA initialization during import
+with patch.dict('sys.modules', {'nodes': MagicMock()}):
+    import comfy_execution.seed_sweep as seed_sweep
+    from comfy_execution.seed_sweep import get_sweep_key, split_history_result
+
+
+class KSampler:
+    SEED_SWEEP_INPUT = "seed"
+
+
+@pytest.fixture(autouse=True)
+def node_classes(monkeypatch):
+    monkeypatch.setattr(seed_sweep.nodes, "NODE_CLASS_MAPPINGS", {"KSampler": KSampler})
+
+
+def make_prompt(seed, sampler_name="euler"):
+    return {
+        "1": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "2": {"class_type": "KSampler", "inputs": {"seed": seed, "sampler_name": sampler_name, "latent_image": ["1", 0]}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": "ComfyUI"}},
+        "4": {"class_type": "PreviewImage", "inputs": {"images": ["1", 0]}},
+    }
+
+
+def make_item(number, prompt_id, prompt, client_id="client"):
+    return (number, prompt_id, prompt, {"client_id": client_id}, ["3"])
+
+
+def test_sweep_key_ignores_only_the_seed():
+    first = get_sweep_key(make_item(0, "a", make_prompt(1)))
+    assert first.seed == 1
+    assert get_sweep_key(make_item(1, "b", make_prompt(2))).key == first.key
+
+    other_prompt = make_prompt(2)
+    other_prompt["1"]["inputs"]["width"] = 768
+    assert get_sweep_key(make_item(1, "b", other_prompt)).key != first.key
+    assert get_sweep_key(make_item(1, "b", make_prompt(2), client_id="other")).key != first.key
+    assert get_sweep_key(make_item(1, "b", make_prompt(2, "euler_ancestral"))) is None
+
+
+def test_split_keeps_outputs_that_cannot_be_divided():
+    sweep = {"node_id": "2", "seeds": [1, 2], "prompts": [make_prompt(1), make_prompt(2)]}
+    results = split_history_result({"outputs": {"3": {"text": ["a", "b", "c"]}}}, sweep)
+    assert results[0]["outputs"]["3"]["text"] == ["a", "b", "c"]
+    assert results[1]["outputs"]["3"]["text"] == ["a", "b", "c"]
@@ -0,0 +1,65 @@
+import pytest
+
+import folder_paths
+from comfy_execution.validation import InputTypesCache, ValidationMemo, freeze_literal
+
+
+class CountingNode:
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        cls.calls += 1
+        return {"required": {"value": ("INT", {"default": 0})}}
+
+
+class DynamicNode(CountingNode):
+    CACHE_INPUT_TYPES = False
+
+
+@pytest.fixture
+def folder_version(monkeypatch):
+    version = [0]
+    monkeypatch.setattr(folder_paths, "get_folder_version", lambda: version[0])
+    return version
+
+
+def test_input_types_cached_until_folder_change(folder_version):
+    CountingNode.calls = 0
+    cache = InputTypesCache()
+    first = cache.get(CountingNode)
+    assert cache.get(CountingNode) is first
+    assert CountingNode.calls == 1
+
+    folder_version[0] += 1
+    cache.get(CountingNode)
+    assert CountingNode.calls == 2
+
+
+def test_input_types_cache_opt_out(folder_version):
+    DynamicNode.calls = 0
+    cache = InputTypesCache()
+    cache.get(DynamicNode)
+    cache.get(DynamicNode)
+    assert DynamicNode.calls == 2
+
+
+def test_freeze_literal_distinguishes_types():
+    assert freeze_literal(1) != freeze_literal(1.0)
+    assert freeze_literal(1) != freeze_literal(True)
+    assert freeze_literal("1") != freeze_literal(1)
+    assert freeze_literal({"__value__": [1, 2]}) == freeze_literal({"__value__": [1, 2]})
+    hash(freeze_literal({"a": [1, {"b": None}]}))
+    with pytest.raises(TypeError):
+        freeze_literal(object())
+
+
+def test_validation_memo_is_bounded():
+    memo = ValidationMemo(max_size=2)
+    memo.set("a", 1)
+    memo.set("b", 2)
+    assert memo.get("a") == 1
+    memo.set("c", 3)
+    assert memo.get("b") is None
+    assert memo.get("a") == 1
+    assert memo.get("c") == 3
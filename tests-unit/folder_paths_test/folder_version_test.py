@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+import folder_paths
+
+
+@pytest.fixture
+def input_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(folder_paths, "FOLDER_CHECK_INTERVAL", 0.0)
+    original = folder_paths.get_input_directory()
+    folder_paths.set_input_directory(str(tmp_path))
+    yield tmp_path
+    folder_paths.set_input_directory(original)
+
+
+def test_version_stable_without_changes(input_dir):
+    version = folder_paths.get_folder_version()
+    assert folder_paths.get_folder_version() == version
+
+
+def test_version_changes_with_input_directory(input_dir):
+    version = folder_paths.get_folder_version()
+    (input_dir / "image.png").write_bytes(b"")
+    # Make sure the change is visible with coarse mtime resolution
+    os.utime(input_dir, (0, 0))
+    assert folder_paths.get_folder_version() != version
+
+
+def test_version_changes_on_notify(input_dir):
+    version = folder_paths.get_folder_version()
+    folder_paths.notify_folder_changed()
+    assert folder_paths.get_folder_version() != version
@@ -0,0 +1,48 @@
+import asyncio
+import json
+
+import pytest
+
+try:
+    import comfy.model_management  # noqa: F401
+except Exception:
+    # Importing it initializes the torch device
+    pytest.skip("comfy.model_management can't initialize a torch device without an accelerator", allow_module_level=True)
+
+# Imported before server like in main.py: importing nodes puts comfy/ first on sys.path,
+# where utils would be comfy/utils.py
+import utils.install_util  # noqa: F401
+from app.websocket_queue import WEBSOCKET_DROPPED
+from server import PromptServer
+
+
+class FakeSendQueue:
+    def __init__(self):
+        self.messages = []
+
+    def put(self, payload, key=None):
+        self.messages.append(payload)
+
+
+@pytest.mark.asyncio
+async def test_messages_to_unknown_clients_are_dropped():
+    server = PromptServer.__new__(PromptServer)
+    server.messages = asyncio.Queue()
+    send_queue = FakeSendQueue()
+    server.socket_queues = {"a": send_queue}
+    dropped = WEBSOCKET_DROPPED.values.get(("disconnected",), 0)
+    task = asyncio.create_task(server.publish_loop())
+    try:
+        server.messages.put_nowait(("status", {"n": 1}, "unknown"))
+        server.messages.put_nowait(("status", {"n": 2}, "a"))
+        for _ in range(10):
+            if len(send_queue.messages) > 0:
+                break
+            await asyncio.sleep(0)
+
+        # The loop keeps running and delivers the messages after the dropped one
+        assert not task.done()
+        assert [json.loads(x)["data"] for x in send_queue.messages] == [{"n": 2}]
+        assert WEBSOCKET_DROPPED.values[("disconnected",)] == dropped + 1
+    finally:
+        task.cancel()
@@ -0,0 +1,68 @@
+"""
+Benchmarks cache key generation for large synthetic graphs.
+
+Run with: pytest tests/benchmark -m benchmark
+"""
+import asyncio
+import random
+import time
+
+import pytest
+
+import nodes
+from comfy_execution.caching import CacheKeySetInputSignature
+from comfy_execution.graph import DynamicPrompt
+
+
+class StubNode:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+    RETURN_TYPES = ("INT",)
+    FUNCTION = "run"
+
+
+class StubIsChangedCache:
+    async def get(self, node_id):
+        return False
+
+
+def deep_graph(size):
+    prompt = {"0": {"class_type": "StubNode", "inputs": {"value": 0}}}
+    for i in range(1, size):
+        prompt[str(i)] = {"class_type": "StubNode", "inputs": {"a": [str(i - 1), 0], "value": i % 7}}
+    return prompt
+
+
+def wide_graph(size, fan_in=8, seed=0):
+    rng = random.Random(seed)
+    prompt = {}
+    for i in range(size):
+        inputs = {"value": i % 13, "text": "a photo of a cat " * 4}
+        for j in range(min(i, fan_in)):
+            inputs[f"in{j}"] = [str(rng.randrange(i)), 0]
+        prompt[str(i)] = {"class_type": "StubNode", "inputs": inputs}
+    return prompt
+
+
+def time_keys(prompt):
+    dynprompt = DynamicPrompt(prompt)
+    key_set = CacheKeySetInputSignature(dynprompt, prompt.keys(), StubIsChangedCache())
+    start = time.perf_counter()
+    asyncio.run(key_set.add_keys(prompt.keys()))
+    return time.perf_counter() - start
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("builder", [deep_graph, wide_graph])
+def test_signature_scaling(builder, monkeypatch, skip_timing_checks):
+    monkeypatch.setitem(nodes.NODE_CLASS_MAPPINGS, "StubNode", StubNode)
+    results = {}
+    for size in (500, 1000, 2000, 4000):
+        results[size] = time_keys(builder(size))
+        print(f"{builder.__name__} {size:5d} nodes: {results[size] * 1000:8.2f} ms ({results[size] / size * 1e6:.1f} us/node)")  # noqa: T201
+
+    if not skip_timing_checks:
+        # Key generation should grow roughly linearly with the number of nodes
+        assert results[4000] < results[1000] * 8
@@ -0,0 +1,201 @@
+"""
+Load test of the server: starts ComfyUI with the stub testing nodes, connects many websocket
+clients and sends concurrent /prompt, /queue, /history, /view and /object_info requests.
+Reports the p50/p95/p99 latency of every endpoint, the event loop lag of the server and the
+websocket messages received per second.
+
+Run with: pytest tests/benchmark/test_server_load.py -m benchmark
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+import pytest
+
+from comfy_execution.graph_utils import GraphBuilder
+
+WEBSOCKET_CLIENTS = 50
+# Concurrent loops sending requests to each endpoint
+PROMPT_SENDERS = 4
+READERS = 4
+DURATION = 20.0
+STARTUP_TIMEOUT = 120.0
+
+
+def percentile(values, p):
+    if len(values) == 0:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def stub_prompt(index):
+    g = GraphBuilder(prefix="load")
+    # Different sizes so that most prompts aren't fully cached
+    image = g.node("StubImage", content="NOISE", height=32 + index % 256, width=32, batch_size=1)
+    g.node("PreviewImage", images=image.out(0))
+    return g.finalize()
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.messages = 0
+        self.completed = []
+
+    def record(self, name, start, ok):
+        self.latencies.setdefault(name, []).append(time.perf_counter() - start)
+        if not ok:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, duration, loop_lag):
+        lines = ["{:<16} {:>8} {:>8} {:>10} {:>10} {:>10}".format("endpoint", "requests", "errors", "p50 ms", "p95 ms", "p99 ms")]
+        for name, values in sorted(self.latencies.items()) + [("prompt done", self.completed)]:
+            lines.append("{:<16} {:>8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                name, len(values), self.errors.get(name, 0),
+                percentile(values, 50) * 1000, percentile(values, 95) * 1000, percentile(values, 99) * 1000))
+        lines.append("event loop lag   p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+            percentile(loop_lag, 50) * 1000, percentile(loop_lag, 99) * 1000, max(loop_lag, default=0) * 1000))
+        lines.append("websocket        {:.1f} messages/s to {} clients".format(self.messages / duration, WEBSOCKET_CLIENTS))
+        return "\n".join(lines)
+
+
+async def websocket_client(session, base_url, client_id, stats, sent_at, stop):
+    start = time.perf_counter()
+    async with session.ws_connect("{}/ws?clientId={}".format(base_url, client_id)) as ws:
+        stats.record("ws connect", start, True)
+        while not stop.is_set():
+            try:
+                msg = await ws.receive(timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                stats.messages += 1
+                data = msg.json()
+                if data["type"] == "executing" and data["data"]["node"] is None:
+                    prompt_id = data["data"].get("prompt_id", None)
+                    if prompt_id in sent_at:
+                        stats.completed.append(time.perf_counter() - sent_at.pop(prompt_id))
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                stats.messages += 1
+            elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                break
+
+
+async def request_loop(session, name, stats, stop, make_request):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            async with make_request(session) as response:
+                await response.read()
+                stats.record(name, start, response.status in (200, 304))
+        except aiohttp.ClientError:
+            stats.record(name, start, False)
+
+
+async def prompt_loop(session, base_url, client_ids, stats, sent_at, stop, index):
+    i = 0
+    while not stop.is_set():
+        prompt_id = uuid.uuid4().hex
+        data = {"prompt": stub_prompt(index * 1000000 + i), "prompt_id": prompt_id, "client_id": client_ids[i % len(client_ids)]}
+        i += 1
+        start = time.perf_counter()
+        sent_at[prompt_id] = start
+        try:
+            async with session.post(base_url + "/prompt", json=data) as response:
+                await response.read()
+                stats.record("/prompt", start, response.status == 200)
+        except aiohttp.ClientError:
+            stats.record("/prompt", start, False)
+        # Keeps the queue from growing without bound when prompts are queued faster than they run
+        await asyncio.sleep(0.05)
+
+
+async def run_load(base_url):
+    stats = Stats()
+    stop = asyncio.Event()
+    sent_at = {}
+    client_ids = [uuid.uuid4().hex for _ in range(WEBSOCKET_CLIENTS)]
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # A preview image to request from /view
+        warmup_id = uuid.uuid4().hex
+        async with session.post(base_url + "/prompt", json={"prompt": stub_prompt(0), "prompt_id": warmup_id}) as response:
+            assert response.status == 200
+        image = None
+        while image is None:
+            await asyncio.sleep(0.2)
+            async with session.get("{}/history/{}".format(base_url, warmup_id)) as response:
+                history = await response.json()
+            for output in history.get(warmup_id, {}).get("outputs", {}).values():
+                image = output["images"][0]
+        view_params = {"filename": image["filename"], "subfolder": image["subfolder"], "type": image["type"]}
+
+        tasks = [asyncio.create_task(websocket_client(session, base_url, x, stats, sent_at, stop)) for x in client_ids]
+        tasks += [asyncio.create_task(prompt_loop(session, base_url, client_ids, stats, sent_at, stop, i)) for i in range(PROMPT_SENDERS)]
+        endpoints = {
+            "/queue": lambda s: s.get(base_url + "/queue"),
+            "/history": lambda s: s.get(base_url + "/history", params={"max_items": "64"}),
+            "/view": lambda s: s.get(base_url + "/view", params=view_params),
+            "/object_info": lambda s: s.get(base_url + "/object_info"),
+        }
+        for name, make_request in endpoints.items():
+            tasks += [asyncio.create_task(request_loop(session, name, stats, stop, make_request)) for _ in range(READERS)]
+
+        await asyncio.sleep(DURATION)
+        stop.set()
+        await asyncio.gather(*tasks)
+
+        async with session.get(base_url + "/internal/loop_lag") as response:
+            samples = (await response.json())["samples"]
+        loop_lag = samples[-int(DURATION / 0.1):]
+    return stats, loop_lag
+
+
+@pytest.fixture(scope="module")
+def server_url(args_pytest):
+    pargs = [
+        sys.executable, 'main.py',
+        '--output-directory', args_pytest["output_dir"],
+        '--listen', args_pytest["listen"],
+        '--port', str(args_pytest["port"]),
+        '--extra-model-paths-config', 'tests/execution/extra_model_paths.yaml',
+        '--cpu',
+    ]
+    p = subprocess.Popen(pargs, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, "PYTHONUNBUFFERED": "1"})
+    url = "http://{}:{}".format(args_pytest["listen"], args_pytest["port"])
+
+    async def wait_ready():
+        deadline = time.perf_counter() + STARTUP_TIMEOUT
+        async with aiohttp.ClientSession() as session:
+            while time.perf_counter() < deadline:
+                try:
+                    async with session.get(url + "/queue") as response:
+                        if response.status == 200:
+                            return True
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.5)
+        return False
+
+    try:
+        assert asyncio.run(wait_ready()), "The server didn't start"
+        yield url
+    finally:
+        p.kill()
+        p.wait()
+
+
+@pytest.mark.benchmark
+def test_server_load(server_url):
+    stats, loop_lag = asyncio.run(run_load(server_url))
+    print()  # noqa: T201
+    print(stats.report(DURATION, loop_lag))  # noqa: T201
+
+    assert stats.errors == {}
+    assert len(stats.latencies["/prompt"]) > 0